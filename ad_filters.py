@@ -0,0 +1,149 @@
+import re
+from dataclasses import dataclass, field, asdict
+from typing import Any, Dict, List, Optional
+
+from parser import Ad
+
+
+@dataclass
+class AdFilter:
+    """
+    Фильтр объявлений одной категории.
+
+    Часть условий уходит прямо в запрос к Kufar (server_params) — цена в BYN,
+    регион и текст поиска, — чтобы лишние объявления вообще не приходили.
+    Остальное (слова, исключения, регулярка, цена в USD) проверяется
+    локально в CompiledFilter за один проход.
+
+    Цены — в тех же единицах, что price_byn / price_usd в ответе Kufar.
+    """
+    price_min: Optional[float] = None
+    price_max: Optional[float] = None
+    currency: str = "byn"                              # byn | usd — к какой цене относятся границы
+    region: Optional[int] = None                       # код области Kufar (rgn), например 7 — Минск
+    query: Optional[str] = None                        # текст поиска на стороне Kufar
+    keywords: List[str] = field(default_factory=list)  # хоть одно слово должно быть в заголовке
+    exclude: List[str] = field(default_factory=list)   # ни одного из этих слов
+    regex: Optional[str] = None                        # заголовок должен совпасть
+
+    @property
+    def is_empty(self) -> bool:
+        return self == AdFilter()
+
+    def server_params(self) -> Dict[str, Any]:
+        """Параметры поиска Kufar для этого фильтра."""
+        params = {}
+        if self.currency == "byn" and (self.price_min is not None or self.price_max is not None):
+            lo = "" if self.price_min is None else f"{self.price_min:.0f}"
+            hi = "" if self.price_max is None else f"{self.price_max:.0f}"
+            params["prc"] = f"r:{lo},{hi}"
+        if self.region is not None:
+            params["rgn"] = self.region
+        if self.query:
+            params["query"] = self.query
+        return params
+
+    def compile(self, check_query: bool = True) -> "CompiledFilter":
+        """
+        check_query=False — запрос к Kufar ушёл с server_params этого фильтра,
+        и query уже проверен на стороне Kufar (у него поиск шире заголовка).
+        """
+        return CompiledFilter(self, check_query)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "AdFilter":
+        known = {k: v for k, v in data.items() if k in cls.__dataclass_fields__}
+        return cls(**known)
+
+    def describe(self) -> str:
+        """Человекочитаемое описание для бота."""
+        if self.is_empty:
+            return "без фильтров"
+        parts = []
+        if self.price_min is not None or self.price_max is not None:
+            unit = "Br" if self.currency == "byn" else "$"
+            lo = "…" if self.price_min is None else f"{self.price_min:.0f}"
+            hi = "…" if self.price_max is None else f"{self.price_max:.0f}"
+            parts.append(f"цена {lo}–{hi} {unit}")
+        if self.region is not None:
+            parts.append(f"регион {self.region}")
+        if self.query:
+            parts.append(f"поиск «{self.query}»")
+        if self.keywords:
+            parts.append("слова: " + ", ".join(self.keywords))
+        if self.exclude:
+            parts.append("кроме: " + ", ".join(self.exclude))
+        if self.regex:
+            parts.append(f"regex /{self.regex}/")
+        return "; ".join(parts)
+
+
+class CompiledFilter:
+    """Скомпилированный фильтр: все локальные проверки за один проход по объявлению."""
+
+    __slots__ = ("_filter", "_query", "_keywords", "_exclude", "_regex", "_price_attr")
+
+    def __init__(self, ad_filter: AdFilter, check_query: bool = True):
+        self._filter = ad_filter
+        # Без серверного поиска query проверяется по заголовку: каждое слово запроса
+        self._query = _query_words(ad_filter.query) if check_query else None
+        self._keywords = _words_re(ad_filter.keywords)
+        self._exclude = _words_re(ad_filter.exclude)
+        self._regex = re.compile(ad_filter.regex, re.IGNORECASE) if ad_filter.regex else None
+        self._price_attr = "price_usd" if ad_filter.currency == "usd" else "price_byn"
+
+    def matches(self, ad: Ad) -> bool:
+        f = self._filter
+
+        if f.price_min is not None or f.price_max is not None:
+            price = _to_number(getattr(ad, self._price_attr))
+            if price is None:
+                return False
+            if f.price_min is not None and price < f.price_min:
+                return False
+            if f.price_max is not None and price > f.price_max:
+                return False
+
+        if f.region is not None and ad.region is not None and ad.region != f.region:
+            return False
+
+        title = ad.title or ""
+        if self._query:
+            normalized = _normalize(title)
+            if not all(word in normalized for word in self._query):
+                return False
+        if self._keywords is not None and not self._keywords.search(title):
+            return False
+        if self._exclude is not None and self._exclude.search(title):
+            return False
+        if self._regex is not None and not self._regex.search(title):
+            return False
+        return True
+
+
+def _words_re(words: List[str]) -> Optional["re.Pattern"]:
+    """Одна регулярка-альтернатива на весь набор слов."""
+    words = [w for w in words if w]
+    if not words:
+        return None
+    return re.compile("|".join(re.escape(w) for w in words), re.IGNORECASE)
+
+
+def _query_words(query: Optional[str]) -> Optional[List[str]]:
+    return re.findall(r"\w+", _normalize(query)) if query else None
+
+
+def _normalize(text: str) -> str:
+    return text.lower().replace("ё", "е")
+
+
+def _to_number(value) -> Optional[float]:
+    if value in (None, "", "0"):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
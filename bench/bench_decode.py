@@ -0,0 +1,86 @@
+"""
+Бенчмарк разбора ответа Kufar: JSON → записи объявлений.
+
+Сравнивает старый путь (stdlib json + словарь на каждое объявление)
+с текущим (parser._json_loads + Ad со __slots__) на ответах из
+bench/fixtures (в репозитории — синтетические, настоящие пишет bench/record.py). Считает CPU на один скан и память: пик аллокаций
+во время разбора и сколько занимают сами записи после него.
+
+Запуск из корня репозитория:
+    python bench/bench_decode.py [-n 200]
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import parser as kufar_parser  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "search_*.json")
+
+
+def legacy_decode(raw: bytes):
+    """Как было: полный json.loads и словарь с готовой строкой цены."""
+    data = json.loads(raw)
+    ads = []
+    for item in data.get("ads", []):
+        ad_id = item.get("ad_id")
+        if not ad_id:
+            continue
+        ads.append({
+            "id": ad_id,
+            "title": item.get("subject", "Без названия"),
+            "price": kufar_parser._format_price(item.get("price_byn"), item.get("price_usd")),
+            "url": f"https://www.kufar.by/item/{ad_id}",
+        })
+    return ads
+
+
+def current_decode(raw: bytes):
+    """Как сейчас: быстрый бэкенд JSON и компактные Ad."""
+    return kufar_parser._parse_response(kufar_parser._json_loads(raw))
+
+
+def cpu_per_scan(decode, pages, rounds: int) -> float:
+    started = time.process_time()
+    for _ in range(rounds):
+        for raw in pages:
+            decode(raw)
+    return (time.process_time() - started) / rounds
+
+
+def memory(decode, pages):
+    """(пик аллокаций за скан, размер результата) в байтах."""
+    tracemalloc.start()
+    results = [decode(raw) for raw in pages]
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del results
+    return peak, retained
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("-n", "--rounds", type=int, default=200, help="сколько раз прогнать все фикстуры")
+    args = ap.parse_args()
+
+    paths = sorted(glob.glob(FIXTURES))
+    pages = [open(p, "rb").read() for p in paths]
+    total_ads = sum(len(current_decode(raw)) for raw in pages)
+    print(f"Фикстуры: {len(pages)} стр., {total_ads} объявлений, "
+          f"{sum(map(len, pages)) / 1024:.0f} КБ; JSON-бэкенд: {kufar_parser.JSON_BACKEND}")
+
+    print(f"{'':10} {'CPU/скан':>10} {'пик памяти':>12} {'результат':>11}")
+    for name, decode in (("было", legacy_decode), ("стало", current_decode)):
+        cpu = cpu_per_scan(decode, pages, args.rounds)
+        peak, retained = memory(decode, pages)
+        print(f"{name:10} {cpu * 1e3:>8.2f}мс {peak / 1024:>10.0f}КБ {retained / 1024:>9.1f}КБ")
+
+
+if __name__ == "__main__":
+    main()
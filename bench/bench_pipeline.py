@@ -0,0 +1,190 @@
+"""
+Нагрузочный бенчмарк пайплайна скан → дедуп → уведомление.
+
+Поднимает FakeKufar и FakeBot (bench/fakes.py) и гоняет настоящие
+KufarClient, ScanScheduler, BotState и NotifyQueue против них — без
+kufar.by и Telegram. Для каждой комбинации числа категорий и темпа
+публикаций печатает:
+    сканов/с, p50 / p99 задержки «опубликовано → уведомление»,
+    CPU на скан, пик памяти, записи состояния (хранилище + очередь).
+
+CPU считается по всему процессу, то есть вместе с заглушками — сравнивать
+имеет смысл прогоны между собой, а не с продакшеном.
+
+Запуск из корня репозитория:
+    python bench/bench_pipeline.py --categories 1,4,16 --rates 6,60 --duration 20
+"""
+import argparse
+import asyncio
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+import parser as kufar_parser  # noqa: E402
+from fakes import FakeBot, FakeKufar  # noqa: E402
+from notifier import NotifyQueue  # noqa: E402
+from parser import Ad  # noqa: E402
+from scheduler import ScanScheduler  # noqa: E402
+from state import BotState  # noqa: E402
+
+FIRST_CATEGORY = 900_000
+
+
+class _App:
+    """Минимум от telegram.ext.Application, который нужен планировщику."""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.bot_data: Dict = {}
+
+
+def _count_calls(obj, name: str, counter: Counter):
+    original = getattr(obj, name)
+
+    def wrapper(*args, **kwargs):
+        counter[name] += 1
+        return original(*args, **kwargs)
+
+    setattr(obj, name, wrapper)
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run_once(args, categories: int, rate: float, workdir: str) -> Dict:
+    # Каждый прогон — с чистого листа в своей папке
+    for name in ("STATE_DB_FILE", "STATE_FILE", "SEEN_JOURNAL_FILE", "NOTIFY_QUEUE_FILE", "NOTIFY_QUEUE_JOURNAL_FILE"):
+        setattr(config, name, os.path.join(workdir, os.path.basename(getattr(config, name))))
+
+    category_ids = list(range(FIRST_CATEGORY, FIRST_CATEGORY + categories))
+    cats = [config.CategoryConfig(c, args.interval_min, args.interval_max) for c in category_ids]
+
+    writes = Counter()
+    state = BotState()
+    for chat_id in range(1, args.chats + 1):
+        sub = state.subscription(chat_id)
+        sub.categories = list(category_ids)
+        state.set_active(chat_id)
+    _count_calls(state._store, "save", writes)
+    _count_calls(state._store, "save_subscription", writes)
+    _count_calls(state._store, "append_seen", writes)
+
+    queue = NotifyQueue(executor=state.writer)
+    _count_calls(queue, "_write", writes)
+    bot = FakeBot(latency=args.latency, chat_rps=args.tg_chat_rps, global_rps=args.tg_global_rps)
+    app = _App(bot)
+
+    async with FakeKufar(category_ids, rate, error_rate=args.error_rate, seed=args.seed) as fake:
+        kufar_parser.KUFAR_API_URL = fake.url
+        # Выдача на старте уже «видена» — меряем установившийся режим, а не первый скан
+        for category_id in category_ids:
+            for ad_id in fake.ids(category_id):
+                state.add_seen(category_id, Ad(ad_id, ""))
+        state.flush_seen()
+        await state.flush()
+        writes.clear()
+        async with kufar_parser.KufarClient() as kufar:
+            app.bot_data.update(state=state, kufar=kufar, notify_queue=queue)
+            scheduler = ScanScheduler(app, cats)
+
+            if args.memory:
+                tracemalloc.start()
+            cpu_started, started = time.process_time(), time.monotonic()
+            tasks = [asyncio.create_task(scheduler.run()), asyncio.create_task(queue.run(bot))]
+            await asyncio.sleep(args.duration)
+            cpu, elapsed = time.process_time() - cpu_started, time.monotonic() - started
+            traced_peak = tracemalloc.get_traced_memory()[1] if args.memory else None
+            if args.memory:
+                tracemalloc.stop()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    scans = sum(s.scans for s in scheduler._scanners.values())
+    latencies = [
+        msg.sent_at - fake.posted_at[ad_id]
+        for msg in bot.sent
+        for ad_id in msg.ad_ids
+        if fake.posted_at.get(ad_id, float("-inf")) >= started
+    ]
+    await queue.close()
+    await state.close()
+    return {
+        "categories": categories,
+        "rate": rate,
+        "scans_per_sec": scans / elapsed,
+        "requests": fake.requests,
+        "delivered": len(latencies),
+        "p50": _percentile(latencies, 0.50),
+        "p99": _percentile(latencies, 0.99),
+        "cpu_per_scan": cpu / scans if scans else float("nan"),
+        "traced_peak": traced_peak,
+        "writes": writes,
+        "throttled": bot.throttled,
+        "photos": (bot.uploads, bot.reused),
+    }
+
+
+def print_row(r: Dict):
+    writes = r["writes"]
+    memory = f"{r['traced_peak'] / 1024:>7.0f}КБ" if r["traced_peak"] is not None else "       —"
+    print(
+        f"{r['categories']:>5} {r['rate']:>7g} {r['scans_per_sec']:>8.2f} {r['requests']:>6} "
+        f"{r['delivered']:>6} {r['p50']:>7.2f}с {r['p99']:>7.2f}с {r['cpu_per_scan'] * 1e3:>8.2f}мс "
+        f"{memory} {writes['append_seen']:>6} {writes['_write']:>6} {r['throttled']:>5}"
+        + (f" фото: {r['photos'][0]} загружено, {r['photos'][1]} по file_id" if any(r["photos"]) else "")
+    )
+
+
+async def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--categories", default="1,4", help="числа категорий через запятую")
+    ap.add_argument("--rates", default="6,60", help="публикаций в минуту на категорию, через запятую")
+    ap.add_argument("--duration", type=float, default=15, help="секунд на прогон")
+    ap.add_argument("--chats", type=int, default=1, help="сколько чатов подписано на все категории")
+    ap.add_argument("--interval-min", type=int, default=1, help="минимальный интервал скана, сек")
+    ap.add_argument("--interval-max", type=int, default=2, help="максимальный интервал скана, сек")
+    ap.add_argument("--latency", type=float, default=0.05, help="задержка FakeBot на сообщение, сек")
+    ap.add_argument("--tg-chat-rps", type=float, default=1, help="лимит FakeBot на чат (как у Telegram)")
+    ap.add_argument("--tg-global-rps", type=float, default=30, help="лимит FakeBot на бота")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 503 от FakeKufar")
+    ap.add_argument("--backend", choices=("sqlite", "json"), default=config.STATE_BACKEND)
+    ap.add_argument("--photos", action="store_true", help="уведомления с фото (NOTIFY_PHOTOS)")
+    ap.add_argument("--memory", action="store_true", help="мерить пик аллокаций (tracemalloc, медленнее)")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    config.STATE_BACKEND = args.backend
+    config.SCAN_RPS = 1000
+    config.SCAN_CONCURRENCY = 8
+    config.NOTIFY_CHAT_RPS = args.tg_chat_rps
+    config.NOTIFY_GLOBAL_RPS = args.tg_global_rps
+    config.NOTIFY_PHOTOS = args.photos
+
+    print(f"Хранилище: {args.backend}; JSON-бэкенд: {kufar_parser.JSON_BACKEND}; "
+          f"{args.duration:g}с на прогон, чатов: {args.chats}")
+    print(f"{'кат.':>5} {'пуб/мин':>7} {'скан/с':>8} {'запр.':>6} {'дост.':>6} {'p50':>8} {'p99':>8} "
+          f"{'CPU/скан':>10} {'пик':>9} {'seen':>6} {'очер.':>6} {'429':>5}")
+    for categories in (int(x) for x in args.categories.split(",")):
+        for rate in (float(x) for x in args.rates.split(",")):
+            with tempfile.TemporaryDirectory() as workdir:
+                print_row(await run_once(args, categories, rate, workdir))
+    print(f"Пик RSS процесса: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} МБ")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,74 @@
+"""
+Память и время AdTracker (tracking.py) на большом числе объявлений.
+
+Заполняет трекер N синтетическими объявлениями (пачками по 50, как страница
+Kufar) и печатает, сколько памяти заняли снимки по tracemalloc, и сколько
+стоит сверка одной страницы, когда трекер полон.
+
+Запуск из корня репозитория:
+    python bench/bench_tracking.py --ads 100000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parser import Ad  # noqa: E402
+from tracking import AdTracker  # noqa: E402
+
+PAGE_SIZE = 50
+
+
+def make_ads(count: int, seed: int):
+    rnd = random.Random(seed)
+    return [
+        Ad(
+            300_000_000 + i,
+            f"Объявление {rnd.randrange(10 ** 9)}",
+            str(rnd.randrange(1, 10 ** 6)),
+            None,
+            None,
+            None,
+            rnd.randrange(1, 5_000_000),
+        )
+        for i in range(count)
+    ]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--ads", type=int, default=100_000, help="сколько объявлений отслеживать")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    ads = make_ads(args.ads, args.seed)
+    pages = [ads[i:i + PAGE_SIZE] for i in range(0, len(ads), PAGE_SIZE)]
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    tracker = AdTracker(capacity=args.ads, ttl=86400)
+    started = time.perf_counter()
+    for page in pages:
+        tracker.diff(page)
+    fill = time.perf_counter() - started
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    # Сверка полной страницы уже известных объявлений — установившийся режим
+    rounds = 200
+    started = time.perf_counter()
+    for i in range(rounds):
+        tracker.diff(pages[i % len(pages)])
+    per_page = (time.perf_counter() - started) / rounds
+
+    print(f"Объявлений в трекере: {len(tracker)}")
+    print(f"Память снимков: {used / 2 ** 20:.1f} МБ ({used / len(tracker):.0f} байт на объявление)")
+    print(f"Заполнение: {fill:.2f}с; сверка страницы из {PAGE_SIZE}: {per_page * 1e6:.0f} мкс")
+
+
+if __name__ == "__main__":
+    main()
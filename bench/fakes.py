@@ -0,0 +1,251 @@
+"""
+Локальные заменители внешних сервисов для бенчмарков и ручной проверки.
+
+FakeKufar — поисковый API Kufar на aiohttp. Объявления «публикуются» в
+каждой категории пуассоновским потоком с заданным темпом; тело объявления
+берётся из ответов в bench/fixtures (в репозитории они синтетические,
+см. README; bench/record.py заменяет их настоящими), так что размер и
+форма ответа — как у Kufar. Поддерживает курсор pagination, ETag /
+If-None-Match и случайные 503 / 429.
+
+FakeBot — вместо telegram.Bot: запоминает отправленные сообщения с
+временем, добавляет задержку и, как Telegram, отвечает RetryAfter при
+превышении лимитов на чат и на бота. Фото и альбомы тоже принимает и,
+как Telegram, отвечает file_id, по которым фото можно слать повторно.
+"""
+import asyncio
+import glob
+import itertools
+import json
+import os
+import random
+import re
+import time
+from collections import deque
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Dict, List, NamedTuple, Optional
+
+from aiohttp import web
+from telegram.error import RetryAfter
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "search_*.json")
+
+_ITEM_RE = re.compile(r"/item/(\d+)")
+
+
+def load_templates(pattern: str = FIXTURES) -> List[Dict]:
+    """Объявления из ответов в bench/fixtures — шаблоны для публикуемых."""
+    ads = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path, "rb") as f:
+            ads.extend(json.load(f).get("ads", []))
+    if not ads:
+        raise FileNotFoundError(f"Нет фикстур: {pattern}")
+    return ads
+
+
+# ─── Kufar ──────────────────────────────────────────────────────────────────
+
+class _Listing(NamedTuple):
+    ad_id: int
+    posted_at: float        # time.monotonic() момента публикации; -inf — было до старта
+    body: bytes             # готовый JSON объявления
+
+
+class FakeKufar:
+    """
+    Заменитель поискового API Kufar.
+
+    rate_per_min — средний темп публикаций в одной категории;
+    backlog      — сколько объявлений уже лежит в каждой категории на старте;
+    error_rate / throttle_rate — доля запросов, на которые отвечаем 503 / 429.
+    Курсор — просто смещение в выдаче. posted_at хранит момент публикации
+    каждого ID, чтобы считать задержку до уведомления.
+    """
+
+    def __init__(
+        self,
+        categories: List[int],
+        rate_per_min: float,
+        backlog: int = 100,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        templates: List[Dict] = None,
+        seed: int = None,
+    ):
+        self.categories = list(categories)
+        self.rate_per_min = rate_per_min
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.requests = 0
+        self.posted_at: Dict[int, float] = {}
+        self._random = random.Random(seed)
+        self._templates = templates or load_templates()
+        self._ids = itertools.count(400_000_000)
+        self._listings: Dict[int, deque] = {cat: deque(maxlen=max(backlog, 1000)) for cat in self.categories}
+        self._tasks: List[asyncio.Task] = []
+        self._runner: Optional[web.AppRunner] = None
+        self.url: Optional[str] = None
+
+        for cat in self.categories:
+            for _ in range(backlog):
+                self._post(cat, posted_at=float("-inf"))
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application()
+        app.router.add_get("/search", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.url = f"http://{host}:{port}/search"
+        if self.rate_per_min > 0:
+            self._tasks = [asyncio.create_task(self._publisher(cat)) for cat in self.categories]
+        return self.url
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def ids(self, category_id: int) -> List[int]:
+        """ID в выдаче категории, новые первыми."""
+        return [item.ad_id for item in self._listings[category_id]]
+
+    def _post(self, category_id: int, posted_at: float = None):
+        ad_id = next(self._ids)
+        item = dict(self._random.choice(self._templates))
+        item["ad_id"] = ad_id
+        item["ad_link"] = f"https://www.kufar.by/item/{ad_id}"
+        item["list_time"] = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        item["subject"] = f"{item.get('subject', 'Объявление')} #{ad_id}"
+        posted_at = time.monotonic() if posted_at is None else posted_at
+        self._listings[category_id].appendleft(
+            _Listing(ad_id, posted_at, json.dumps(item, ensure_ascii=False).encode())
+        )
+        self.posted_at[ad_id] = posted_at
+
+    async def _publisher(self, category_id: int):
+        rate = self.rate_per_min / 60
+        while True:
+            await asyncio.sleep(self._random.expovariate(rate))
+            self._post(category_id)
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        roll = self._random.random()
+        if roll < self.error_rate:
+            return web.Response(status=503)
+        if roll < self.error_rate + self.throttle_rate:
+            return web.Response(status=429, headers={"Retry-After": "1"})
+
+        listings = self._listings.get(int(request.query.get("cat", 0)))
+        if listings is None:
+            return web.json_response({"ads": [], "pagination": {"pages": []}, "total": 0})
+
+        etag = f'"{listings[0].ad_id if listings else 0}"'
+        offset = int(request.query.get("cursor", 0))
+        if offset == 0 and request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+
+        size = int(request.query.get("size", 50))
+        page = list(itertools.islice(listings, offset, offset + size))
+        pages = [{"label": "self", "num": offset // size + 1, "token": None}]
+        if offset + size < len(listings):
+            pages.append({"label": "next", "num": offset // size + 2, "token": str(offset + size)})
+        body = (
+            b'{"ads":[' + b",".join(item.body for item in page) + b'],"pagination":'
+            + json.dumps({"pages": pages}).encode() + b',"total":' + str(len(listings)).encode() + b"}"
+        )
+        headers = {"ETag": etag} if offset == 0 else {}
+        return web.Response(body=body, content_type="application/json", headers=headers)
+
+
+# ─── Telegram ───────────────────────────────────────────────────────────────
+
+class SentMessage(NamedTuple):
+    chat_id: int
+    text: str
+    sent_at: float          # time.monotonic()
+
+    @property
+    def ad_ids(self) -> List[int]:
+        return [int(m) for m in _ITEM_RE.findall(self.text)]
+
+
+class FakeBot:
+    """
+    Заменитель telegram.Bot для очереди уведомлений.
+
+    latency   — сколько «идёт» каждый запрос к Telegram;
+    chat_rps / global_rps — лимиты, при превышении — RetryAfter, как у
+    настоящего API (None — без лимита);
+    photo_latency — сколько дольше идёт фото, которое Telegram скачивает по
+    URL (по file_id — как обычное сообщение). uploads / reused считают,
+    сколько фото пришло URL, а сколько — file_id.
+    """
+
+    def __init__(self, latency: float = 0.05, chat_rps: float = None, global_rps: float = None,
+                 photo_latency: float = 0.5):
+        self.latency = latency
+        self.photo_latency = photo_latency
+        self.uploads = 0
+        self.reused = 0
+        self.chat_rps = chat_rps
+        self.global_rps = global_rps
+        self.sent: List[SentMessage] = []
+        self.calls = 0
+        self.throttled = 0
+        self._chat_calls: Dict[int, deque] = {}
+        self._global_calls: deque = deque()
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        await self._call(chat_id, text, self.latency)
+
+    async def send_photo(self, chat_id: int, photo: str, caption: str = None, **kwargs):
+        return (await self._send_photos(chat_id, [photo], caption))[0]
+
+    async def send_media_group(self, chat_id: int, media: List, **kwargs):
+        return await self._send_photos(chat_id, [m.media for m in media], media[0].caption)
+
+    async def _send_photos(self, chat_id: int, photos: List[str], caption: Optional[str]) -> List:
+        urls = [p for p in photos if p.startswith("http")]
+        await self._call(chat_id, caption or "", self.latency + (self.photo_latency if urls else 0))
+        self.uploads += len(urls)
+        self.reused += len(photos) - len(urls)
+        return [
+            SimpleNamespace(photo=[SimpleNamespace(file_id=p if p not in urls else f"file-{abs(hash(p))}")])
+            for p in photos
+        ]
+
+    async def _call(self, chat_id: int, text: str, latency: float):
+        self.calls += 1
+        await asyncio.sleep(latency)
+        now = time.monotonic()
+        chat_calls = self._chat_calls.setdefault(chat_id, deque())
+        if _over_limit(chat_calls, self.chat_rps, now) or _over_limit(self._global_calls, self.global_rps, now):
+            self.throttled += 1
+            raise RetryAfter(1)
+        chat_calls.append(now)
+        self._global_calls.append(now)
+        self.sent.append(SentMessage(chat_id, text, now))
+
+
+def _over_limit(calls: deque, rps: Optional[float], now: float) -> bool:
+    """Скользящее окно в 1 с: сколько вызовов уже было."""
+    if rps is None:
+        return False
+    while calls and now - calls[0] > 1.0:
+        calls.popleft()
+    return len(calls) >= rps
@@ -0,0 +1,55 @@
+"""
+Запись настоящих ответов Kufar в bench/fixtures — для bench_decode и FakeKufar.
+
+Сохраняет сырые ответы первых страниц выдачи как есть
+(search_<категория>_page<N>.json), идя по курсору pagination.
+
+Запуск из корня репозитория:
+    python bench/record.py 5070 [5010 ...] [--pages 2]
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import parser as kufar_parser  # noqa: E402
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+async def record(category_id: int, pages: int, session: aiohttp.ClientSession):
+    params = kufar_parser._search_params(category_id)
+    for page_num in range(1, pages + 1):
+        async with session.get(kufar_parser.KUFAR_API_URL, params=params) as resp:
+            resp.raise_for_status()
+            raw = await resp.read()
+        path = os.path.join(FIXTURES_DIR, f"search_{category_id}_page{page_num}.json")
+        with open(path, "wb") as f:
+            f.write(raw)
+        ads = kufar_parser._parse_response(kufar_parser._json_loads(raw))
+        print(f"{path}: {len(ads)} объявлений, {len(raw) / 1024:.0f} КБ")
+
+        cursor = kufar_parser._next_cursor(kufar_parser._json_loads(raw))
+        if cursor is None:
+            break
+        params = dict(params, cursor=cursor)
+
+
+async def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("categories", nargs="+", type=int, help="ID категорий Kufar")
+    ap.add_argument("--pages", type=int, default=2, help="сколько страниц записать на категорию")
+    args = ap.parse_args()
+
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    async with aiohttp.ClientSession(headers=kufar_parser.HEADERS) as session:
+        for category_id in args.categories:
+            await record(category_id, args.pages, session)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
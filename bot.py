@@ -1,12 +1,17 @@
+import html
 import logging
+import re
+from typing import List, Optional, Tuple
 
 from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
 from telegram.ext import ContextTypes
 
 import config
-from state import BotState
+from ad_filters import AdFilter
+from catalog import Category, get_catalog
+from state import BotState, StateWriteError, Subscription
 from notifier import notify_missed_ads
-import parser as kufar_parser
+from catchup import catch_up
 
 logger = logging.getLogger(__name__)
 
@@ -29,56 +34,50 @@ KB_MENU = ReplyKeyboardMarkup(
 
 # ─── Имя категории для текстов ──────────────────────────────────────────────
 
-CATEGORY_NAMES = {
-    5070: "Фототехника и оптика",
-    5000: "Техника",
-    5010: "Телефоны",
-    5020: "Аудиотехника",
-    5030: "Компьютеры и комплектующие",
-    5040: "Игры и приставки",
-    5050: "Оргтехника",
-    5060: "ТВ и видеотехника",
-    5080: "Планшеты и электронные книги",
-    5090: "Бытовая техника",
-    1000: "Недвижимость",
-    2000: "Авто и транспорт",
-    2010: "Легковые авто",
-    3000: "Все для дома",
-    4000: "Хобби, спорт и туризм",
-    6000: "Работа, бизнес, учёба",
-    7000: "Прочее",
-    8000: "Мода и стиль",
-    9000: "Свадьба и праздники",
-    10000: "Сад и огород",
-    11000: "Животные",
-    12000: "Всё для детей и мам",
-    13000: "Услуги",
-    14000: "Ремонт и стройка",
-}
-
-
-def get_category_name() -> str:
-    return CATEGORY_NAMES.get(config.KUFAR_CATEGORY_ID, f"Категория {config.KUFAR_CATEGORY_ID}")
-
-
-def get_keyboard(state: BotState) -> ReplyKeyboardMarkup:
-    """Возвращает клавиатуру в зависимости от текущего состояния."""
-    if state.status == "active":
+def get_category_name(category_id: int) -> str:
+    return get_catalog().name(category_id)
+
+
+def _category_lines(categories: List[Category]) -> str:
+    """Список категорий «ID — название» для ответа бота."""
+    return "\n".join(f"{c.id} — {html.escape(c.name)}" for c in categories)
+
+
+def get_categories_text(sub: Subscription) -> str:
+    """Названия категорий подписки через запятую."""
+    if not sub.categories:
+        return "нет категорий"
+    return ", ".join(get_category_name(c) for c in sub.categories)
+
+
+def get_keyboard(sub: Subscription) -> ReplyKeyboardMarkup:
+    """Возвращает клавиатуру в зависимости от текущего состояния чата."""
+    if sub.status == "active":
         return KB_MAIN_ACTIVE
     return KB_MAIN_INACTIVE
 
 
+def is_allowed(update: Update) -> bool:
+    """Пускаем только чаты из TELEGRAM_ALLOWED_CHAT_IDS (по умолчанию — TELEGRAM_CHAT_ID)."""
+    if config.TELEGRAM_ALLOW_ANY_CHAT:
+        return True
+    return update.effective_chat.id in config.TELEGRAM_ALLOWED_CHAT_IDS
+
+
 # ─── Обработчики ────────────────────────────────────────────────────────────
 
 async def handle_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /start — приветствие."""
-    state = context.bot_data["state"]
-    category = get_category_name()
+    if not is_allowed(update):
+        return
+    state: BotState = context.bot_data["state"]
+    sub = state.subscription(update.effective_chat.id)
+    category = html.escape(get_categories_text(sub))
 
-    # Если бот уже активен — просто напомнить
-    if state.status == "active":
+    # Если слежка уже активна — просто напомнить
+    if sub.status == "active":
         await update.message.reply_text(
-            f"👋 Слежка уже активна за категорией <b>{category}</b>.",
+            f"👋 Слежка уже активна: <b>{category}</b>.",
             parse_mode="HTML",
             reply_markup=KB_MAIN_ACTIVE,
         )
@@ -86,7 +85,8 @@ async def handle_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await update.message.reply_text(
         f"👋 Привет! Я отслеживаю новые объявления на kufar.by.\n\n"
-        f"Категория: <b>{category}</b>\n\n"
+        f"Категории: <b>{category}</b>\n"
+        f"Изменить: /watch и /unwatch, фильтры: /filter\n\n"
         f"Нажми <b>Старт</b>, чтобы начать.",
         parse_mode="HTML",
         reply_markup=KB_MAIN_INACTIVE,
@@ -95,54 +95,73 @@ async def handle_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def handle_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Общий обработчик текстовых кнопок."""
+    if not is_allowed(update):
+        return
     text = update.message.text
     state: BotState = context.bot_data["state"]
+    sub = state.subscription(update.effective_chat.id)
 
     if text == "▶️ Старт":
-        await _start_scan(update, context, state)
+        await _start_scan(update, context, state, sub)
     elif text == "⏹️ Стоп":
-        await _stop_scan(update, context, state)
+        await _stop_scan(update, context, state, sub)
     elif text == "☰ Меню":
         await _show_menu(update, context)
     elif text == "🔄 Перезапустить":
-        await _restart_scan(update, context, state)
+        await _restart_scan(update, context, state, sub)
     elif text == "⬅️ Назад":
-        await _back(update, context, state)
+        await _back(update, context, sub)
     else:
         # Неизвестная кнопка — просто показываем текущую клавиатуру
         await update.message.reply_text(
             "Используй кнопки ниже.",
-            reply_markup=get_keyboard(state),
+            reply_markup=get_keyboard(sub),
         )
 
 
 # ─── Внутренние функции кнопок ──────────────────────────────────────────────
 
-async def _start_scan(update: Update, context: ContextTypes.DEFAULT_TYPE, state: BotState):
-    """Кнопка Старт."""
-    bot = context.bot
-    category = get_category_name()
+async def _flush(state: BotState):
+    """
+    Ждёт записи смены статуса на диск. Диск не отвечает — изменение уже
+    действует в памяти, и ответ на кнопку не ждём дольше STATE_FLUSH_TIMEOUT.
+    """
+    try:
+        await state.flush()
+    except StateWriteError as e:
+        logger.error(f"Смена статуса не записана на диск: {e}")
 
-    # Если был Стоп — считаем пропущенные объявления
-    if state.status == "stopped" and state.stopped_at:
-        missed = await _count_missed(state)
-        if missed > 0:
-            await notify_missed_ads(bot, missed)
 
-    # Переключаем в active
-    state.set_active()
+async def _start_scan(update: Update, context: ContextTypes.DEFAULT_TYPE, state: BotState, sub: Subscription):
+    """Кнопка Старт."""
+    category = html.escape(get_categories_text(sub))
+
+    # Если был Стоп — пропущенные считаем в фоне, чтобы не держать ответ на кнопку.
+    # Снимок подписки берём до set_active: он сбрасывает stopped_at и курсоры
+    if sub.status == "stopped" and sub.stopped_at:
+        context.application.create_task(
+            _report_missed(context, state, Subscription.from_dict(sub.to_dict())),
+            update=update,
+        )
+
+    # Переключаем в active; новые категории чата сразу попадают в планировщик
+    state.set_active(sub.chat_id)
+    for category_id in sub.categories:
+        context.bot_data["scheduler"].add_category(category_id)
+    await _flush(state)
 
     await update.message.reply_text(
-        f"✅ Ожидаю публикацию объявлений в категории <b>{category}</b>. "
+        f"✅ Ожидаю публикацию объявлений: <b>{category}</b>. "
         f"О появлении будет сообщено.",
         parse_mode="HTML",
         reply_markup=KB_MAIN_ACTIVE,
     )
 
 
-async def _stop_scan(update: Update, context: ContextTypes.DEFAULT_TYPE, state: BotState):
+async def _stop_scan(update: Update, context: ContextTypes.DEFAULT_TYPE, state: BotState, sub: Subscription):
     """Кнопка Стоп."""
-    state.set_stopped()
+    state.set_stopped(sub.chat_id)
+    await _flush(state)
 
     await update.message.reply_text(
         "⏹️ Слежка приостановлена.",
@@ -158,10 +177,11 @@ async def _show_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
-async def _restart_scan(update: Update, context: ContextTypes.DEFAULT_TYPE, state: BotState):
-    """Кнопка Перезапустить — полный сброс."""
-    state.set_reset()
-    category = get_category_name()
+async def _restart_scan(update: Update, context: ContextTypes.DEFAULT_TYPE, state: BotState, sub: Subscription):
+    """Кнопка Перезапустить — сброс статуса чата."""
+    state.set_reset(sub.chat_id)
+    await _flush(state)
+    category = html.escape(get_categories_text(sub))
 
     await update.message.reply_text(
         f"🔄 Бот сброшен. Нажми <b>Старт</b>, чтобы возобновить слежку за <b>{category}</b>.",
@@ -170,21 +190,261 @@ async def _restart_scan(update: Update, context: ContextTypes.DEFAULT_TYPE, stat
     )
 
 
-async def _back(update: Update, context: ContextTypes.DEFAULT_TYPE, state: BotState):
+async def _back(update: Update, context: ContextTypes.DEFAULT_TYPE, sub: Subscription):
     """Кнопка Назад — возвращаем на главный экран."""
     await update.message.reply_text(
         "Главное меню",
-        reply_markup=get_keyboard(state),
+        reply_markup=get_keyboard(sub),
+    )
+
+
+# ─── Категории ──────────────────────────────────────────────────────────────
+
+async def handle_categories(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Команда /categories — подписка чата и справочник категорий.
+        /categories          — верхние категории
+        /categories 5000     — подкатегории
+        /categories фото     — поиск по названию
+    """
+    if not is_allowed(update):
+        return
+    state: BotState = context.bot_data["state"]
+    sub = state.subscription(update.effective_chat.id)
+    catalog = get_catalog()
+    query = " ".join(context.args or []).strip()
+
+    if not query:
+        listing = "Разделы:\n" + _category_lines(catalog.roots())
+    elif query.isdigit():
+        category_id = int(query)
+        parent = catalog.parent(category_id)
+        listing = f"<b>{html.escape(catalog.name(category_id))}</b> ({category_id})"
+        if parent is not None:
+            listing += f", раздел «{html.escape(parent.name)}» ({parent.id})"
+        children = catalog.children(category_id)
+        if children:
+            listing += "\n\n" + _category_lines(children)
+    else:
+        found = catalog.search(query)
+        listing = _category_lines(found) if found else f"Ничего не нашлось по «{html.escape(query)}»"
+
+    await update.message.reply_text(
+        f"Твои категории: <b>{html.escape(get_categories_text(sub))}</b>\n\n"
+        f"Добавить: /watch ID или название, убрать: /unwatch ID\n"
+        f"Подкатегории: /categories ID, поиск: /categories слово\n\n{listing}",
+        parse_mode="HTML",
+        reply_markup=get_keyboard(sub),
+    )
+
+
+def _pick_category(query: str) -> Tuple[Optional[int], List[Category]]:
+    """
+    ID категории из аргумента /watch: число — если такая категория есть в
+    справочнике (или в KUFAR_CATEGORIES), иначе поиск по справочнику.
+    Возвращает (ID или None, варианты, если их несколько).
+    """
+    catalog = get_catalog()
+    if query.isdigit():
+        category_id = int(query)
+        configured = any(c.id == category_id for c in config.KUFAR_CATEGORIES)
+        # Пустой справочник (не удалось загрузить) — проверить не по чему, верим на слово
+        if configured or not len(catalog) or category_id in catalog:
+            return category_id, []
+        return None, []
+    found = catalog.search(query)
+    if len(found) == 1:
+        return found[0].id, []
+    return None, found
+
+
+async def handle_watch(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /watch <ID или название> — добавить категорию в подписку чата."""
+    if not is_allowed(update):
+        return
+    state: BotState = context.bot_data["state"]
+    sub = state.subscription(update.effective_chat.id)
+    query = " ".join(context.args or []).strip()
+    if not query:
+        await update.message.reply_text(
+            f"Укажи ID или название категории, например: /watch 5010 или /watch телефоны\n"
+            f"Сейчас: {get_categories_text(sub)}",
+            reply_markup=get_keyboard(sub),
+        )
+        return
+
+    category_id, options = _pick_category(query)
+    if category_id is None:
+        text = (
+            f"Какую именно? /watch ID\n\n{_category_lines(options)}" if options
+            else f"Не нашёл категорию «{html.escape(query)}». Список: /categories"
+        )
+        await update.message.reply_text(text, parse_mode="HTML", reply_markup=get_keyboard(sub))
+        return
+
+    state.watch(sub.chat_id, category_id)
+    context.bot_data["scheduler"].add_category(category_id)
+    await update.message.reply_text(
+        f"➕ Слежу за <b>{html.escape(get_category_name(category_id))}</b>.\n"
+        f"Категории: {html.escape(get_categories_text(sub))}",
+        parse_mode="HTML",
+        reply_markup=get_keyboard(sub),
     )
 
 
+async def handle_unwatch(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /unwatch <ID> — убрать категорию из подписки чата."""
+    if not is_allowed(update):
+        return
+    state: BotState = context.bot_data["state"]
+    sub = state.subscription(update.effective_chat.id)
+    args = context.args or []
+    if len(args) != 1 or not args[0].isdigit() or int(args[0]) not in sub.categories:
+        await update.message.reply_text(
+            f"Укажи ID категории из подписки, например: /unwatch 5010\nСейчас: {get_categories_text(sub)}",
+            reply_markup=get_keyboard(sub),
+        )
+        return
+
+    category_id = int(args[0])
+    state.unwatch(sub.chat_id, category_id)
+    context.bot_data["scheduler"].remove_category(category_id)
+    await update.message.reply_text(
+        f"➖ Больше не слежу за <b>{html.escape(get_category_name(category_id))}</b>.\n"
+        f"Категории: {html.escape(get_categories_text(sub))}",
+        parse_mode="HTML",
+        reply_markup=get_keyboard(sub),
+    )
+
+
+# ─── Фильтры ────────────────────────────────────────────────────────────────
+
+FILTER_HELP = (
+    "Фильтры объявлений:\n"
+    "/filter — показать текущие\n"
+    "/filter [категория] price 100-500 [usd] — цена (любую границу можно опустить: 100- или -500)\n"
+    "/filter [категория] region 7 — код области Kufar\n"
+    "/filter [категория] query текст — поиск на стороне Kufar\n"
+    "/filter [категория] words canon, nikon — хоть одно слово в заголовке\n"
+    "/filter [категория] exclude сломан, запчасти — ни одного из слов\n"
+    "/filter [категория] regex выражение — заголовок должен совпасть\n"
+    "/filter [категория] clear — убрать все фильтры\n\n"
+    "Значение «-» убирает одно условие. Без категории — первая из подписки."
+)
+
+
+async def handle_filter(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /filter — просмотр и правка фильтров категории в подписке чата."""
+    if not is_allowed(update):
+        return
+    state: BotState = context.bot_data["state"]
+    sub = state.subscription(update.effective_chat.id)
+    args = list(context.args or [])
+
+    if not args:
+        lines = [
+            f"• <b>{html.escape(get_category_name(c))}</b> ({c}): "
+            f"{html.escape(sub.get_filter(c).describe())}"
+            for c in sub.categories
+        ]
+        await update.message.reply_text(
+            "\n".join(lines) + "\n\n" + html.escape(FILTER_HELP),
+            parse_mode="HTML",
+            reply_markup=get_keyboard(sub),
+        )
+        return
+
+    if not sub.categories:
+        await update.message.reply_text("Сначала добавь категорию: /watch <ID>")
+        return
+
+    category_id = sub.categories[0]
+    if args[0].isdigit():
+        category_id = int(args.pop(0))
+        if category_id not in sub.categories:
+            await update.message.reply_text(f"Категория {category_id} не в подписке — добавь её через /watch.")
+            return
+
+    if not args:
+        await update.message.reply_text(FILTER_HELP)
+        return
+
+    field_name, value = args[0].lower(), " ".join(args[1:]).strip()
+    try:
+        ad_filter = _apply_filter_arg(sub.get_filter(category_id), field_name, value)
+        ad_filter.compile()  # проверяем регулярку до сохранения
+    except (ValueError, re.error) as e:
+        await update.message.reply_text(f"Не понял фильтр: {e}\n\n{FILTER_HELP}")
+        return
+
+    state.set_filter(sub.chat_id, category_id, ad_filter)
+    await update.message.reply_text(
+        f"Фильтр для <b>{html.escape(get_category_name(category_id))}</b>: "
+        f"{html.escape(ad_filter.describe())}",
+        parse_mode="HTML",
+        reply_markup=get_keyboard(sub),
+    )
+
+
+def _apply_filter_arg(ad_filter: AdFilter, field_name: str, value: str) -> AdFilter:
+    """Возвращает копию фильтра с изменённым полем."""
+    f = AdFilter.from_dict(ad_filter.to_dict())
+    clear = value == "-"
+
+    if field_name == "clear":
+        return AdFilter()
+    if field_name == "price":
+        if clear:
+            f.price_min = f.price_max = None
+            f.currency = "byn"
+            return f
+        parts = value.split()
+        f.currency = "usd" if len(parts) > 1 and parts[1].lower() in ("usd", "$") else "byn"
+        lo, sep, hi = parts[0].partition("-") if parts else ("", "", "")
+        if not sep and lo:
+            raise ValueError("цена задаётся как min-max")
+        f.price_min = float(lo) if lo else None
+        f.price_max = float(hi) if hi else None
+        if f.price_min is None and f.price_max is None:
+            raise ValueError("нужна хотя бы одна граница цены")
+        return f
+    if field_name == "region":
+        f.region = None if clear else int(value)
+        return f
+    if field_name == "query":
+        f.query = None if clear or not value else value
+        return f
+    if field_name in ("words", "exclude"):
+        words = [] if clear else [w.strip() for w in value.split(",") if w.strip()]
+        setattr(f, "keywords" if field_name == "words" else "exclude", words)
+        return f
+    if field_name == "regex":
+        f.regex = None if clear or not value else value
+        return f
+    raise ValueError(f"неизвестное условие «{field_name}»")
+
+
 # ─── Подсчёт пропущенных ────────────────────────────────────────────────────
 
-async def _count_missed(state: BotState) -> int:
+async def _report_missed(context: ContextTypes.DEFAULT_TYPE, state: BotState, stopped: Subscription):
     """
-    Тянем текущие объявления и считаем, сколько из них юзер ещё не видел.
-    Это лёгкий запрос — просто один fetch при Старте.
+    Сообщает чату, сколько он пропустил за Стоп (по каждой категории), и при
+    CATCHUP_DIGEST ставит сами объявления в очередь уведомлений — она
+    отправит их сводкой.
     """
-    ads = await kufar_parser.fetch_ads()
-    missed = sum(1 for ad in ads if not state.is_seen(ad["id"]))
-    return missed
+    kufar = context.bot_data["kufar"]
+    queue = context.bot_data["notify_queue"]
+    for category_id in stopped.categories:
+        result = await catch_up(
+            state, kufar, stopped.chat_id, category_id,
+            stopped.get_filter(category_id),
+            since=stopped.stopped_at_dt,
+            stop_cursor=stopped.stop_cursors.get(category_id),
+            throttle=context.bot_data["scheduler"].throttle,
+        )
+        if result.count > 0:
+            await notify_missed_ads(
+                context.bot, stopped.chat_id, result.count, category_id, get_category_name(category_id),
+            )
+        if config.CATCHUP_DIGEST and result.ads:
+            queue.put_many([(stopped.chat_id, ad) for ad in result.ads[:config.NOTIFY_DIGEST_MAX]])
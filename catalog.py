@@ -0,0 +1,312 @@
+"""
+Справочник категорий Kufar: дерево родитель → подкатегории и поиск по названию.
+
+Источник — kufar_categories.xlsx из репозитория (CATEGORIES_FILE). Таблица
+разбирается один раз и сохраняется компактным JSON (CATEGORIES_CACHE_FILE);
+следующие запуски читают кэш, пока xlsx не изменился. Если задан
+CATEGORY_TAXONOMY_URL, справочник в фоне дополняется категориями оттуда,
+и результат тоже идёт в кэш.
+
+Формат листа: строка-раздел (без ID, только название), за ней строка
+«<Раздел> (все)» с ID родительской категории и строки подкатегорий.
+"""
+import difflib
+import json
+import logging
+import os
+import re
+import zipfile
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional
+from xml.etree import ElementTree
+
+import aiohttp
+
+import config
+
+logger = logging.getLogger(__name__)
+
+_NS = {"m": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
+_CELL_REF_RE = re.compile(r"[A-Z]+")
+_WORD_RE = re.compile(r"\w+")
+
+# Версия формата кэша: другая — кэш пересобирается
+CACHE_VERSION = 1
+
+
+class Category(NamedTuple):
+    id: int
+    name: str
+    parent_id: Optional[int] = None
+
+
+class Catalog:
+    """
+    Индексированное дерево категорий.
+
+    По ID — dict; дети — списки ID у родителя; для поиска у каждой
+    категории хранится нормализованное название и его слова.
+    """
+
+    def __init__(self, categories: Iterable[Category] = ()):
+        self._by_id: Dict[int, Category] = {}
+        self._children: Dict[int, List[int]] = {}
+        self._search_names: Dict[int, str] = {}
+        self.update(categories)
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def __contains__(self, category_id: int) -> bool:
+        return category_id in self._by_id
+
+    def __iter__(self) -> Iterator[Category]:
+        return iter(self._by_id.values())
+
+    def update(self, categories: Iterable[Category]):
+        """Добавляет или заменяет категории и перестраивает индексы."""
+        for category in categories:
+            self._by_id[category.id] = category
+        self._children = {}
+        for category in self._by_id.values():
+            if category.parent_id is not None:
+                self._children.setdefault(category.parent_id, []).append(category.id)
+        self._search_names = {c.id: _normalize(c.name) for c in self._by_id.values()}
+
+    # ─── Поиск по ID и дереву ───────────────────────────────────────────
+
+    def get(self, category_id: int) -> Optional[Category]:
+        return self._by_id.get(category_id)
+
+    def name(self, category_id: int) -> str:
+        category = self._by_id.get(category_id)
+        return category.name if category else f"Категория {category_id}"
+
+    def parent(self, category_id: int) -> Optional[Category]:
+        category = self._by_id.get(category_id)
+        if category is None or category.parent_id is None:
+            return None
+        return self._by_id.get(category.parent_id)
+
+    def children(self, category_id: int) -> List[Category]:
+        return [self._by_id[c] for c in self._children.get(category_id, ())]
+
+    def roots(self) -> List[Category]:
+        return [c for c in self._by_id.values() if c.parent_id is None]
+
+    def root_of(self, category_id: int) -> int:
+        """ID верхней категории (для неизвестной — она сама)."""
+        seen = set()
+        while category_id not in seen:
+            seen.add(category_id)
+            category = self._by_id.get(category_id)
+            if category is None or category.parent_id is None:
+                return category_id
+            category_id = category.parent_id
+        return category_id
+
+    def group_by_parent(self, category_ids: Iterable[int]) -> Dict[int, List[int]]:
+        """Раскладывает категории по верхним: {ID верхней: [категории из списка]}."""
+        groups: Dict[int, List[int]] = {}
+        for category_id in category_ids:
+            groups.setdefault(self.root_of(category_id), []).append(category_id)
+        return groups
+
+    # ─── Поиск по названию ──────────────────────────────────────────────
+
+    def search(self, query: str, limit: int = 10) -> List[Category]:
+        """
+        Категории по названию: те, где для каждого слова запроса есть слово
+        названия, которое с него начинается. Если таких нет — похожие
+        (опечатки) через difflib.
+        """
+        words = _WORD_RE.findall(_normalize(query))
+        if not words:
+            return []
+
+        found = []
+        for category_id, name in self._search_names.items():
+            name_words = _WORD_RE.findall(name)
+            if all(any(nw.startswith(w) for nw in name_words) for w in words):
+                found.append(category_id)
+        found.sort(key=lambda c: (self._by_id[c].parent_id is not None, len(self._search_names[c])))
+
+        if not found:
+            # Похожие слова названий: «фототехнка» → «фототехника»
+            vocabulary: Dict[str, List[int]] = {}
+            for category_id, name in self._search_names.items():
+                for word in _WORD_RE.findall(name):
+                    vocabulary.setdefault(word, []).append(category_id)
+            for word in words:
+                for match in difflib.get_close_matches(word, vocabulary, n=limit, cutoff=0.75):
+                    found.extend(c for c in vocabulary[match] if c not in found)
+
+        return [self._by_id[c] for c in found[:limit]]
+
+
+def _normalize(text: str) -> str:
+    return text.lower().replace("ё", "е")
+
+
+# ─── Загрузка ───────────────────────────────────────────────────────────────
+
+def read_xlsx(path: str) -> List[Category]:
+    """Разбирает лист справочника без внешних зависимостей (zip + XML, строки inline)."""
+    with zipfile.ZipFile(path) as book:
+        sheet = ElementTree.fromstring(book.read("xl/worksheets/sheet1.xml"))
+
+    categories = []
+    parent_id: Optional[int] = None
+    section: Optional[str] = None
+    for row in sheet.iterfind("m:sheetData/m:row", _NS):
+        cells = {}
+        for cell in row.iterfind("m:c", _NS):
+            column = _CELL_REF_RE.match(cell.get("r", "")).group()
+            value = cell.find("m:v", _NS)
+            if value is None:
+                value = cell.find("m:is/m:t", _NS)
+            cells[column] = (value.text or "").strip() if value is not None else ""
+
+        raw_id, name = cells.get("A", ""), _clean_name(cells.get("B", ""))
+        if not name or raw_id == "ID":
+            continue
+        if not raw_id:
+            # Строка-раздел: следующая строка с ID — его родительская категория
+            section, parent_id = name, None
+            continue
+        try:
+            category_id = int(float(raw_id))
+        except ValueError:
+            continue
+        if parent_id is None:
+            parent_id = category_id
+            categories.append(Category(category_id, section or name))
+        else:
+            categories.append(Category(category_id, name, parent_id))
+    return categories
+
+
+def _clean_name(name: str) -> str:
+    """«Техника (все)» → «Техника», пометки вида «← по умолчанию» убираются."""
+    name = name.split("←", 1)[0].strip()
+    if name.endswith("(все)"):
+        name = name[:-len("(все)")].strip()
+    return name
+
+
+def _source_signature(path: str) -> Dict[str, Any]:
+    stat = os.stat(path)
+    return {"path": os.path.basename(path), "size": stat.st_size, "mtime": int(stat.st_mtime)}
+
+
+def load_catalog(path: str = None, cache_path: str = None) -> Catalog:
+    """
+    Справочник из кэша, если он собран из того же xlsx, иначе из xlsx
+    (и кэш пересобирается). Без xlsx — пустой справочник.
+    """
+    path = path or config.CATEGORIES_FILE
+    cache_path = cache_path or config.CATEGORIES_CACHE_FILE
+    if not os.path.exists(path):
+        logger.warning(f"Справочник категорий {path} не найден")
+        return Catalog()
+
+    signature = _source_signature(path)
+    try:
+        with open(cache_path, "r") as f:
+            cached = json.load(f)
+        if cached.get("version") == CACHE_VERSION and cached.get("source") == signature:
+            return Catalog(Category(cid, name, parent) for cid, parent, name in cached["categories"])
+    except FileNotFoundError:
+        pass
+    except (json.JSONDecodeError, OSError, KeyError, TypeError, ValueError) as e:
+        logger.warning(f"Кэш справочника {cache_path} не читается, пересобираем: {e}")
+
+    catalog = Catalog(read_xlsx(path))
+    save_cache(catalog, signature, cache_path)
+    logger.info(f"Справочник категорий собран из {path}: {len(catalog)} категорий")
+    return catalog
+
+
+def save_cache(catalog: Catalog, signature: Dict[str, Any], cache_path: str = None):
+    cache_path = cache_path or config.CATEGORIES_CACHE_FILE
+    data = {
+        "version": CACHE_VERSION,
+        "source": signature,
+        "categories": [[c.id, c.parent_id, c.name] for c in catalog],
+    }
+    tmp_path = cache_path + ".tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.warning(f"Не удалось сохранить кэш справочника: {e}")
+
+
+# ─── Таксономия Kufar ───────────────────────────────────────────────────────
+
+async def refresh_catalog(catalog: Catalog, url: str = None) -> int:
+    """
+    Дополняет справочник категориями с CATEGORY_TAXONOMY_URL и сохраняет кэш.
+    Возвращает, сколько категорий пришло (0 — URL не задан или ошибка).
+    """
+    url = url or config.CATEGORY_TAXONOMY_URL
+    if not url:
+        return 0
+    try:
+        timeout = aiohttp.ClientTimeout(total=30)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.get(url) as resp:
+                resp.raise_for_status()
+                data = await resp.json(content_type=None)
+    except (aiohttp.ClientError, TimeoutError, ValueError) as e:
+        logger.warning(f"Не удалось обновить справочник категорий с {url}: {e}")
+        return 0
+
+    categories = list(_walk_taxonomy(data))
+    if not categories:
+        logger.warning(f"В ответе {url} не нашлось категорий")
+        return 0
+    catalog.update(categories)
+    if os.path.exists(config.CATEGORIES_FILE):
+        save_cache(catalog, _source_signature(config.CATEGORIES_FILE))
+    logger.info(f"Справочник категорий обновлён с {url}: {len(categories)} категорий")
+    return len(categories)
+
+
+def _walk_taxonomy(node: Any, parent_id: Optional[int] = None) -> Iterator[Category]:
+    """
+    Категории из JSON таксономии: объекты с id и названием (label / name /
+    title), вложенные в children / subcategories / categories на любой глубине.
+    """
+    if isinstance(node, list):
+        for item in node:
+            yield from _walk_taxonomy(item, parent_id)
+        return
+    if not isinstance(node, dict):
+        return
+
+    own_id = parent_id
+    raw_id = node.get("id")
+    name = node.get("label") or node.get("name") or node.get("title")
+    if raw_id is not None and isinstance(name, str):
+        try:
+            own_id = int(raw_id)
+        except (TypeError, ValueError):
+            pass
+        else:
+            yield Category(own_id, name.strip(), parent_id)
+
+    for key in ("children", "subcategories", "categories"):
+        if key in node:
+            yield from _walk_taxonomy(node[key], own_id)
+
+
+_catalog: Optional[Catalog] = None
+
+
+def get_catalog() -> Catalog:
+    """Общий справочник процесса (загружается при первом обращении)."""
+    global _catalog
+    if _catalog is None:
+        _catalog = load_catalog()
+    return _catalog
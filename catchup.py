@@ -0,0 +1,97 @@
+"""
+Догоняющий подсчёт объявлений, пропущенных чатом за время Стопа.
+
+Считаем ровно то, что опубликовано после stopped_at:
+    • уже виденное сканером (другие чаты продолжали слежку) — из истории
+      хранилища, а без неё — по BotState.seq против курсора Стопа;
+    • невиденное — листаем выдачу Kufar от новых к старым, пока время
+      публикации (list_time) не уйдёт раньше stopped_at, не встретится
+      известный ID или не кончатся CATCHUP_MAX_PAGES / CATCHUP_MAX_SECONDS.
+"""
+import logging
+from contextlib import aclosing
+from datetime import datetime
+from typing import Any, Awaitable, Callable, List, NamedTuple, Optional
+
+import config
+import parser as kufar_parser
+from ad_filters import AdFilter
+from parser import Ad
+from state import BotState
+
+logger = logging.getLogger(__name__)
+
+
+class CatchUp(NamedTuple):
+    count: int          # сколько пропущено (с фильтрами чата)
+    ads: List[Ad]       # те из них, что есть на руках, новые первыми (для сводки)
+
+
+async def catch_up(
+    state: BotState,
+    kufar: kufar_parser.KufarClient,
+    chat_id: int,
+    category_id: int,
+    ad_filter: AdFilter,
+    since: datetime,
+    stop_cursor: Optional[int] = None,
+    throttle: Callable[[], Awaitable[Any]] = None,
+) -> CatchUp:
+    """
+    Пропущенные чатом chat_id объявления категории с момента since.
+    throttle — общий лимит запросов сканов (ScanScheduler.throttle): догонялка
+    листает до CATCHUP_MAX_PAGES страниц и не должна обгонять SCAN_RPS.
+
+    Невиденные объявления запоминаются как виденные, если категорию больше
+    никто не смотрит, — иначе сканер после Старта прислал бы их ещё раз
+    поштучно. Если смотрит, их оставляем сканеру: он разошлёт и другим чатам.
+    """
+    matcher = ad_filter.compile(check_query=False)
+    count = 0
+    ads: List[Ad] = []
+
+    history = await state.ads_since(category_id, since)
+    if history is not None:
+        for ad in reversed(history):
+            listed = ad.listed_at
+            if (listed is None or listed >= since) and matcher.matches(ad):
+                count += 1
+                ads.append(ad)
+    elif stop_cursor is not None:
+        count += max(state.seq(category_id) - stop_cursor, 0)
+
+    consume = not any(sub.chat_id != chat_id for sub in state.subscribers(category_id))
+    fresh: List[Ad] = []
+    pages = kufar_parser.FetchStats()
+    try:
+        async with aclosing(kufar.iter_ads(
+            category_id,
+            is_known=lambda ad_id: state.is_seen(category_id, ad_id),
+            max_pages=config.CATCHUP_MAX_PAGES,
+            max_seconds=config.CATCHUP_MAX_SECONDS,
+            throttle=throttle,
+            stats=pages,
+            extra_params=ad_filter.server_params(),
+            on_page=lambda page: state.recall_seen(category_id, [ad.id for ad in page]),
+        )) as stream:
+            async for ad in stream:
+                listed = ad.listed_at
+                if listed is not None and listed < since:
+                    # Выдача отсортирована по времени — дальше только старше Стопа
+                    break
+                if state.is_seen(category_id, ad.id):
+                    continue
+                if consume:
+                    state.add_seen(category_id, ad)
+                if matcher.matches(ad):
+                    fresh.append(ad)
+    except kufar_parser.KufarError as e:
+        logger.error(f"Не удалось догнать пропущенные в категории {category_id}: {e}")
+    finally:
+        state.flush_seen()
+
+    logger.info(
+        f"Пропущено в категории {category_id} с {since:%d.%m %H:%M}: "
+        f"{count} уже виденных + {len(fresh)} новых ({pages.pages} стр.)"
+    )
+    return CatchUp(count + len(fresh), fresh + ads)
@@ -1,21 +1,187 @@
 import os
+import re
+from typing import List, NamedTuple, Set
 
 # Telegram
 TELEGRAM_BOT_TOKEN: str = os.getenv("TELEGRAM_BOT_TOKEN", "")
+# Чат по умолчанию: ему достаётся подписка из старого state.json, и он же допущен к боту,
+# если TELEGRAM_ALLOWED_CHAT_IDS не задан
 TELEGRAM_CHAT_ID: int = int(os.getenv("TELEGRAM_CHAT_ID", "0"))
+# Каким чатам можно пользоваться ботом, через запятую; пусто — только TELEGRAM_CHAT_ID, «*» — всем
+def _parse_chat_ids(raw: str, errors: List[str]) -> Set[int]:
+    chat_ids = set()
+    for chunk in raw.split(","):
+        chunk = chunk.strip()
+        if not chunk or chunk == "*":
+            continue
+        try:
+            chat_ids.add(int(chunk))
+        except ValueError:
+            errors.append(f"TELEGRAM_ALLOWED_CHAT_IDS: не разобрать «{chunk}»")
+    return chat_ids
+
+
+_CHAT_ID_ERRORS: List[str] = []
+_ALLOWED_CHAT_IDS = os.getenv("TELEGRAM_ALLOWED_CHAT_IDS", "").replace(" ", "")
+TELEGRAM_ALLOW_ANY_CHAT: bool = _ALLOWED_CHAT_IDS == "*"
+TELEGRAM_ALLOWED_CHAT_IDS: Set[int] = _parse_chat_ids(_ALLOWED_CHAT_IDS, _CHAT_ID_ERRORS) or (
+    {TELEGRAM_CHAT_ID} if TELEGRAM_CHAT_ID else set()
+)
+# Webhook: публичный адрес сервиса (например, https://kufar-bot.onrender.com); пусто — long polling
+TELEGRAM_WEBHOOK_URL: str = os.getenv("TELEGRAM_WEBHOOK_URL", "").rstrip("/")
+TELEGRAM_WEBHOOK_PATH: str = os.getenv("TELEGRAM_WEBHOOK_PATH", "/telegram")
+# Секрет в заголовке X-Telegram-Bot-Api-Secret-Token; пусто — генерируется при старте
+TELEGRAM_WEBHOOK_SECRET: str = os.getenv("TELEGRAM_WEBHOOK_SECRET", "")
 
 # Kufar
 KUFAR_CATEGORY_ID: int = int(os.getenv("KUFAR_CATEGORY_ID", "5070"))  # Фототехника и оптика
 
+# Пагинация: размер страницы и пределы догоняющей выборки
+KUFAR_PAGE_SIZE: int = int(os.getenv("KUFAR_PAGE_SIZE", "50"))
+KUFAR_MAX_PAGES: int = int(os.getenv("KUFAR_MAX_PAGES", "5"))                    # страниц за один скан
+KUFAR_MAX_FETCH_SECONDS: float = float(os.getenv("KUFAR_MAX_FETCH_SECONDS", "20"))  # секунд за один скан
+
+# HTTP-пул к api.kufar.by
+KUFAR_POOL_LIMIT: int = int(os.getenv("KUFAR_POOL_LIMIT", "4"))                  # макс. одновременных соединений
+KUFAR_DNS_CACHE_TTL: int = int(os.getenv("KUFAR_DNS_CACHE_TTL", "300"))          # секунды
+KUFAR_KEEPALIVE_TIMEOUT: float = float(os.getenv("KUFAR_KEEPALIVE_TIMEOUT", "120"))  # секунды
+
+# Повторы запросов к Kufar (decorrelated jitter) и предохранитель
+KUFAR_RETRY_ATTEMPTS: int = int(os.getenv("KUFAR_RETRY_ATTEMPTS", "3"))          # попыток на запрос, включая первую
+KUFAR_RETRY_BASE: float = float(os.getenv("KUFAR_RETRY_BASE", "0.5"))            # минимальная пауза, сек
+KUFAR_RETRY_CAP: float = float(os.getenv("KUFAR_RETRY_CAP", "10"))               # максимальная пауза, сек
+KUFAR_RETRY_AFTER_MAX: float = float(os.getenv("KUFAR_RETRY_AFTER_MAX", "30"))   # дольше Retry-After — не ждём, отдаём планировщику
+KUFAR_BREAKER_THRESHOLD: int = int(os.getenv("KUFAR_BREAKER_THRESHOLD", "5"))    # ошибок подряд до размыкания
+KUFAR_BREAKER_RESET: float = float(os.getenv("KUFAR_BREAKER_RESET", "60"))       # сколько держать разомкнутым, сек
+
+# Справочник категорий: таблица из репозитория, её скомпилированный кэш
+# и (необязательно) адрес таксономии Kufar, которой справочник дополняется в фоне
+CATEGORIES_FILE: str = os.getenv("CATEGORIES_FILE", "kufar_categories.xlsx")
+CATEGORIES_CACHE_FILE: str = os.getenv("CATEGORIES_CACHE_FILE", "categories.cache.json")
+CATEGORY_TAXONOMY_URL: str = os.getenv("CATEGORY_TAXONOMY_URL", "")
+
 # Интервалы сканирования (секунды)
 SCAN_INTERVAL_MIN: int = int(os.getenv("SCAN_INTERVAL_MIN", "41"))
 SCAN_INTERVAL_MAX: int = int(os.getenv("SCAN_INTERVAL_MAX", "94"))
 
-# Файл состояния на диске
+# Адаптивный интервал: подстраивается под темп публикаций в категории
+SCAN_ADAPTIVE: bool = os.getenv("SCAN_ADAPTIVE", "1") not in ("0", "false", "no")
+SCAN_TARGET_NEW_PER_SCAN: float = float(os.getenv("SCAN_TARGET_NEW_PER_SCAN", "1"))  # сколько новых ждём за скан
+SCAN_EWMA_ALPHA: float = float(os.getenv("SCAN_EWMA_ALPHA", "0.3"))   # вес последнего скана в оценке темпа
+SCAN_JITTER: float = float(os.getenv("SCAN_JITTER", "0.2"))           # ± доля случайного разброса интервала
+
+# Штраф за ошибки: интервал удваивается до SCAN_BACKOFF_MAX (секунды)
+SCAN_BACKOFF_MAX: int = int(os.getenv("SCAN_BACKOFF_MAX", "900"))
+
+# Глобальные лимиты на все категории сразу
+SCAN_CONCURRENCY: int = int(os.getenv("SCAN_CONCURRENCY", "2"))     # одновременных запросов к Kufar
+SCAN_RPS: float = float(os.getenv("SCAN_RPS", "0.5"))               # запросов в секунду в среднем
+
+
+# Категории для слежки.
+# Формат KUFAR_CATEGORIES: "5070,5010:30-60" — ID через запятую,
+# после двоеточия можно задать свой интервал min-max в секундах.
+# Если не задано — следим только за KUFAR_CATEGORY_ID.
+class CategoryConfig(NamedTuple):
+    id: int
+    interval_min: int
+    interval_max: int
+
+
+def _parse_categories(raw: str, errors: List[str]) -> List[CategoryConfig]:
+    categories = []
+    for chunk in raw.split(","):
+        chunk = chunk.strip()
+        if not chunk:
+            continue
+        try:
+            if ":" in chunk:
+                cat, interval = chunk.split(":", 1)
+                lo, hi = interval.split("-", 1)
+                categories.append(CategoryConfig(int(cat), int(lo), int(hi)))
+            else:
+                categories.append(CategoryConfig(int(chunk), SCAN_INTERVAL_MIN, SCAN_INTERVAL_MAX))
+        except ValueError:
+            errors.append(f"KUFAR_CATEGORIES: не разобрать «{chunk}»")
+    return categories
+
+
+_CATEGORY_ERRORS: List[str] = []
+KUFAR_CATEGORIES: List[CategoryConfig] = _parse_categories(
+    os.getenv("KUFAR_CATEGORIES", str(KUFAR_CATEGORY_ID)), _CATEGORY_ERRORS
+)
+
+# Очередь уведомлений (переживает рестарт)
+NOTIFY_QUEUE_FILE: str = "notify_queue.json"
+# Журнал очереди: добавленное и отправленное, периодически сворачивается в NOTIFY_QUEUE_FILE
+NOTIFY_QUEUE_JOURNAL_FILE: str = "notify_queue.log"
+# Сворачивать журнал, когда в нём столько строк (и больше, чем вдвое длиннее очереди)
+NOTIFY_JOURNAL_COMPACT_EVERY: int = int(os.getenv("NOTIFY_JOURNAL_COMPACT_EVERY", "1000"))
+NOTIFY_CHAT_RPS: float = float(os.getenv("NOTIFY_CHAT_RPS", "1"))         # сообщений/с в один чат
+NOTIFY_GLOBAL_RPS: float = float(os.getenv("NOTIFY_GLOBAL_RPS", "25"))    # сообщений/с всего
+NOTIFY_DIGEST_THRESHOLD: int = int(os.getenv("NOTIFY_DIGEST_THRESHOLD", "5"))  # с какой длины очереди слать сводкой
+NOTIFY_DIGEST_MAX: int = int(os.getenv("NOTIFY_DIGEST_MAX", "20"))        # объявлений в одной сводке
+NOTIFY_RETRY_MAX: float = float(os.getenv("NOTIFY_RETRY_MAX", "60"))      # потолок backoff при сетевых ошибках, сек
+
+# Фото в уведомлениях: одно фото или альбом (media group) на объявление
+NOTIFY_PHOTOS: bool = os.getenv("NOTIFY_PHOTOS", "0") not in ("0", "false", "no")
+NOTIFY_PHOTOS_MAX: int = int(os.getenv("NOTIFY_PHOTOS_MAX", "4"))            # фото на объявление (Telegram: до 10)
+NOTIFY_PHOTO_CONCURRENCY: int = int(os.getenv("NOTIFY_PHOTO_CONCURRENCY", "2"))  # одновременных отправок фото
+NOTIFY_PHOTO_CACHE_SIZE: int = int(os.getenv("NOTIFY_PHOTO_CACHE_SIZE", "5000"))  # URL → file_id Telegram (LRU)
+
+# Отслеживание изменений: снижение цены и перевыкладка (снимки объявлений в памяти)
+TRACK_CHANGES: bool = os.getenv("TRACK_CHANGES", "1") not in ("0", "false", "no")
+TRACK_MAX_ADS: int = int(os.getenv("TRACK_MAX_ADS", "100000"))            # сколько объявлений помнить (LRU)
+TRACK_TTL_DAYS: float = float(os.getenv("TRACK_TTL_DAYS", "14"))          # забывать не встречавшиеся столько дней
+TRACK_PRICE_DROP_PCT: float = float(os.getenv("TRACK_PRICE_DROP_PCT", "1"))  # минимальное снижение цены, %
+
+# Подсчёт пропущенных после Стопа: до какой глубины листать и слать ли их сводкой
+CATCHUP_MAX_PAGES: int = int(os.getenv("CATCHUP_MAX_PAGES", "20"))
+CATCHUP_MAX_SECONDS: float = float(os.getenv("CATCHUP_MAX_SECONDS", "60"))
+CATCHUP_DIGEST: bool = os.getenv("CATCHUP_DIGEST", "0") not in ("0", "false", "no")
+
+# /health отвечает 503, если при активной слежке не было успешного скана столько секунд
+HEALTH_STALE_SECONDS: int = int(os.getenv("HEALTH_STALE_SECONDS", "600"))
+
+# Остановка по SIGTERM: сколько секунд даём очереди уведомлений доотправиться
+# (Render ждёт после SIGTERM около 30 секунд)
+SHUTDOWN_DRAIN_SECONDS: float = float(os.getenv("SHUTDOWN_DRAIN_SECONDS", "20"))
+
+# Где хранить состояние: sqlite (STATE_DB_FILE) или json (STATE_FILE + журнал)
+STATE_BACKEND: str = os.getenv("STATE_BACKEND", "sqlite").lower()
+
+# База SQLite: подписки, виденные ID и история объявлений
+STATE_DB_FILE: str = os.getenv("STATE_DB_FILE", "state.db")
+
+# Запись состояния идёт в фоне: изменения за это окно (секунды) уходят одной записью.
+# Смена статуса чата и остановка пишутся сразу, не дожидаясь окна
+STATE_WRITE_DELAY: float = float(os.getenv("STATE_WRITE_DELAY", "1"))
+# Сколько секунд ждать записи на диск там, где её ждут (кнопки Старт/Стоп, остановка)
+STATE_FLUSH_TIMEOUT: float = float(os.getenv("STATE_FLUSH_TIMEOUT", "5"))
+
+# Файл состояния на диске (бэкенд json; для sqlite — источник разовой миграции)
 STATE_FILE: str = "state.json"
 
+# Журнал новых виденных ID (дозапись), периодически сворачивается в STATE_FILE
+SEEN_JOURNAL_FILE: str = "state.seen.log"
+
 # Сколько последних виденных ID хранить в памяти (чтобы файл не рос бесконечно)
-SEEN_IDS_LIMIT: int = 500
+SEEN_IDS_LIMIT: int = int(os.getenv("SEEN_IDS_LIMIT", "500"))
+
+# Через сколько строк журнала делать свёртку в STATE_FILE
+SEEN_JOURNAL_COMPACT_EVERY: int = int(os.getenv("SEEN_JOURNAL_COMPACT_EVERY", "1000"))
+
+# Несколько процессов (coordination.py): file — JSON под flock на одном хосте,
+# sqlite — общая база; пусто — процесс один и делает всё сам
+COORDINATION_BACKEND: str = os.getenv("COORDINATION_BACKEND", "").lower()
+# Файл хранилища аренд; пусто — coordination.json / coordination.db
+COORDINATION_FILE: str = os.getenv("COORDINATION_FILE", "")
+# Срок аренды (секунды): через столько лидера и категории упавшего процесса подхватят другие
+COORDINATION_LEASE_SECONDS: float = float(os.getenv("COORDINATION_LEASE_SECONDS", "15"))
+# Как часто лидер забирает входящие, а ведомые перечитывают список категорий
+COORDINATION_POLL_SECONDS: float = float(os.getenv("COORDINATION_POLL_SECONDS", "2"))
+# Имя процесса в кольце; пусто — <hostname>-<pid>
+WORKER_ID: str = os.getenv("WORKER_ID", "")
 
 
 def validate():
@@ -23,9 +189,72 @@ def validate():
     errors = []
     if not TELEGRAM_BOT_TOKEN:
         errors.append("TELEGRAM_BOT_TOKEN не установлена")
-    if TELEGRAM_CHAT_ID == 0:
-        errors.append("TELEGRAM_CHAT_ID не установлена")
+    errors.extend(_CHAT_ID_ERRORS)
+    if not TELEGRAM_ALLOW_ANY_CHAT and not TELEGRAM_ALLOWED_CHAT_IDS and not _CHAT_ID_ERRORS:
+        errors.append("Укажите TELEGRAM_CHAT_ID или TELEGRAM_ALLOWED_CHAT_IDS («*» — пускать все чаты)")
+    if TELEGRAM_WEBHOOK_URL and not TELEGRAM_WEBHOOK_URL.startswith("https://"):
+        errors.append("TELEGRAM_WEBHOOK_URL должен начинаться с https://")
+    if not TELEGRAM_WEBHOOK_PATH.startswith("/"):
+        errors.append("TELEGRAM_WEBHOOK_PATH должен начинаться с /")
+    if TELEGRAM_WEBHOOK_SECRET and not re.fullmatch(r"[A-Za-z0-9_-]{1,256}", TELEGRAM_WEBHOOK_SECRET):
+        errors.append("TELEGRAM_WEBHOOK_SECRET: 1–256 символов A-Z, a-z, 0-9, _ и -")
+    if KUFAR_POOL_LIMIT < 1:
+        errors.append("KUFAR_POOL_LIMIT должен быть больше 0")
+    if KUFAR_RETRY_ATTEMPTS < 1 or KUFAR_BREAKER_THRESHOLD < 1:
+        errors.append("KUFAR_RETRY_ATTEMPTS и KUFAR_BREAKER_THRESHOLD должны быть больше 0")
+    if not 0 < KUFAR_RETRY_BASE <= KUFAR_RETRY_CAP:
+        errors.append("Должно быть 0 < KUFAR_RETRY_BASE <= KUFAR_RETRY_CAP")
+    if KUFAR_PAGE_SIZE < 1 or KUFAR_MAX_PAGES < 1:
+        errors.append("KUFAR_PAGE_SIZE и KUFAR_MAX_PAGES должны быть больше 0")
+    if NOTIFY_CHAT_RPS <= 0 or NOTIFY_GLOBAL_RPS <= 0:
+        errors.append("NOTIFY_CHAT_RPS и NOTIFY_GLOBAL_RPS должны быть больше 0")
+    if NOTIFY_DIGEST_THRESHOLD < 2 or NOTIFY_DIGEST_MAX < 2:
+        errors.append("NOTIFY_DIGEST_THRESHOLD и NOTIFY_DIGEST_MAX должны быть не меньше 2")
+    if not 1 <= NOTIFY_PHOTOS_MAX <= 10:
+        errors.append("NOTIFY_PHOTOS_MAX должен быть от 1 до 10")
+    if NOTIFY_JOURNAL_COMPACT_EVERY < 1:
+        errors.append("NOTIFY_JOURNAL_COMPACT_EVERY должен быть больше 0")
+    if NOTIFY_PHOTO_CONCURRENCY < 1 or NOTIFY_PHOTO_CACHE_SIZE < 1:
+        errors.append("NOTIFY_PHOTO_CONCURRENCY и NOTIFY_PHOTO_CACHE_SIZE должны быть больше 0")
+    if TRACK_MAX_ADS < 1 or TRACK_TTL_DAYS <= 0:
+        errors.append("TRACK_MAX_ADS и TRACK_TTL_DAYS должны быть больше 0")
+    if SHUTDOWN_DRAIN_SECONDS < 0:
+        errors.append("SHUTDOWN_DRAIN_SECONDS не может быть отрицательным")
+    if CATCHUP_MAX_PAGES < 1 or CATCHUP_MAX_SECONDS <= 0:
+        errors.append("CATCHUP_MAX_PAGES и CATCHUP_MAX_SECONDS должны быть больше 0")
+    if STATE_WRITE_DELAY < 0:
+        errors.append("STATE_WRITE_DELAY не может быть отрицательным")
+    if STATE_FLUSH_TIMEOUT <= 0:
+        errors.append("STATE_FLUSH_TIMEOUT должен быть больше 0")
+    if STATE_BACKEND not in ("sqlite", "json"):
+        errors.append("STATE_BACKEND должен быть sqlite или json")
+    if SEEN_IDS_LIMIT < 1:
+        errors.append("SEEN_IDS_LIMIT должен быть больше 0")
+    if COORDINATION_BACKEND not in ("", "file", "sqlite"):
+        errors.append("COORDINATION_BACKEND должен быть file, sqlite или пустым")
+    if COORDINATION_LEASE_SECONDS <= 0 or COORDINATION_POLL_SECONDS <= 0:
+        errors.append("COORDINATION_LEASE_SECONDS и COORDINATION_POLL_SECONDS должны быть больше 0")
     if SCAN_INTERVAL_MIN >= SCAN_INTERVAL_MAX:
         errors.append("SCAN_INTERVAL_MIN должен быть меньше SCAN_INTERVAL_MAX")
+    errors.extend(_CATEGORY_ERRORS)
+    if not KUFAR_CATEGORIES and not _CATEGORY_ERRORS:
+        errors.append("KUFAR_CATEGORIES пуст")
+    seen_categories = set()
+    for cat in KUFAR_CATEGORIES:
+        if cat.interval_min >= cat.interval_max:
+            errors.append(f"Категория {cat.id}: минимальный интервал должен быть меньше максимального")
+        if cat.id in seen_categories:
+            errors.append(f"Категория {cat.id} указана дважды")
+        seen_categories.add(cat.id)
+    if not 0 < SCAN_EWMA_ALPHA <= 1:
+        errors.append("SCAN_EWMA_ALPHA должен быть в диапазоне (0, 1]")
+    if not 0 <= SCAN_JITTER < 1:
+        errors.append("SCAN_JITTER должен быть в диапазоне [0, 1)")
+    if SCAN_TARGET_NEW_PER_SCAN <= 0:
+        errors.append("SCAN_TARGET_NEW_PER_SCAN должен быть больше 0")
+    if SCAN_CONCURRENCY < 1:
+        errors.append("SCAN_CONCURRENCY должен быть больше 0")
+    if SCAN_RPS <= 0:
+        errors.append("SCAN_RPS должен быть больше 0")
     if errors:
         raise ValueError("Ошибки конфигурации:\n" + "\n".join(f"  • {e}" for e in errors))
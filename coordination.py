@@ -0,0 +1,440 @@
+"""
+Координация нескольких процессов бота: аренды (leases), шардирование
+категорий и выбор лидера.
+
+Без координации (COORDINATION_BACKEND пуст) процесс один и делает всё сам.
+С координацией процессы делят общее хранилище аренд:
+    - каждый процесс держит аренду «worker:<id>» — по живым арендам
+      строится кольцо консистентного хэширования, и каждая категория
+      сканируется ровно одним процессом;
+    - один процесс держит аренду «leader»: он ведёт Telegram (апдейты,
+      подписки, state.db, очередь уведомлений) и публикует список
+      категорий для сканирования;
+    - остальные (ведомые) сканируют свои категории и складывают
+      скачанное во входящие хранилища; лидер забирает его, отсеивает
+      виденное и рассылает — дублей уведомлений нет.
+
+Аренда живёт COORDINATION_LEASE_SECONDS и продлевается втрое чаще. Упал
+лидер — через срок аренды её забирает ведомый и становится лидером; упал
+ведомый — его категории по кольцу переходят к остальным.
+
+Бэкенды: file — JSON под fcntl.flock (несколько процессов на одном хосте),
+sqlite — таблицы в одной базе (WAL, общий диск).
+"""
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+import config
+import metrics
+from parser import Ad
+
+logger = logging.getLogger(__name__)
+
+LEADER_LEASE = "leader"
+WORKER_LEASE_PREFIX = "worker:"
+CATEGORIES_KEY = "categories"
+
+
+class CoordinationError(Exception):
+    """Хранилище аренд недоступно (диск, блокировка SQLite)."""
+
+
+class LeadershipLost(Exception):
+    """Аренду лидера не удалось продлить — её уже может держать другой процесс."""
+
+
+# ─── Хранилища аренд ────────────────────────────────────────────────────────
+
+class LeaseStore:
+    """
+    Общее для процессов хранилище: аренды с истечением, значения по ключу
+    и очередь входящих (строки, у каждой растущий номер).
+    Методы блокирующие — Coordinator зовёт их из отдельного потока.
+    """
+
+    def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        """Берёт или продлевает аренду. False — её держит другой владелец."""
+        raise NotImplementedError
+
+    def release(self, name: str, owner: str):
+        """Отпускает аренду, если она ещё наша."""
+        raise NotImplementedError
+
+    def holders(self, prefix: str) -> Dict[str, str]:
+        """Действующие аренды с именем на prefix: {имя: владелец}."""
+        raise NotImplementedError
+
+    def set_value(self, key: str, value: str):
+        raise NotImplementedError
+
+    def get_value(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def push(self, items: List[str]):
+        """Дописывает строки во входящие."""
+        raise NotImplementedError
+
+    def peek(self, limit: int) -> Tuple[int, List[str]]:
+        """Первые limit входящих и номер последней из них (0 — входящих нет)."""
+        raise NotImplementedError
+
+    def ack(self, upto: int):
+        """Удаляет входящие до номера upto включительно."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+def open_lease_store() -> LeaseStore:
+    if config.COORDINATION_BACKEND == "file":
+        return FileLeaseStore(config.COORDINATION_FILE or "coordination.json")
+    return SqliteLeaseStore(config.COORDINATION_FILE or "coordination.db")
+
+
+class FileLeaseStore(LeaseStore):
+    """
+    Всё в одном JSON-файле; каждая операция — чтение, изменение и атомарная
+    перезапись под эксклюзивным flock на соседнем .lock-файле.
+    """
+
+    def __init__(self, path: str):
+        if fcntl is None:
+            raise RuntimeError("COORDINATION_BACKEND=file работает только там, где есть fcntl")
+        self.path = path
+        self._lock_path = path + ".lock"
+
+    def _transaction(self, change):
+        with open(self._lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(self.path, "r") as f:
+                        data = json.load(f)
+                except FileNotFoundError:
+                    data = {}
+                except json.JSONDecodeError as e:
+                    logger.warning(f"{self.path} повреждён, начинаем заново: {e}")
+                    data = {}
+                for key, default in (("leases", {}), ("values", {}), ("inbox", []), ("seq", 0)):
+                    data.setdefault(key, default)
+
+                result, changed = change(data)
+                if changed:
+                    tmp_path = self.path + ".tmp"
+                    with open(tmp_path, "w") as f:
+                        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+                    os.replace(tmp_path, self.path)
+                return result
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        def change(data):
+            now = time.time()
+            holder = data["leases"].get(name)
+            if holder is not None and holder[0] != owner and holder[1] > now:
+                return False, False
+            data["leases"][name] = [owner, now + ttl]
+            return True, True
+        return self._transaction(change)
+
+    def release(self, name: str, owner: str):
+        def change(data):
+            holder = data["leases"].get(name)
+            if holder is None or holder[0] != owner:
+                return None, False
+            del data["leases"][name]
+            return None, True
+        self._transaction(change)
+
+    def holders(self, prefix: str) -> Dict[str, str]:
+        def change(data):
+            now = time.time()
+            return {
+                name: owner for name, (owner, expires_at) in data["leases"].items()
+                if name.startswith(prefix) and expires_at > now
+            }, False
+        return self._transaction(change)
+
+    def set_value(self, key: str, value: str):
+        def change(data):
+            if data["values"].get(key) == value:
+                return None, False
+            data["values"][key] = value
+            return None, True
+        self._transaction(change)
+
+    def get_value(self, key: str) -> Optional[str]:
+        return self._transaction(lambda data: (data["values"].get(key), False))
+
+    def push(self, items: List[str]):
+        def change(data):
+            for item in items:
+                data["seq"] += 1
+                data["inbox"].append([data["seq"], item])
+            return None, bool(items)
+        self._transaction(change)
+
+    def peek(self, limit: int) -> Tuple[int, List[str]]:
+        def change(data):
+            head = data["inbox"][:limit]
+            return (head[-1][0] if head else 0, [item for _, item in head]), False
+        return self._transaction(change)
+
+    def ack(self, upto: int):
+        def change(data):
+            rest = [entry for entry in data["inbox"] if entry[0] > upto]
+            changed = len(rest) != len(data["inbox"])
+            data["inbox"] = rest
+            return None, changed
+        self._transaction(change)
+
+
+class SqliteLeaseStore(LeaseStore):
+    """
+    Аренды, значения и входящие — таблицы SQLite. Аренда берётся одним
+    UPSERT: чужая строка перезаписывается, только если истекла.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS kv (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS inbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            item TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # Автокоммит, транзакции — явным BEGIN IMMEDIATE, где нужно
+        self._conn = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(self.SCHEMA)
+
+    def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        cur = self._conn.execute(
+            "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE leases.owner = excluded.owner OR leases.expires_at <= ?",
+            (name, owner, now + ttl, now),
+        )
+        return cur.rowcount == 1
+
+    def release(self, name: str, owner: str):
+        self._conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+    def holders(self, prefix: str) -> Dict[str, str]:
+        rows = self._conn.execute(
+            "SELECT name, owner FROM leases WHERE substr(name, 1, ?) = ? AND expires_at > ?",
+            (len(prefix), prefix, time.time()),
+        )
+        return dict(rows)
+
+    def set_value(self, key: str, value: str):
+        self._conn.execute(
+            "INSERT INTO kv (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value),
+        )
+
+    def get_value(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def push(self, items: List[str]):
+        if not items:
+            return
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.executemany("INSERT INTO inbox (item) VALUES (?)", ((item,) for item in items))
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def peek(self, limit: int) -> Tuple[int, List[str]]:
+        rows = self._conn.execute("SELECT id, item FROM inbox ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return (rows[-1][0] if rows else 0, [item for _, item in rows])
+
+    def ack(self, upto: int):
+        self._conn.execute("DELETE FROM inbox WHERE id <= ?", (upto,))
+
+    def close(self):
+        self._conn.close()
+
+
+# ─── Консистентное хэширование ──────────────────────────────────────────────
+
+class HashRing:
+    """
+    Кольцо консистентного хэширования: у каждого процесса replicas точек
+    на кольце, ключ достаётся первой точке по часовой стрелке. Когда процесс
+    приходит или уходит, переезжает только ~1/N категорий.
+    """
+
+    def __init__(self, nodes: Iterable[str] = (), replicas: int = 64):
+        self.nodes = sorted(set(nodes))
+        points = sorted(
+            (_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(replicas)
+        )
+        self._hashes = [h for h, _ in points]
+        self._owners = [node for _, node in points]
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def node_for(self, key: str) -> Optional[str]:
+        if not self._hashes:
+            return None
+        i = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._owners[i]
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode("utf-8"), usedforsecurity=False).digest()[:8], "big")
+
+
+# ─── Координатор процесса ───────────────────────────────────────────────────
+
+class Coordinator:
+    """
+    Аренды этого процесса и то, что из них следует: лидер ли он и какие
+    категории сканирует. run() продлевает аренды в фоне; если процесс был
+    лидером и продлить аренду не смог, run() бросает LeadershipLost —
+    процесс останавливается, чтобы два лидера не слали уведомления
+    одновременно (перезапущенный вернётся ведомым).
+    """
+
+    def __init__(self, store: LeaseStore, worker_id: str = None, lease: float = None):
+        self._store = store
+        self.worker_id = worker_id or config.WORKER_ID or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease = lease or config.COORDINATION_LEASE_SECONDS
+        self.is_leader = False
+        self.became_leader = asyncio.Event()
+        self._ring = HashRing([self.worker_id])
+        # Один поток: SQLite-соединение и flock не делятся между потоками
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="coordination")
+
+    async def _call(self, function, *args):
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+        except (OSError, sqlite3.Error) as e:
+            raise CoordinationError(str(e)) from e
+
+    def owns(self, category_id: int) -> bool:
+        """Сканирует ли категорию этот процесс."""
+        return self._ring.node_for(str(category_id)) in (self.worker_id, None)
+
+    async def run(self):
+        """
+        Продлевает аренды каждые lease/3 секунды до отмены. Ошибку хранилища
+        ведомый переживает; лидер, не продливший аренду за полсрока, сходит
+        с роли раньше, чем её сможет взять другой.
+        """
+        renewed_at = time.monotonic()
+        while True:
+            try:
+                await self.renew()
+                renewed_at = time.monotonic()
+            except CoordinationError as e:
+                logger.warning(f"Не удалось продлить аренды: {e}")
+                if self.is_leader and time.monotonic() - renewed_at > self.lease / 2:
+                    self.is_leader = False
+                    metrics.COORD_LEADER.set(0)
+                    raise LeadershipLost(f"{self.worker_id} не продлил аренду лидера") from e
+            await asyncio.sleep(self.lease / 3)
+
+    async def renew(self):
+        await self._call(self._store.acquire, WORKER_LEASE_PREFIX + self.worker_id, self.worker_id, self.lease)
+        leader = await self._call(self._store.acquire, LEADER_LEASE, self.worker_id, self.lease)
+        if self.is_leader and not leader:
+            self.is_leader = False
+            metrics.COORD_LEADER.set(0)
+            raise LeadershipLost(f"{self.worker_id} потерял аренду лидера")
+        if leader and not self.is_leader:
+            logger.info(f"Процесс {self.worker_id} стал лидером")
+            self.is_leader = True
+            metrics.COORD_LEADER.set(1)
+            self.became_leader.set()
+
+        workers = await self._call(self._store.holders, WORKER_LEASE_PREFIX)
+        nodes = set(workers.values()) | {self.worker_id}
+        if set(self._ring.nodes) != nodes:
+            logger.info(f"Процессов в кольце: {len(nodes)} ({', '.join(sorted(nodes))})")
+            self._ring = HashRing(nodes)
+        metrics.COORD_WORKERS.set(len(nodes))
+
+    async def close(self):
+        """Отпускает аренды — остальные подхватят роль и категории сразу, не дожидаясь срока."""
+        try:
+            if self.is_leader:
+                await self._call(self._store.release, LEADER_LEASE, self.worker_id)
+            await self._call(self._store.release, WORKER_LEASE_PREFIX + self.worker_id, self.worker_id)
+        except CoordinationError as e:
+            logger.warning(f"Не удалось отпустить аренды: {e}")
+        finally:
+            await self._call(self._store.close)
+            self._executor.shutdown(wait=True)
+
+    # ─── Категории и входящие ───────────────────────────────────────────
+
+    async def publish_categories(self, category_ids: Iterable[int]):
+        """Лидер: какие категории сейчас нужно сканировать."""
+        await self._call(self._store.set_value, CATEGORIES_KEY, json.dumps(sorted(category_ids)))
+
+    async def categories(self) -> List[int]:
+        raw = await self._call(self._store.get_value, CATEGORIES_KEY)
+        return json.loads(raw) if raw else []
+
+    async def push_ads(self, category_id: int, ads: List[Ad]):
+        """
+        Ведомый: всё скачанное за скан — лидеру, одной записью (и пустой:
+        по ней лидер видит, что сканы идут).
+        """
+        item = json.dumps({"category": category_id, "ads": [ad.to_dict() for ad in ads]}, ensure_ascii=False)
+        await self._call(self._store.push, [item])
+        metrics.COORD_INBOX_ADS.inc(len(ads), direction="pushed")
+
+    async def pull_ads(self, limit: int = 100) -> Tuple[int, List[Tuple[int, List[Ad]]]]:
+        """
+        Лидер: сканы ведомых — (категория, объявления) — и номер для ack().
+        Подтверждать — после того как объявления поставлены в очередь уведомлений.
+        """
+        upto, items = await self._call(self._store.peek, limit)
+        scans = []
+        for item in items:
+            try:
+                data = json.loads(item)
+                scans.append((int(data["category"]), [Ad.from_dict(ad) for ad in data["ads"]]))
+            except (json.JSONDecodeError, KeyError, TypeError, ValueError) as e:
+                logger.warning(f"Пропускаем битую запись входящих: {e}")
+        metrics.COORD_INBOX_ADS.inc(sum(len(ads) for _, ads in scans), direction="pulled")
+        return upto, scans
+
+    async def ack(self, upto: int):
+        if upto:
+            await self._call(self._store.ack, upto)
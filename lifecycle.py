@@ -0,0 +1,98 @@
+"""
+Жизненный цикл процесса: фоновые задачи, сигналы и порядок остановки.
+
+Render при редеплое шлёт SIGTERM и ждёт ~30 секунд. За это время нужно
+остановить сканер (скачанное к этому моменту всё равно попадает в очередь),
+дать воркеру уведомлений отправить очередь (не дольше SHUTDOWN_DRAIN_SECONDS)
+и сбросить состояние на диск. Что не успело уйти — остаётся в
+notify_queue.json и уходит после рестарта.
+"""
+import asyncio
+import logging
+import signal
+from typing import Coroutine, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class Lifecycle:
+    """
+    Фоновые задачи приложения и сигнал «пора останавливаться».
+
+    spawn() запускает задачу под именем и следит за ней: если она упала
+    или неожиданно завершилась, исключение попадает в лог и процесс
+    начинает штатную остановку, а не работает дальше вполсилы.
+    SIGTERM / SIGINT делают то же самое. Разовые задачи (critical=False)
+    остановку не вызывают — их ошибки только пишутся в лог.
+    """
+
+    def __init__(self):
+        self._stop = asyncio.Event()
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._optional: Set[str] = set()
+        self.reason: Optional[str] = None
+
+    @property
+    def stopping(self) -> bool:
+        return self._stop.is_set()
+
+    @property
+    def running(self) -> Set[str]:
+        """Имена фоновых задач, которые ещё работают."""
+        return set(self._tasks)
+
+    def install_signal_handlers(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self.request_stop, sig.name)
+            except (NotImplementedError, RuntimeError):
+                # Windows: обработчиков сигналов в цикле нет, остаётся KeyboardInterrupt
+                pass
+
+    def request_stop(self, reason: str):
+        if self._stop.is_set():
+            return
+        logger.info(f"Останавливаемся: {reason}")
+        self.reason = reason
+        self._stop.set()
+
+    async def wait(self):
+        """Ждёт сигнала или падения фоновой задачи."""
+        await self._stop.wait()
+
+    # ─── Фоновые задачи ─────────────────────────────────────────────────
+
+    def spawn(self, name: str, coro: Coroutine, critical: bool = True) -> asyncio.Task:
+        task = asyncio.create_task(coro, name=name)
+        self._tasks[name] = task
+        if not critical:
+            self._optional.add(name)
+        task.add_done_callback(self._on_done)
+        return task
+
+    def _on_done(self, task: asyncio.Task):
+        name = task.get_name()
+        if self._tasks.get(name) is task:
+            del self._tasks[name]
+        critical = name not in self._optional
+        self._optional.discard(name)
+        if task.cancelled():
+            return
+        exc = task.exception()
+        if exc is not None:
+            logger.error(f"Фоновая задача {name} упала", exc_info=exc)
+        if critical:
+            self.request_stop(f"упала задача {name}" if exc is not None else f"завершилась задача {name}")
+
+    async def cancel(self, name: str):
+        """Отменяет задачу и дожидается её завершения."""
+        task = self._tasks.get(name)
+        if task is None:
+            return
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    async def cancel_all(self):
+        for name in list(self._tasks):
+            await self.cancel(name)
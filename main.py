@@ -1,15 +1,27 @@
 import asyncio
+import hmac
+import json
 import logging
-import random
 import os
+import secrets
+import time
 
 from aiohttp import web
+from telegram import Update
 from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters
 
 import config
+import metrics
 from state import BotState
-from bot import handle_start, handle_button
-from notifier import notify_new_ad
+from bot import (
+    handle_start, handle_button, handle_filter,
+    handle_categories, handle_watch, handle_unwatch,
+)
+from scheduler import ScanScheduler, ShardScanner
+from notifier import NotifyQueue
+from lifecycle import Lifecycle
+from catalog import get_catalog, refresh_catalog
+from coordination import Coordinator, open_lease_store
 import parser as kufar_parser
 
 # ─── Логирование ────────────────────────────────────────────────────────────
@@ -24,17 +36,76 @@ logger = logging.getLogger(__name__)
 
 # ─── HTTP-сервер для health checks (Render + UptimeRobot) ──────────────────
 
-async def health_check(request):
+async def root(request):
     """Отвечает OK на все запросы — для Render и UptimeRobot."""
     return web.Response(text="OK", status=200)
 
 
-async def start_http_server():
-    """Запускает минимальный HTTP-сервер на порту из env."""
+async def health_check(request):
+    """
+    OK, пока сканы идут. Если слежка активна хоть в одном чате, а успешного скана не было
+    дольше HEALTH_STALE_SECONDS (считая от старта процесса), — 503.
+    У ведомого процесса подписок нет: сканы должны идти, пока ему достались категории.
+    """
+    bot_app = request.app["bot_app"]
+    if bot_app is not None:
+        state: BotState = bot_app.bot_data["state"]
+        watching = state.any_active
+    else:
+        watching = bool(metrics.COORD_OWNED_CATEGORIES.value())
+    if watching:
+        since = metrics.seconds_since_last_scan()
+        if since is None:
+            since = time.time() - request.app["started_at"]
+        if since > config.HEALTH_STALE_SECONDS:
+            return web.Response(text=f"STALE: нет успешных сканов {since:.0f}с", status=503)
+    return web.Response(text="OK", status=200)
+
+
+async def metrics_handler(request):
+    """Метрики пайплайна в формате Prometheus."""
+    return web.Response(
+        body=metrics.REGISTRY.render().encode("utf-8"),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+async def telegram_webhook(request):
+    """
+    Апдейты от Telegram (режим webhook). Чужие запросы отсекаются по
+    секрету в X-Telegram-Bot-Api-Secret-Token; принятый апдейт уходит в
+    очередь Application, дальше — обычные обработчики бота.
+    """
+    token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not hmac.compare_digest(token, request.app["webhook_secret"]):
+        return web.Response(status=403)
+
+    bot_app = request.app["bot_app"]
+    try:
+        update = Update.de_json(await request.json(), bot_app.bot)
+    except (json.JSONDecodeError, TypeError, ValueError, KeyError) as e:
+        logger.warning(f"Не разобрать апдейт Telegram: {e}")
+        return web.Response(status=400)
+    await bot_app.update_queue.put(update)
+    return web.Response(status=200)
+
+
+async def start_http_server(bot_app=None, webhook_secret: str = None):
+    """
+    Запускает минимальный HTTP-сервер на порту из env.
+    С webhook_secret на нём же принимает апдейты Telegram (TELEGRAM_WEBHOOK_PATH).
+    Без bot_app — сервер ведомого процесса: только /, /health и /metrics.
+    """
     app = web.Application()
-    app.router.add_get("/", health_check)
+    app["bot_app"] = bot_app
+    app["started_at"] = time.time()
+    app.router.add_get("/", root)
     app.router.add_get("/health", health_check)
-    
+    app.router.add_get("/metrics", metrics_handler)
+    if webhook_secret:
+        app["webhook_secret"] = webhook_secret
+        app.router.add_post(config.TELEGRAM_WEBHOOK_PATH, telegram_webhook)
+
     port = int(os.getenv("PORT", "8080"))
     runner = web.AppRunner(app)
     await runner.setup()
@@ -48,60 +119,167 @@ async def start_http_server():
 
 async def scan_loop(app):
     """
-    Бесконечный цикл парсинга.
-    Работает только когда state == active.
-    Интервал между запросами — случайное число от SCAN_INTERVAL_MIN до SCAN_INTERVAL_MAX.
+    Бесконечный цикл парсинга по всем категориям из KUFAR_CATEGORIES
+    и из подписок чатов. Категория сканируется, пока на неё подписан
+    хоть один активный чат.
+    Расписание каждой категории и общие лимиты — в scheduler.ScanScheduler.
     """
-    state: BotState = app.bot_data["state"]
+    await app.bot_data["scheduler"].run()
 
-    while True:
-        interval = random.randint(config.SCAN_INTERVAL_MIN, config.SCAN_INTERVAL_MAX)
 
-        if state.status == "active":
-            try:
-                ads = await kufar_parser.fetch_ads()
+# ─── Старт приложения ───────────────────────────────────────────────────────
 
-                for ad in ads:
-                    if not state.is_seen(ad["id"]):
-                        # Новое объявление — уведомляем и запоминаем
-                        state.add_seen(ad["id"])
-                        await notify_new_ad(app.bot, ad)
-                        logger.info(f"Новое объявление: {ad['id']} — {ad['title']}")
+async def main():
+    config.validate()
 
-            except Exception as e:
-                logger.error(f"Ошибка в цикле сканирования: {e}")
-        else:
-            logger.debug(f"Слежка неактивна (status={state.status}), пропускаем.")
+    lifecycle = Lifecycle()
+    lifecycle.install_signal_handlers()
 
-        logger.debug(f"Следующий скан через {interval}с")
-        await asyncio.sleep(interval)
+    # Без координации процесс один и сразу лидер. С ней — ждёт аренды
+    # лидера, а пока её держит другой, сканирует свою долю категорий
+    coordinator = None
+    if config.COORDINATION_BACKEND:
+        coordinator = Coordinator(open_lease_store())
+        await coordinator.renew()
+        lifecycle.spawn("coordination", coordinator.run())
+    try:
+        if coordinator is None or coordinator.is_leader or await follow(coordinator, lifecycle):
+            await lead(lifecycle, coordinator)
+    finally:
+        if coordinator is not None:
+            await lifecycle.cancel_all()
+            await coordinator.close()
 
 
-# ─── Старт приложения ───────────────────────────────────────────────────────
+async def follow(coordinator: Coordinator, lifecycle: Lifecycle) -> bool:
+    """
+    Ведомый процесс: сканирует доставшиеся ему категории и отдаёт скачанное
+    лидеру. Возвращает True, когда этот процесс сам стал лидером, и False —
+    если пора останавливаться.
+    """
+    logger.info(f"Процесс {coordinator.worker_id} — ведомый: сканирует свою долю категорий")
+    # Health checks и метрики нужны и ведомому; став лидером, он поднимет сервер заново
+    http_runner = await start_http_server()
+    async with kufar_parser.KufarClient() as kufar:
+        lifecycle.spawn("shard_scan", ShardScanner(kufar, coordinator).run())
+        waiters = [
+            asyncio.create_task(lifecycle.wait()),
+            asyncio.create_task(coordinator.became_leader.wait()),
+        ]
+        try:
+            await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+            await lifecycle.cancel("shard_scan")
+            await http_runner.cleanup()
+    return coordinator.is_leader and not lifecycle.stopping
 
-async def main():
-    config.validate()
 
+async def lead(lifecycle: Lifecycle, coordinator: Coordinator = None):
+    """Лидер (или единственный процесс): Telegram, состояние, очередь уведомлений и сканы."""
     # Инициализация состояния
     state = BotState()
 
-    # Собираем Telegram-бот
-    app = ApplicationBuilder().token(config.TELEGRAM_BOT_TOKEN).build()
+    # Справочник категорий: из кэша, а при первом запуске — из xlsx
+    catalog = get_catalog()
+    logger.info(f"Справочник категорий: {len(catalog)}")
+
+    # Собираем Telegram-бот. В режиме webhook апдейты приходят на наш
+    # HTTP-сервер, и Updater с long polling не нужен
+    webhook_secret = None
+    builder = ApplicationBuilder().token(config.TELEGRAM_BOT_TOKEN)
+    if config.TELEGRAM_WEBHOOK_URL:
+        webhook_secret = config.TELEGRAM_WEBHOOK_SECRET or secrets.token_urlsafe(32)
+        builder = builder.updater(None)
+    app = builder.build()
     app.bot_data["state"] = state
 
+    # Один HTTP-клиент Kufar на всё приложение (keep-alive + кэш DNS)
+    kufar = kufar_parser.KufarClient()
+    app.bot_data["kufar"] = kufar
+
+    # Очередь уведомлений: сканер кладёт, воркер отправляет. Пишет она через
+    # поток записи состояния — очередь ложится на диск раньше виденных ID
+    notify_queue = NotifyQueue(executor=state.writer)
+    app.bot_data["notify_queue"] = notify_queue
+
+    # Планировщик сканов; /watch добавляет в него категории на лету
+    app.bot_data["scheduler"] = ScanScheduler(app, coordinator=coordinator)
+
     # Регистрируем обработчики
     app.add_handler(CommandHandler("start", handle_start))
+    app.add_handler(CommandHandler("filter", handle_filter))
+    app.add_handler(CommandHandler("categories", handle_categories))
+    app.add_handler(CommandHandler("watch", handle_watch))
+    app.add_handler(CommandHandler("unwatch", handle_unwatch))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_button))
 
-    # Стартуем HTTP-сервер для health checks
-    http_runner = await start_http_server()
+    # Стартуем HTTP-сервер для health checks (и webhook, если включён)
+    http_runner = await start_http_server(app, webhook_secret)
+
+    async with app, kufar:
+        try:
+            await app.start()
+            if webhook_secret:
+                webhook_url = config.TELEGRAM_WEBHOOK_URL + config.TELEGRAM_WEBHOOK_PATH
+                await app.bot.set_webhook(
+                    webhook_url, secret_token=webhook_secret, allowed_updates=Update.ALL_TYPES,
+                )
+                logger.info(f"Апдейты Telegram принимаются через webhook: {webhook_url}")
+            else:
+                await app.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+                logger.info("Апдейты Telegram принимаются через long polling")
+
+            # Сканер и воркер уведомлений — в фоне; первый скан идёт сразу
+            lifecycle.spawn("scan", scan_loop(app))
+            lifecycle.spawn("notify", notify_queue.run(app.bot))
+            lifecycle.spawn("loop_lag", metrics.watch_event_loop_lag())
+            if config.CATEGORY_TAXONOMY_URL:
+                lifecycle.spawn("catalog", refresh_catalog(catalog), critical=False)
+            logger.info("Бот запущен. Ожидаю команды.")
+            await lifecycle.wait()
+        finally:
+            await shutdown(app, lifecycle, http_runner, coordinator)
+
+
+async def shutdown(app, lifecycle: Lifecycle, http_runner, coordinator: Coordinator = None):
+    """
+    Штатная остановка, по шагам:
+        1. больше не принимаем апдейты (long polling);
+        2. останавливаем сканер — скачанное к этому моменту уходит в очередь;
+        3. даём очереди уведомлений доотправиться, но не дольше SHUTDOWN_DRAIN_SECONDS;
+        4. останавливаем бота и HTTP-сервер, сбрасываем состояние на диск.
+
+    Если процесс перестал быть лидером, шаг 3 пропускается: очередь с диска
+    уже рассылает новый лидер, и доотправка дала бы дубли.
+    """
+    state: BotState = app.bot_data["state"]
+    notify_queue: NotifyQueue = app.bot_data["notify_queue"]
+    try:
+        if app.updater is not None and app.updater.running:
+            await app.updater.stop()
+        await lifecycle.cancel("scan")
+
+        if coordinator is not None and not coordinator.is_leader:
+            logger.warning("Лидер уже другой процесс — очередь уведомлений оставляем ему")
+        elif "notify" in lifecycle.running:
+            if await notify_queue.drain(config.SHUTDOWN_DRAIN_SECONDS):
+                logger.info("Очередь уведомлений отправлена")
+            else:
+                logger.warning(
+                    f"Не успели отправить {len(notify_queue)} уведомлений — уйдут после рестарта"
+                )
+        await lifecycle.cancel_all()
 
-    # Стартуем цикл сканирования в фоне
-    async with app:
-        asyncio.create_task(scan_loop(app))
-        logger.info("Бот запущен. Ожидаю команды.")
-        # Держим процесс живым
-        await asyncio.Event().wait()
+        if app.running:
+            await app.stop()
+        await http_runner.cleanup()
+    finally:
+        if coordinator is None or coordinator.is_leader:
+            await notify_queue.close()
+        await state.close()
+        logger.info("Состояние сохранено, бот остановлен")
 
 
 # ─── Точка входа ────────────────────────────────────────────────────────────
@@ -0,0 +1,266 @@
+"""
+Метрики пайплайна в формате Prometheus (text exposition 0.0.4).
+
+Без внешних зависимостей: счётчики, gauge и гистограммы с метками.
+Все метрики регистрируются в REGISTRY при объявлении, /metrics отдаёт
+REGISTRY.render().
+"""
+import asyncio
+import bisect
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+# Границы по умолчанию: секунды сетевых запросов
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 15.0)
+# Штуки: объявления на странице / новые за скан
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+# Секунды коротких задержек: запись на диск, отставание цикла событий
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List["_Metric"] = []
+
+    def register(self, metric: "_Metric"):
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), registry: Registry = None):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels: Dict[str, object]) -> LabelValues:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name}: ожидались метки {self.label_names}, получены {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _fmt_labels(self, values: LabelValues, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+        pairs = list(zip(self.label_names, values)) + list(extra)
+        if not pairs:
+            return ""
+        inner = ",".join(f'{k}="{_escape(v)}"' for k, v in pairs)
+        return "{" + inner + "}"
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{self._fmt_labels(k)} {_num(v)}" for k, v in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+        self._function: Optional[Callable[[], Optional[float]]] = None
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def value(self, **labels) -> Optional[float]:
+        return self._values.get(self._key(labels))
+
+    def set_function(self, function: Callable[[], Optional[float]]):
+        """Значение вычисляется при каждом чтении (только для метрик без меток)."""
+        self._function = function
+
+    def samples(self) -> List[str]:
+        if self._function is not None:
+            value = self._function()
+            return [] if value is None else [f"{self.name} {_num(value)}"]
+        return [f"{self.name}{self._fmt_labels(k)} {_num(v)}" for k, v in sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS, registry: Registry = None):
+        super().__init__(name, help, labels, registry)
+        self.buckets = tuple(sorted(buckets))
+        # метки → (счётчики по корзинам, сумма, количество)
+        self._values: Dict[LabelValues, List] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            entry[0][index] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def time(self, **labels) -> "_Timer":
+        return _Timer(self, labels)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{self._fmt_labels(key, (('le', _num(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{self._fmt_labels(key, (('le', '+Inf'),))} {count}")
+            lines.append(f"{self.name}_sum{self._fmt_labels(key)} {_num(total)}")
+            lines.append(f"{self.name}_count{self._fmt_labels(key)} {count}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: Dict[str, object]):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._started = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.monotonic() - self._started, **self._labels)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _num(value: float) -> str:
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+# ─── Метрики пайплайна ──────────────────────────────────────────────────────
+
+# Kufar
+KUFAR_FETCH_SECONDS = Histogram(
+    "kufar_fetch_seconds", "Время запроса к поисковому API Kufar")
+KUFAR_CONNECT_SECONDS = Histogram(
+    "kufar_connect_seconds", "Установка нового соединения с Kufar (DNS + TCP + TLS)")
+KUFAR_TTFB_SECONDS = Histogram(
+    "kufar_ttfb_seconds", "От начала запроса к Kufar до заголовков ответа")
+KUFAR_CONNECTIONS = Counter(
+    "kufar_connections_total", "Запросы к Kufar: соединение из пула (reused=true) или новое", ["reused"])
+KUFAR_RESPONSES = Counter(
+    "kufar_responses_total", "Ответы Kufar по HTTP-статусу (error — сетевая ошибка)", ["status"])
+KUFAR_RETRIES = Counter(
+    "kufar_retries_total", "Повторы запросов к Kufar по причине (throttled / server / network)", ["reason"])
+KUFAR_CIRCUIT_OPEN = Gauge(
+    "kufar_circuit_open", "Предохранитель эндпоинта Kufar разомкнут (1) или нет (0)", ["endpoint"])
+KUFAR_ADS_PER_PAGE = Histogram(
+    "kufar_ads_per_page", "Объявлений на разобранной странице", buckets=COUNT_BUCKETS)
+
+# Сканы
+SCANS = Counter(
+    "scans_total", "Сканы категорий по результату (ok / unchanged / empty / throttled / error)", ["category", "result"])
+SCAN_NEW_ADS = Histogram(
+    "scan_new_ads", "Новых объявлений за скан", ["category"], buckets=COUNT_BUCKETS)
+SCAN_ADS_CHECKED = Counter(
+    "scan_ads_checked_total", "Объявлений проверено на дубли", ["category"])
+SCAN_ADS_DUPLICATE = Counter(
+    "scan_ads_duplicate_total", "Из них уже виденных (попаданий в дедуп)", ["category"])
+SCAN_ADS_FILTERED = Counter(
+    "scan_ads_filtered_total", "Новых объявлений, отсеянных фильтрами", ["category"])
+LAST_SUCCESSFUL_SCAN = Gauge(
+    "last_successful_scan_timestamp_seconds", "Unix-время последнего успешного скана")
+SECONDS_SINCE_LAST_SCAN = Gauge(
+    "seconds_since_last_successful_scan", "Секунд с последнего успешного скана любой категории")
+
+# Отслеживание изменений
+TRACK_EVENTS = Counter(
+    "track_events_total", "События отслеживания (price_drop / relist)", ["kind"])
+TRACKED_ADS = Gauge(
+    "tracked_ads", "Объявлений в хранилище снимков")
+
+# Уведомления
+NOTIFY_SECONDS = Histogram(
+    "notify_send_seconds", "Время отправки сообщения в Telegram (включая повторы)")
+NOTIFY_SENT = Counter(
+    "notify_sent_total", "Отправлено сообщений (ad / photo / digest / price_drop / relist)", ["kind"])
+NOTIFY_FAILURES = Counter(
+    "notify_failures_total", "Ошибки отправки по причине", ["reason"])
+NOTIFY_PHOTO_CACHE = Counter(
+    "notify_photo_cache_total", "Фото в уведомлениях: hit — по file_id, miss — загрузка по URL", ["result"])
+NOTIFY_QUEUE_DEPTH = Gauge(
+    "notify_queue_depth", "Объявлений в очереди на отправку")
+
+# Координация процессов
+COORD_LEADER = Gauge(
+    "coordination_leader", "Этот процесс — лидер (1) или ведомый (0)")
+COORD_WORKERS = Gauge(
+    "coordination_workers", "Живых процессов в кольце")
+COORD_OWNED_CATEGORIES = Gauge(
+    "coordination_owned_categories", "Категорий, которые сканирует этот процесс")
+COORD_INBOX_ADS = Counter(
+    "coordination_inbox_ads_total", "Объявления во входящих лидера (pushed — от ведомого, pulled — лидером)",
+    ["direction"])
+
+# Состояние и цикл событий
+STATE_WRITE_SECONDS = Histogram(
+    "state_write_seconds", "Время фоновой записи состояния на диск", buckets=LAG_BUCKETS)
+STATE_WRITE_ERRORS = Counter(
+    "state_write_errors_total", "Неудачные записи состояния (будут повторены)")
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds", "На сколько позже заказанного просыпается задача в цикле событий",
+    buckets=LAG_BUCKETS)
+
+
+def mark_scan_success():
+    LAST_SUCCESSFUL_SCAN.set(time.time())
+
+
+def seconds_since_last_scan() -> Optional[float]:
+    last = LAST_SUCCESSFUL_SCAN.value()
+    return None if last is None else time.time() - last
+
+
+SECONDS_SINCE_LAST_SCAN.set_function(seconds_since_last_scan)
+
+
+async def watch_event_loop_lag(interval: float = 0.5):
+    """
+    Фоновая задача: засыпает на interval и меряет, насколько позже проснулась.
+    Всё, что блокирует цикл событий (синхронный диск, тяжёлый CPU), видно
+    в EVENT_LOOP_LAG.
+    """
+    while True:
+        started = time.monotonic()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, time.monotonic() - started - interval))
@@ -1,40 +1,42 @@
+import asyncio
+import html
+import json
 import logging
-from typing import Dict, Any
+import os
+from collections import OrderedDict
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
 
-from telegram import Bot
+from telegram import Bot, InputMediaPhoto
 from telegram.constants import ParseMode
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
 
 import config
+import metrics
+from parser import Ad
+from ratelimit import RateLimiter
+from tracking import AdEvent
 
 logger = logging.getLogger(__name__)
 
-
-async def notify_new_ad(bot: Bot, ad: Dict[str, Any]):
-    """Отправляет сообщение о новом объявлении в Telegram."""
-    text = _format_ad(ad)
-    try:
-        await bot.send_message(
-            chat_id=config.TELEGRAM_CHAT_ID,
-            text=text,
-            parse_mode=ParseMode.HTML,
-        )
-    except Exception as e:
-        logger.error(f"Не удалось отправить уведомление: {e}")
+# Лимиты Telegram на длину сообщения и подписи к фото
+MESSAGE_LIMIT = 4096
+CAPTION_LIMIT = 1024
 
 
-async def notify_missed_ads(bot: Bot, count: int):
-    """Сообщение о пропущенных объявлениях после Стопа."""
+async def notify_missed_ads(bot: Bot, chat_id: int, count: int, category_id: int, category_name: str):
+    """Сообщение о пропущенных объявлениях в категории после Стопа."""
     category_url = (
-        f"https://www.kufar.by/category/{config.KUFAR_CATEGORY_ID}"
+        f"https://www.kufar.by/category/{category_id}"
     )
     text = (
-        f"📦 Пока слежка была приостановлена, появилось <b>{count}</b> "
-        f"новых объявлений.\n\n"
+        f"📦 Пока слежка была приостановлена, в категории <b>{html.escape(category_name)}</b> "
+        f"появилось <b>{count}</b> новых объявлений.\n\n"
         f'<a href="{category_url}">Посмотреть на kufar.by →</a>'
     )
     try:
         await bot.send_message(
-            chat_id=config.TELEGRAM_CHAT_ID,
+            chat_id=chat_id,
             text=text,
             parse_mode=ParseMode.HTML,
         )
@@ -42,14 +44,524 @@ async def notify_missed_ads(bot: Bot, count: int):
         logger.error(f"Не удалось отправить сообщение о пропущенных: {e}")
 
 
-def _format_ad(ad: Dict[str, Any]) -> str:
+# ─── Кэш фото ───────────────────────────────────────────────────────────────
+
+class PhotoCache:
+    """
+    URL фото → file_id в Telegram (LRU на NOTIFY_PHOTO_CACHE_SIZE записей).
+
+    Первый раз Telegram сам скачивает фото по URL; в ответе приходит file_id,
+    и все следующие отправки того же фото (то же объявление другому чату,
+    повтор после ошибки) идут по нему, без повторной загрузки. Если фото
+    прямо сейчас загружается для другого чата, ждём его file_id, а не
+    грузим второй раз. Кэш живёт в памяти процесса.
+    """
+
+    def __init__(self, capacity: int = None):
+        self._capacity = capacity or config.NOTIFY_PHOTO_CACHE_SIZE
+        self._file_ids: "OrderedDict[str, str]" = OrderedDict()
+        self._uploading: Dict[str, asyncio.Event] = {}
+
+    def __len__(self) -> int:
+        return len(self._file_ids)
+
+    def get(self, url: str) -> str:
+        """Что передать Telegram: file_id, если фото уже загружалось, иначе сам URL."""
+        file_id = self._file_ids.get(url)
+        if file_id is None:
+            metrics.NOTIFY_PHOTO_CACHE.inc(result="miss")
+            return url
+        self._file_ids.move_to_end(url)
+        metrics.NOTIFY_PHOTO_CACHE.inc(result="hit")
+        return file_id
+
+    async def resolve(self, urls: List[str]) -> List[str]:
+        """Как get(), но сначала дожидается загрузок этих URL, которые уже идут."""
+        for event in {self._uploading[url] for url in urls if url in self._uploading}:
+            await event.wait()
+        return [self.get(url) for url in urls]
+
+    def start_upload(self, urls: List[str]) -> asyncio.Event:
+        """Помечает URL как загружаемые; событие выставляется в finish_upload()."""
+        event = asyncio.Event()
+        for url in urls:
+            self._uploading.setdefault(url, event)
+        return event
+
+    def finish_upload(self, urls: List[str], event: asyncio.Event):
+        for url in urls:
+            if self._uploading.get(url) is event:
+                del self._uploading[url]
+        event.set()
+
+    def put(self, url: str, file_id: str):
+        self._file_ids[url] = file_id
+        self._file_ids.move_to_end(url)
+        while len(self._file_ids) > self._capacity:
+            self._file_ids.popitem(last=False)
+
+    def discard(self, urls: List[str]):
+        for url in urls:
+            self._file_ids.pop(url, None)
+
+
+# ─── Очередь уведомлений ────────────────────────────────────────────────────
+
+class Notice(NamedTuple):
+    """Элемент очереди: чат, объявление и, если это не просто новое, — событие."""
+    chat_id: int
+    ad: Ad
+    event: Optional[AdEvent] = None
+
+    @property
+    def key(self) -> Tuple[int, int, Optional[str]]:
+        return self.chat_id, self.ad.id, self.event.kind if self.event else None
+
+
+class NotifyQueue:
+    """
+    Очередь новых объявлений между сканером и Telegram.
+
+    Элемент очереди — Notice (чат, объявление, событие). Событие есть у
+    снижения цены и перевыкладки (tracking.py) — такие уходят отдельным
+    сообщением и в сводку не попадают. Сканер кладёт элементы через put_many
+    и сразу идёт дальше, а фоновый воркер (run) отправляет с учётом лимитов
+    Telegram. Очередь лежит на диске, элемент удаляется из неё только после
+    успешной отправки — так неотправленное переживает рестарт.
+
+    На диске — снимок (NOTIFY_QUEUE_FILE) и журнал (NOTIFY_QUEUE_JOURNAL_FILE):
+    put_many дописывает в журнал добавленное, отправленное копится
+    STATE_WRITE_DELAY секунд и уходит одной строкой. Когда журнал становится
+    длиннее очереди, он сворачивается в новый снимок. Пишет поток записи
+    (тот же, что у BotState, если его передали), цикл событий диск не ждёт;
+    добавление уходит в поток сразу — раньше, чем сканер отдаст на запись
+    виденные ID.
+
+    Если для чата накопилось NOTIFY_DIGEST_THRESHOLD и больше объявлений,
+    они уходят ему одним сводным сообщением (до NOTIFY_DIGEST_MAX штук).
+
+    С NOTIFY_PHOTOS объявление с фото уходит фото или альбомом с подписью.
+    Такие отправки идут отдельными задачами, не больше
+    NOTIFY_PHOTO_CONCURRENCY одновременно, а воркер тем временем шлёт
+    текстовые уведомления дальше.
+    """
+
+    def __init__(self, path: str = None, journal_path: str = None, executor: Executor = None):
+        self._path = path or config.NOTIFY_QUEUE_FILE
+        self._journal_path = journal_path or config.NOTIFY_QUEUE_JOURNAL_FILE
+        self._gen = 0                      # поколение снимка; журнал другого поколения устарел
+        self._journal_lines = 0
+        self._needs_compact = False        # следующая запись — снимок целиком
+        self._items: List[Notice] = self._load()
+        self._keys = {item.key for item in self._items}
+        self._owns_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix="notify-writer")
+        self._writes: Set[asyncio.Future] = set()
+        self._sent_keys: List[Tuple] = []  # отправленные, ещё не в журнале
+        self._flusher: Optional[asyncio.Task] = None
+        self._ready = asyncio.Event()
+        self._idle = asyncio.Event()       # очередь пуста, воркер ничего не отправляет
+        self._global_limiter = RateLimiter(config.NOTIFY_GLOBAL_RPS)
+        self._chat_limiters: Dict[int, RateLimiter] = {}
+        self._photos = PhotoCache()
+        self._photo_slots = asyncio.Semaphore(config.NOTIFY_PHOTO_CONCURRENCY)
+        self._photo_tasks: Set[asyncio.Task] = set()
+        self._in_flight: Set[Tuple] = set()    # ключи элементов, которые сейчас отправляются фото
+        metrics.NOTIFY_QUEUE_DEPTH.set_function(lambda: len(self._items))
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    # ─── Диск ───────────────────────────────────────────────────────────
+
+    def _load(self) -> List[Notice]:
+        items: List[Notice] = []
+        try:
+            with open(self._path, "r") as f:
+                data = json.load(f)
+            if isinstance(data, list):
+                data = {"gen": 0, "items": data}  # формат до журнала
+            self._gen = int(data["gen"])
+            items = [_item_from_dict(item) for item in data["items"]]
+        except FileNotFoundError:
+            pass
+        except (json.JSONDecodeError, OSError, TypeError, KeyError, ValueError) as e:
+            logger.error(f"Очередь уведомлений повреждена, начинаем с пустой: {e}")
+            self._needs_compact = True
+            return []
+
+        items = self._replay_journal(items)
+        if items:
+            logger.info(f"В очереди с прошлого запуска: {len(items)} объявлений")
+        return items
+
+    def _replay_journal(self, items: List[Notice]) -> List[Notice]:
+        try:
+            with open(self._journal_path, "r") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            lines = []
+        try:
+            header = json.loads(lines[0]) if lines else None
+        except json.JSONDecodeError:
+            header = None
+        if header is None or header.get("gen") != self._gen:
+            # Журнала нет или он старше снимка (упали посреди свёртки) — начнём новый
+            self._needs_compact = True
+            return items
+
+        by_key = {item.key: item for item in items}
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+                if "add" in record:
+                    item = _item_from_dict(record["add"])
+                    by_key.setdefault(item.key, item)
+                else:
+                    for key in record["done"]:
+                        by_key.pop(tuple(key), None)
+            except (json.JSONDecodeError, TypeError, KeyError, ValueError):
+                # Недописанная последняя строка после падения
+                logger.warning("Пропускаем битую строку журнала очереди уведомлений")
+        self._journal_lines = len(lines) - 1
+        return list(by_key.values())
+
+    def _submit(self, records: List[Dict]):
+        """Отдаёт строки журнала потоку записи; если журнал разросся — сворачивает в снимок."""
+        self._journal_lines += len(records)
+        snapshot = None
+        limit = max(config.NOTIFY_JOURNAL_COMPACT_EVERY, 2 * len(self._items))
+        if self._needs_compact or self._journal_lines > limit:
+            # В снимке уже нет отправленного — копить их больше незачем
+            self._gen += 1
+            snapshot = [_item_to_dict(item) for item in self._items]
+            records = []
+            self._sent_keys = []
+            self._journal_lines = 0
+            self._needs_compact = False
+        gen = self._gen
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write(records, snapshot, gen)
+            return
+        future = loop.run_in_executor(self._executor, self._write, records, snapshot, gen)
+        self._writes.add(future)
+        future.add_done_callback(self._on_written)
+
+    def _on_written(self, future: asyncio.Future):
+        self._writes.discard(future)
+        if future.cancelled() or future.exception() is None:
+            return
+        # Что не легло в журнал, ляжет в следующий снимок целиком
+        metrics.STATE_WRITE_ERRORS.inc()
+        logger.error(f"Не удалось записать очередь уведомлений, повтор: {future.exception()}")
+        self._needs_compact = True
+        self._schedule_flush()
+
+    def _write(self, records: List[Dict], snapshot: Optional[List[Dict]], gen: int):
+        """Выполняется в потоке записи."""
+        if snapshot is not None:
+            _write_atomic(self._path, {"gen": gen, "items": snapshot})
+            with open(self._journal_path, "w") as f:
+                f.write(json.dumps({"gen": gen}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            return
+        with open(self._journal_path, "a") as f:
+            f.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _schedule_flush(self):
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_later(), name="notify-writer")
+
+    async def _flush_later(self):
+        await asyncio.sleep(config.STATE_WRITE_DELAY)
+        self._flush_sent()
+
+    def _flush_sent(self):
+        if self._sent_keys or self._needs_compact:
+            records = [{"done": self._sent_keys}] if self._sent_keys else []
+            self._sent_keys = []
+            self._submit(records)
+
+    async def close(self):
+        """Дописывает отправленное и ждёт записи на диск, но не дольше STATE_FLUSH_TIMEOUT."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+        self._flush_sent()
+        pending = set()
+        if self._writes:
+            _, pending = await asyncio.wait(set(self._writes), timeout=config.STATE_FLUSH_TIMEOUT)
+            if pending:
+                logger.error("Очередь уведомлений не дописана на диск до остановки")
+        if self._owns_executor:
+            self._executor.shutdown(wait=not pending)
+
+    # ─── Производитель ──────────────────────────────────────────────────
+
+    def put_many(self, items: List[Tuple]):
+        """
+        Кладёт в очередь пары (чат, объявление) или тройки (чат, объявление,
+        событие) — одна строка журнала на элемент, одна запись на весь вызов.
+        """
+        added = []
+        for item in items:
+            item = Notice(*item)
+            if item.key in self._keys:
+                continue
+            self._items.append(item)
+            self._keys.add(item.key)
+            added.append(item)
+        if added:
+            self._submit([{"add": _item_to_dict(item)} for item in added])
+            self._idle.clear()
+            self._ready.set()
+
+    # ─── Потребитель ────────────────────────────────────────────────────
+
+    async def run(self, bot: Bot):
+        """Воркер: бесконечно разбирает очередь и шлёт в Telegram."""
+        try:
+            while True:
+                ready = [item for item in self._items if item.key not in self._in_flight]
+                if not ready:
+                    self._ready.clear()
+                    if not self._items:
+                        self._idle.set()
+                    await self._ready.wait()
+                    continue
+
+                # Берём чат из головы очереди и всё, что для него накопилось
+                head = ready[0]
+                chat_id = head.chat_id
+                pending = [item for item in ready if item.chat_id == chat_id and item.event is None]
+
+                if head.event is not None:
+                    batch = [head]
+                    text = _format_event(head.event)
+                    kind = head.event.kind
+                elif len(pending) >= config.NOTIFY_DIGEST_THRESHOLD:
+                    text, count = _format_digest([item.ad for item in pending[:config.NOTIFY_DIGEST_MAX]])
+                    batch = pending[:count]
+                    kind = "digest"
+                elif config.NOTIFY_PHOTOS and head.ad.images:
+                    self._start_photo_send(bot, head)
+                    continue
+                else:
+                    batch = pending[:1]
+                    text = _format_ad(batch[0].ad)
+                    kind = "ad"
+
+                with metrics.NOTIFY_SECONDS.time():
+                    sent, _ = await self._send(bot, chat_id, text)
+                if sent:
+                    metrics.NOTIFY_SENT.inc(kind=kind)
+                self._done(batch)
+        finally:
+            # Недоотправленные фото остаются в очереди на диске
+            for task in self._photo_tasks:
+                task.cancel()
+            await asyncio.gather(*self._photo_tasks, return_exceptions=True)
+            self._in_flight.clear()
+
+    def _done(self, batch: List[Notice]):
+        """Отправлено (или выброшено как неотправляемое) — убираем из очереди."""
+        done = {item.key for item in batch}
+        self._items = [item for item in self._items if item.key not in done]
+        self._keys -= done
+        self._sent_keys.extend(done)
+        self._schedule_flush()
+
+    # ─── Фото ───────────────────────────────────────────────────────────
+
+    def _start_photo_send(self, bot: Bot, item: Notice):
+        self._in_flight.add(item.key)
+        task = asyncio.create_task(self._photo_send(bot, item))
+        self._photo_tasks.add(task)
+        task.add_done_callback(self._photo_tasks.discard)
+
+    async def _photo_send(self, bot: Bot, item: Notice):
+        try:
+            async with self._photo_slots:
+                with metrics.NOTIFY_SECONDS.time():
+                    sent = await self._send_photos(bot, item)
+                if sent:
+                    metrics.NOTIFY_SENT.inc(kind="photo")
+                else:
+                    # Фото Telegram не принял (битый URL, устаревший file_id) — шлём текстом
+                    sent, _ = await self._send(bot, item.chat_id, _format_ad(item.ad))
+                    if sent:
+                        metrics.NOTIFY_SENT.inc(kind="ad")
+            self._done([item])
+        finally:
+            self._in_flight.discard(item.key)
+            self._ready.set()
+
+    async def _send_photos(self, bot: Bot, item: Notice) -> bool:
+        """Одно фото или альбом с подписью; file_id из ответа запоминаются."""
+        urls = item.ad.images[:config.NOTIFY_PHOTOS_MAX]
+        caption = _format_ad(item.ad)
+        if len(caption) > CAPTION_LIMIT:
+            return False
+        media = await self._photos.resolve(urls)
+        uploads = [url for url, photo in zip(urls, media) if photo == url]
+        upload = self._photos.start_upload(uploads)
+        try:
+            if len(media) == 1:
+                sent, message = await self._send_request(
+                    item.chat_id,
+                    lambda: bot.send_photo(
+                        chat_id=item.chat_id, photo=media[0], caption=caption, parse_mode=ParseMode.HTML,
+                    ),
+                )
+                messages = [message]
+            else:
+                # Подпись альбома — у первого фото
+                album = [
+                    InputMediaPhoto(photo, caption=caption if i == 0 else None, parse_mode=ParseMode.HTML)
+                    for i, photo in enumerate(media)
+                ]
+                sent, messages = await self._send_request(
+                    item.chat_id, lambda: bot.send_media_group(chat_id=item.chat_id, media=album),
+                )
+            if not sent:
+                self._photos.discard(urls)
+                return False
+
+            for url, message in zip(urls, messages or ()):
+                photo = getattr(message, "photo", None)
+                if photo:
+                    # Самый большой размер — последний
+                    self._photos.put(url, photo[-1].file_id)
+            return True
+        finally:
+            self._photos.finish_upload(uploads, upload)
+
+    # ─── Отправка ───────────────────────────────────────────────────────
+
+    async def drain(self, timeout: float) -> bool:
+        """
+        Ждёт, пока воркер отправит всё из очереди, но не дольше timeout.
+        True — очередь пуста; иначе остаток лежит на диске до следующего запуска.
+        """
+        if not self._items:
+            return True
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return not self._items
+
+    async def _send(self, bot: Bot, chat_id: int, text: str) -> Tuple[bool, Any]:
+        return await self._send_request(
+            chat_id, lambda: bot.send_message(chat_id=chat_id, text=text, parse_mode=ParseMode.HTML),
+        )
+
+    async def _send_request(self, chat_id: int, request: Callable[[], Awaitable]) -> Tuple[bool, Any]:
+        """
+        Выполняет запрос к Telegram, пока не получится; возвращает (успех, ответ).
+        RetryAfter — ждём сколько сказал Telegram; сетевые ошибки — повтор с backoff.
+        Ошибки, которые повтором не лечатся (BadRequest, Forbidden), — в лог и False.
+        """
+        chat_limiter = self._chat_limiters.get(chat_id)
+        if chat_limiter is None:
+            chat_limiter = self._chat_limiters[chat_id] = RateLimiter(config.NOTIFY_CHAT_RPS)
+
+        delay = 1.0
+        while True:
+            await chat_limiter.acquire()
+            await self._global_limiter.acquire()
+            try:
+                return True, await request()
+            except RetryAfter as e:
+                metrics.NOTIFY_FAILURES.inc(reason="retry_after")
+                logger.warning(f"Telegram просит подождать {e.retry_after}с")
+                await asyncio.sleep(e.retry_after)
+            except (BadRequest, Forbidden) as e:
+                metrics.NOTIFY_FAILURES.inc(reason="rejected")
+                logger.error(f"Не удалось отправить уведомление, пропускаем: {e}")
+                return False, None
+            except NetworkError as e:
+                metrics.NOTIFY_FAILURES.inc(reason="network")
+                logger.warning(f"Сетевая ошибка Telegram, повтор через {delay:.0f}с: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, config.NOTIFY_RETRY_MAX)
+            except TelegramError as e:
+                metrics.NOTIFY_FAILURES.inc(reason="telegram")
+                logger.error(f"Не удалось отправить уведомление, пропускаем: {e}")
+                return False, None
+
+
+def _write_atomic(path: str, data: Any):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _item_to_dict(item: Notice) -> Dict:
+    data = {"chat_id": item.chat_id, "ad": item.ad.to_dict()}
+    if item.event is not None:
+        data["event"] = item.event.to_dict()
+    return data
+
+
+def _item_from_dict(data: Dict) -> Notice:
+    if "chat_id" not in data:
+        # Старый формат очереди — голое объявление для TELEGRAM_CHAT_ID
+        return Notice(config.TELEGRAM_CHAT_ID, Ad.from_dict(data))
+    ad = Ad.from_dict(data["ad"])
+    event = AdEvent.from_dict(data["event"], ad) if data.get("event") else None
+    return Notice(int(data["chat_id"]), ad, event)
+
+
+def _format_ad(ad: Ad) -> str:
     """Форматирует объявление в текст для Telegram."""
-    title = ad.get("title", "Без названия")
-    price = ad.get("price", "Цена не указана")
-    url = ad.get("url", "")
+    title = html.escape(ad.title or "Без названия")
+    price = ad.price
+    url = ad.url
 
     return (
         f"🆕 <b>{title}</b>\n"
         f"💰 {price}\n\n"
         f'<a href="{url}">Открыть объявление →</a>'
     )
+
+
+def _format_event(event: AdEvent) -> str:
+    """Сообщение о снижении цены или перевыкладке."""
+    ad = event.ad
+    title = html.escape(ad.title or "Без названия")
+    old_price = f"{event.old_price:,} Br".replace(",", " ") if event.old_price else "Цена не указана"
+    if event.kind == "price_drop":
+        header = f"📉 Цена снижена: <b>{title}</b>\n💰 <s>{old_price}</s> → {ad.price}"
+    else:
+        header = (
+            f"🔁 Похоже, перевыложено: <b>{title}</b>\n💰 {ad.price} (было {old_price})\n"
+            f'Прежнее объявление: https://www.kufar.by/item/{event.previous_id}'
+        )
+    return f'{header}\n\n<a href="{ad.url}">Открыть объявление →</a>'
+
+
+def _format_digest(ads: List[Ad]) -> Tuple[str, int]:
+    """
+    Сводка из нескольких объявлений одним сообщением.
+    Возвращает текст и сколько объявлений в него влезло (лимит MESSAGE_LIMIT).
+    """
+    lines = []
+    length = 64  # запас под заголовок
+    for ad in ads:
+        title = html.escape(ad.title or "Без названия")
+        line = f'\n• <a href="{ad.url}">{title}</a> — {ad.price}'
+        if lines and length + len(line) > MESSAGE_LIMIT:
+            break
+        lines.append(line)
+        length += len(line)
+    header = f"🆕 Новых объявлений: <b>{len(lines)}</b>\n"
+    return header + "".join(lines), len(lines)
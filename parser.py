@@ -1,14 +1,26 @@
+import asyncio
 import aiohttp
+import hashlib
+import json
 import logging
-from typing import List, Dict, Any
+import re
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
 
 import config
+import metrics
+from resilience import CircuitBreaker, decorrelated_jitter, parse_retry_after
 
 logger = logging.getLogger(__name__)
 
 # Реальный API эндпоинт kufar.by
 KUFAR_API_URL = "https://api.kufar.by/search-api/v2/search/rendered-paginated"
 
+# Фото объявлений из хранилища rms: путь из images[].path приклеивается сюда
+KUFAR_IMAGE_URL = "https://rms.kufar.by/v1/gallery/"
+
 # Заголовки — имитируем обычный браузер
 HEADERS = {
     "User-Agent": (
@@ -22,42 +34,527 @@ HEADERS = {
 }
 
 
-async def fetch_ads(category_id: int = None) -> List[Dict[str, Any]]:
+# Быстрый JSON, если установлен; иначе — стандартный json
+try:
+    import orjson
+    _json_loads = orjson.loads
+    JSON_BACKEND = "orjson"
+except ImportError:  # pragma: no cover — зависит от окружения
+    _json_loads = json.loads
+    JSON_BACKEND = "json"
+
+# ad_id и цена в сыром JSON — чтобы снять отпечаток, не разбирая весь ответ.
+# В отпечаток идут все объявления страницы с ценами, чтобы снижение цены
+# любого из них не пряталось за «страница не изменилась»
+_AD_ID_RE = re.compile(rb'"(?:ad_id|price_byn)"\s*:\s*"?(\d+)')
+
+
+class KufarError(Exception):
+    """Kufar не ответил или ответил не 200."""
+
+    def __init__(self, message: str, status: int = None, retry_after: float = None):
+        super().__init__(message)
+        self.status = status                # HTTP-статус; None — сетевая ошибка / таймаут
+        self.retry_after = retry_after      # через сколько секунд имеет смысл повторить
+
+    @property
+    def retryable(self) -> bool:
+        """Повтор может помочь: сеть, 5xx, 429. Прочие 4xx — нет."""
+        return self.status is None or self.status == 429 or self.status >= 500
+
+
+class KufarThrottled(KufarError):
+    """Kufar просит сбавить темп (429)."""
+
+
+class KufarCircuitOpen(KufarError):
+    """Предохранитель эндпоинта разомкнут — запрос даже не отправлялся."""
+
+
+class KufarBadPayload(KufarError):
+    """Kufar ответил 200, но не JSON выдачи (HTML, капча, обрезанный ответ)."""
+
+
+@dataclass
+class FetchResult:
     """
-    Тянет список объявлений с kufar.by для указанной категории.
-    Возвращает список словарей с полями:
-        id, title, price, url
+    Типизированный итог выборки:
+        ok         — объявления получены (или страница не изменилась)
+        empty      — Kufar ответил 200, но без единого объявления
+        throttled  — 429, ждать retry_after
+        error      — сеть, 5xx, разомкнутый предохранитель и прочее
+    """
+    status: str
+    ads: List["Ad"] = field(default_factory=list)
+    retry_after: Optional[float] = None
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status in ("ok", "empty")
+
+    @classmethod
+    def from_error(cls, error: KufarError) -> "FetchResult":
+        status = "throttled" if isinstance(error, KufarThrottled) else "error"
+        return cls(status, retry_after=error.retry_after, error=str(error))
+
+
+# ─── Объявление ─────────────────────────────────────────────────────────────
+
+class Ad:
+    """
+    Компактная запись объявления — только поля, которые нужны дальше по цепочке.
+    Цены и время публикации хранятся как их прислал Kufar (строкой),
+    в текст / datetime переводятся по запросу.
+    """
+
+    __slots__ = ("id", "title", "price_byn", "price_usd", "region", "list_time", "seller_id", "images")
+
+    def __init__(
+        self,
+        id: int,
+        title: str,
+        price_byn: Optional[str] = None,
+        price_usd: Optional[str] = None,
+        region: Optional[int] = None,
+        list_time: Optional[str] = None,
+        seller_id: Optional[int] = None,
+        images: Optional[List[str]] = None,
+    ):
+        self.id = id
+        self.title = title
+        self.price_byn = price_byn
+        self.price_usd = price_usd
+        self.region = region           # код области Kufar (параметр region)
+        self.list_time = list_time     # когда опубликовано / поднято, ISO 8601 UTC
+        self.seller_id = seller_id     # account_id продавца
+        self.images = images           # URL фото (первые NOTIFY_PHOTOS_MAX), только с NOTIFY_PHOTOS
+
+    @property
+    def url(self) -> str:
+        return f"https://www.kufar.by/item/{self.id}"
+
+    @property
+    def price(self) -> str:
+        return _format_price(self.price_byn, self.price_usd)
+
+    @property
+    def listed_at(self) -> Optional[datetime]:
+        """Время публикации (aware UTC) или None, если Kufar его не прислал."""
+        if not self.list_time:
+            return None
+        try:
+            listed = datetime.fromisoformat(self.list_time)
+        except ValueError:
+            return None
+        if listed.tzinfo is None:
+            listed = listed.replace(tzinfo=timezone.utc)
+        return listed
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Ad":
+        return cls(**{name: data.get(name) for name in cls.__slots__})
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Ad) and self.to_dict() == other.to_dict()
+
+    def __repr__(self) -> str:
+        return f"Ad(id={self.id!r}, title={self.title!r}, price={self.price!r})"
+
+
+# ─── Тайминги запросов ──────────────────────────────────────────────────────
+
+@dataclass
+class RequestTiming:
+    """Тайминги одного запроса к Kufar (секунды)."""
+    connect: Optional[float] = None   # установка соединения; None — соединение из пула
+    ttfb: Optional[float] = None      # до первого байта ответа
+    total: Optional[float] = None     # весь запрос целиком
+    reused: bool = False              # соединение взято из keep-alive пула
+
+
+def _make_trace_config() -> aiohttp.TraceConfig:
+    """Собирает TraceConfig, который пишет тайминги в trace_request_ctx."""
+
+    async def on_request_start(session, ctx, params):
+        ctx.started = time.monotonic()
+        ctx.timing = ctx.trace_request_ctx["timing"]
+
+    async def on_connection_create_start(session, ctx, params):
+        ctx.conn_started = time.monotonic()
+
+    async def on_connection_create_end(session, ctx, params):
+        ctx.timing.connect = time.monotonic() - ctx.conn_started
+
+    async def on_connection_reuseconn(session, ctx, params):
+        ctx.timing.reused = True
+
+    async def on_request_end(session, ctx, params):
+        # Заголовки ответа получены — это и есть первый байт
+        ctx.timing.ttfb = time.monotonic() - ctx.started
+
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(on_request_start)
+    trace.on_connection_create_start.append(on_connection_create_start)
+    trace.on_connection_create_end.append(on_connection_create_end)
+    trace.on_connection_reuseconn.append(on_connection_reuseconn)
+    trace.on_request_end.append(on_request_end)
+    return trace
+
+
+# ─── Отпечатки страниц ──────────────────────────────────────────────────────
+
+@dataclass
+class PageValidator:
+    """Чем можно проверить, что первая страница не изменилась с прошлого скана."""
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    fingerprint: Optional[str] = None   # хэш ID и цен всех объявлений страницы
+
+
+@dataclass
+class FetchStats:
+    """Что произошло за одну выборку iter_ads."""
+    pages: int = 0                      # сколько страниц реально скачали и разобрали
+    unchanged: Optional[str] = None     # "not_modified" | "fingerprint" — если сработал шорткат
+
+
+class _Page(NamedTuple):
+    data: Optional[Dict[str, Any]]      # None — страница не изменилась, не разбирали
+    validator: PageValidator
+    unchanged: Optional[str]
+
+
+def _fingerprint(raw: bytes) -> str:
+    return hashlib.blake2b(b",".join(_AD_ID_RE.findall(raw)), digest_size=16).hexdigest()
+
+
+# ─── Клиент Kufar ───────────────────────────────────────────────────────────
+
+class KufarClient:
     """
+    Долгоживущий клиент kufar.by.
+    Держит одну aiohttp-сессию с ограниченным keep-alive пулом и кэшем DNS,
+    чтобы каждый скан не платил за DNS + TCP + TLS заново.
+
+    Открывается один раз при старте (start) и закрывается при остановке (close).
+    """
+
+    def __init__(self):
+        self._session: Optional[aiohttp.ClientSession] = None
+        # Отпечаток первой страницы по каждой выдаче — категории вместе с серверными
+        # фильтрами (для условных запросов)
+        self._validators: Dict[Tuple, PageValidator] = {}
+        # Предохранитель на каждый эндпоинт
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    async def start(self):
+        if self._session is not None:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=config.KUFAR_POOL_LIMIT,
+            ttl_dns_cache=config.KUFAR_DNS_CACHE_TTL,
+            keepalive_timeout=config.KUFAR_KEEPALIVE_TIMEOUT,
+        )
+        self._session = aiohttp.ClientSession(
+            headers=HEADERS,
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=15),
+            trace_configs=[_make_trace_config()],
+        )
+        logger.info("Kufar-клиент запущен")
+
+    async def close(self):
+        if self._session is None:
+            return
+        await self._session.close()
+        self._session = None
+        logger.info("Kufar-клиент закрыт")
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def reset_validators(self, category_id: int):
+        """Забывает отпечатки выдачи категории: следующая первая страница разберётся целиком."""
+        cat = str(category_id)
+        for key in [k for k in self._validators if dict(k).get("cat") == cat]:
+            del self._validators[key]
+
+    async def iter_ads(
+        self,
+        category_id: int = None,
+        is_known: Callable[[int], bool] = None,
+        max_pages: int = None,
+        max_seconds: float = None,
+        throttle: Callable[[], Awaitable[Any]] = None,
+        conditional: bool = False,
+        stats: FetchStats = None,
+        extra_params: Dict[str, Any] = None,
+        on_page: Callable[[List[Ad]], Awaitable[Any]] = None,
+    ) -> AsyncIterator[Ad]:
+        """
+        Инкрементальная выборка: отдаёт объявления страница за страницей
+        (новые первыми) и идёт по курсору дальше, только пока на странице
+        нет уже известных ID.
+
+        Останавливается, когда:
+            • на странице встретился ID, для которого is_known(id) == True
+              (страница отдаётся целиком — дедуп делает вызывающий);
+            • пройдено max_pages страниц (по умолчанию KUFAR_MAX_PAGES);
+            • прошло max_seconds с начала (по умолчанию KUFAR_MAX_FETCH_SECONDS);
+            • у Kufar больше нет страниц.
+
+        throttle — корутина, которую ждём перед каждым запросом (лимит RPS).
+
+        conditional=True — первая страница запрашивается условно: с ETag /
+        Last-Modified прошлого ответа, а если Kufar их не шлёт — сравнивается
+        отпечаток ID и цен страницы. Если страница не изменилась, JSON не разбирается
+        и ничего не отдаётся. Отпечаток запоминается только после того, как
+        выборка дошла до конца без ошибки: иначе следующий скан принял бы
+        первую страницу за «не изменилась» и не добрал бы остальные.
+
+        stats — сюда пишется, сколько страниц скачано и сработал ли шорткат.
+        extra_params — дополнительные параметры поиска (серверные фильтры).
+        on_page — корутина, которую ждём с объявлениями каждой страницы до
+        первого is_known по ним (например, поднять их историю из хранилища).
+        Ошибки запроса пробрасываются как KufarError.
+        """
+        if max_pages is None:
+            max_pages = config.KUFAR_MAX_PAGES
+        if max_seconds is None:
+            max_seconds = config.KUFAR_MAX_FETCH_SECONDS
+
+        if stats is None:
+            stats = FetchStats()
+
+        params = _search_params(category_id, extra_params)
+        validator_key = _validator_key(params)
+        new_validator = None
+        deadline = time.monotonic() + max_seconds
+
+        for page_num in range(1, max_pages + 1):
+            if throttle is not None:
+                await throttle()
+            validator = None
+            if conditional and page_num == 1:
+                validator = self._validators.get(validator_key)
+            page = await self._request(params, validator)
+
+            if page.unchanged:
+                stats.unchanged = page.unchanged
+                logger.debug(f"Категория {params['cat']}: страница не изменилась ({page.unchanged})")
+                return
+            stats.pages += 1
+            data = page.data
+            ads = _parse_response(data)
+            metrics.KUFAR_ADS_PER_PAGE.observe(len(ads))
+            if on_page is not None:
+                await on_page(ads)
+
+            reached_known = False
+            for ad in ads:
+                if is_known is not None and is_known(ad.id):
+                    reached_known = True
+                yield ad
+
+            if conditional and page_num == 1:
+                new_validator = page.validator
+
+            if reached_known:
+                break
+            cursor = _next_cursor(data)
+            if cursor is None:
+                break
+            if time.monotonic() >= deadline:
+                logger.info(f"Категория {params['cat']}: остановились на странице {page_num} по времени")
+                break
+            params = dict(params, cursor=cursor)
+        else:
+            logger.info(f"Категория {params['cat']}: дошли до лимита в {max_pages} стр.")
+
+        if new_validator is not None:
+            self._validators[validator_key] = new_validator
+
+    async def _request(self, params: Dict[str, Any], validator: PageValidator = None) -> _Page:
+        """
+        GET к поисковому API с политикой повторов.
+
+        Сеть, 5xx и 429 повторяются до KUFAR_RETRY_ATTEMPTS раз с паузой
+        decorrelated jitter; 429 ждёт столько, сколько сказал Retry-After
+        (если это не дольше KUFAR_RETRY_AFTER_MAX — иначе ошибка уходит
+        планировщику). Сеть, 5xx и не-JSON вместо выдачи считаются предохранителем эндпоинта:
+        пока он разомкнут, запросы не уходят вовсе (KufarCircuitOpen).
+        """
+        endpoint = KUFAR_API_URL
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            breaker = self._breakers[endpoint] = CircuitBreaker(
+                config.KUFAR_BREAKER_THRESHOLD, config.KUFAR_BREAKER_RESET,
+            )
+
+        delay = config.KUFAR_RETRY_BASE
+        for attempt in range(1, config.KUFAR_RETRY_ATTEMPTS + 1):
+            if not breaker.allow():
+                raise KufarCircuitOpen(
+                    f"Предохранитель Kufar разомкнут, повтор через {breaker.retry_in():.0f}с",
+                    retry_after=breaker.retry_in(),
+                )
+            try:
+                page = await self._request_once(params, validator)
+            except KufarError as e:
+                # Не-JSON вместо выдачи (капча, заглушка) — эндпоинт неисправен, как при 5xx
+                if e.status is None or e.status >= 500 or isinstance(e, KufarBadPayload):
+                    if breaker.record_failure():
+                        logger.warning(f"Предохранитель Kufar разомкнут на {config.KUFAR_BREAKER_RESET:.0f}с: {e}")
+                else:
+                    # Kufar ответил (429, 4xx) — сервер жив, предохранителю это успех
+                    breaker.record_success()
+                metrics.KUFAR_CIRCUIT_OPEN.set(int(breaker.state != CircuitBreaker.CLOSED), endpoint="search")
+                if breaker.state != CircuitBreaker.CLOSED:
+                    raise KufarCircuitOpen(
+                        f"{e}; предохранитель разомкнут, повтор через {breaker.retry_in():.0f}с",
+                        status=e.status,
+                        retry_after=breaker.retry_in(),
+                    ) from e
+                if not e.retryable or attempt == config.KUFAR_RETRY_ATTEMPTS:
+                    raise
+                if e.retry_after is not None:
+                    if e.retry_after > config.KUFAR_RETRY_AFTER_MAX:
+                        raise
+                    wait = e.retry_after
+                else:
+                    delay = wait = decorrelated_jitter(delay, config.KUFAR_RETRY_BASE, config.KUFAR_RETRY_CAP)
+                reason = "throttled" if isinstance(e, KufarThrottled) else "network" if e.status is None else "server"
+                metrics.KUFAR_RETRIES.inc(reason=reason)
+                logger.warning(f"Kufar: {e}; попытка {attempt + 1} через {wait:.1f}с")
+                await asyncio.sleep(wait)
+                continue
+            except BaseException:
+                # Отмена или ошибка не от Kufar: иначе пробный запрос half-open
+                # так и числился бы «в полёте», и предохранитель не замкнулся бы никогда
+                breaker.release_probe()
+                raise
+
+            breaker.record_success()
+            metrics.KUFAR_CIRCUIT_OPEN.set(0, endpoint="search")
+            return page
+
+    async def _request_once(self, params: Dict[str, Any], validator: PageValidator = None) -> _Page:
+        """
+        Один GET к поисковому API.
+        С validator — условный запрос: 304 или совпавший отпечаток дают
+        _Page с data=None, и тело ответа не разбирается.
+        """
+        if self._session is None:
+            raise RuntimeError("KufarClient не запущен — вызови start()")
+
+        headers = {}
+        if validator is not None:
+            if validator.etag:
+                headers["If-None-Match"] = validator.etag
+            if validator.last_modified:
+                headers["If-Modified-Since"] = validator.last_modified
+
+        timing = RequestTiming()
+        started = time.monotonic()
+        try:
+            async with self._session.get(
+                KUFAR_API_URL, params=params, headers=headers, trace_request_ctx={"timing": timing}
+            ) as resp:
+                metrics.KUFAR_RESPONSES.inc(status=resp.status)
+                if resp.status == 304 and validator is not None:
+                    return _Page(None, validator, "not_modified")
+                if resp.status == 429:
+                    raise KufarThrottled(
+                        "Kufar ответил 429 (слишком много запросов)",
+                        status=429,
+                        retry_after=parse_retry_after(resp.headers.get("Retry-After")),
+                    )
+                if resp.status != 200:
+                    raise KufarError(f"Kufar ответил со статусом {resp.status}", status=resp.status)
+
+                raw = await resp.read()
+                new_validator = PageValidator(
+                    etag=resp.headers.get("ETag"),
+                    last_modified=resp.headers.get("Last-Modified"),
+                    fingerprint=_fingerprint(raw),
+                )
+                if validator is not None and validator.fingerprint == new_validator.fingerprint:
+                    return _Page(None, new_validator, "fingerprint")
+
+                try:
+                    data = _json_loads(raw)
+                except ValueError as e:
+                    raise KufarBadPayload(f"Kufar прислал не JSON: {e}", status=resp.status) from e
+                if not isinstance(data, dict):
+                    raise KufarBadPayload(f"Kufar прислал не выдачу: {type(data).__name__}", status=resp.status)
+                logger.debug(f"Получен ответ от Kufar: {len(data.get('ads', []))} объявлений")
+                return _Page(data, new_validator, None)
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            metrics.KUFAR_RESPONSES.inc(status="error")
+            raise KufarError(str(e) or type(e).__name__) from e
+        finally:
+            timing.total = time.monotonic() - started
+            metrics.KUFAR_FETCH_SECONDS.observe(timing.total)
+            self._record_timing(timing)
+
+    def _record_timing(self, timing: RequestTiming):
+        """Тайминги запроса — в метрики (у каждого запроса свои, общего «последнего» нет)."""
+        if timing.connect is not None:
+            metrics.KUFAR_CONNECT_SECONDS.observe(timing.connect)
+        if timing.ttfb is not None:
+            metrics.KUFAR_TTFB_SECONDS.observe(timing.ttfb)
+        metrics.KUFAR_CONNECTIONS.inc(reused=str(timing.reused).lower())
+        logger.debug(
+            "Kufar тайминги: connect=%s ttfb=%s total=%s reused=%s",
+            _fmt_seconds(timing.connect),
+            _fmt_seconds(timing.ttfb),
+            _fmt_seconds(timing.total),
+            timing.reused,
+        )
+
+
+def _fmt_seconds(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value * 1000:.0f}ms"
+
+
+def _validator_key(params: Dict[str, Any]) -> Tuple:
+    """Ключ выдачи: с другими фильтрами у той же категории другая первая страница."""
+    return tuple(sorted((k, str(v)) for k, v in params.items() if k != "cursor"))
+
+
+def _search_params(category_id: int = None, extra_params: Dict[str, Any] = None) -> Dict[str, Any]:
     if category_id is None:
         category_id = config.KUFAR_CATEGORY_ID
-
     params = {
         "cat": category_id,
         "lang": "ru",
-        "size": 50,
+        "size": config.KUFAR_PAGE_SIZE,
         "sort": "lst.d",  # lst.d = сортировка по дате, новые первыми
     }
+    if extra_params:
+        params.update(extra_params)
+    return params
 
-    try:
-        async with aiohttp.ClientSession(headers=HEADERS) as session:
-            async with session.get(KUFAR_API_URL, params=params, timeout=aiohttp.ClientTimeout(total=15)) as resp:
-                if resp.status != 200:
-                    logger.warning(f"Kufar ответил со статусом {resp.status}")
-                    return []
 
-                data = await resp.json(content_type=None)
-                logger.debug(f"Получен ответ от Kufar: {len(data.get('ads', []))} объявлений")
-                return _parse_response(data)
+def _next_cursor(data: Dict[str, Any]) -> Optional[str]:
+    """Токен следующей страницы из блока pagination, если он есть."""
+    pages = (data.get("pagination") or {}).get("pages") or []
+    for page in pages:
+        if page.get("label") == "next" and page.get("token"):
+            return page["token"]
+    return None
 
-    except aiohttp.ClientError as e:
-        logger.error(f"Ошибка запроса к kufar: {e}")
-        return []
-    except Exception as e:
-        logger.error(f"Неизвестная ошибка парсера: {e}")
-        return []
 
-
-def _parse_response(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+def _parse_response(data: Dict[str, Any]) -> List["Ad"]:
     """
     Парсит ответ API kufar и вытаскивает нужные поля.
     Структура ответа может измениться — тут основная точка адаптации.
@@ -70,20 +567,48 @@ def _parse_response(data: Dict[str, Any]) -> List[Dict[str, Any]]:
         if not ad_id:
             continue
 
-        title = item.get("subject", "Без названия")
-        price = _format_price(item.get("price_byn"), item.get("price_usd"))
-        url = f"https://www.kufar.by/item/{ad_id}"
-
-        ads.append({
-            "id": ad_id,
-            "title": title,
-            "price": price,
-            "url": url,
-        })
+        ads.append(Ad(
+            ad_id,
+            item.get("subject", "Без названия"),
+            item.get("price_byn"),
+            item.get("price_usd"),
+            _region(item),
+            item.get("list_time"),
+            _to_int(item.get("account_id")),
+            _images(item) if config.NOTIFY_PHOTOS else None,
+        ))
 
     return ads
 
 
+def _images(item: Dict[str, Any]) -> Optional[List[str]]:
+    """URL первых NOTIFY_PHOTOS_MAX фото объявления (None — фото нет)."""
+    urls = [
+        KUFAR_IMAGE_URL + image["path"]
+        for image in item.get("images") or ()
+        if image.get("path") and image.get("media_storage", "rms") == "rms"
+    ]
+    return urls[:config.NOTIFY_PHOTOS_MAX] or None
+
+
+def _to_int(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _region(item: Dict[str, Any]) -> Optional[int]:
+    """Код области из ad_parameters (p == "region")."""
+    for param in item.get("ad_parameters") or ():
+        if param.get("p") == "region":
+            try:
+                return int(param.get("v"))
+            except (TypeError, ValueError):
+                return None
+    return None
+
+
 def _format_price(price_byn, price_usd) -> str:
     """Форматирует цену в читаемую строку."""
     if price_byn and price_byn != "0":
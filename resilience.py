@@ -0,0 +1,90 @@
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+
+def decorrelated_jitter(previous: float, base: float, cap: float) -> float:
+    """
+    Следующая пауза между повторами (decorrelated jitter): случайная
+    в [base, previous * 3], но не больше cap. Повторы разных клиентов
+    не синхронизируются, а пауза в среднем растёт.
+    """
+    return min(cap, random.uniform(base, max(base, previous * 3)))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After в секундах: число секунд или HTTP-дата. None — не разобрать."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, moment.timestamp() - time.time())
+
+
+class CircuitBreaker:
+    """
+    Предохранитель: после threshold ошибок подряд размыкается и
+    reset_timeout секунд не пропускает запросы. Потом пропускает один
+    пробный (half-open): удался — замыкается, нет — снова размыкается.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, threshold: int, reset_timeout: float):
+        self._threshold = threshold
+        self._reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self._opened_at < self._reset_timeout:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def retry_in(self) -> float:
+        """Сколько секунд до пробного запроса (0 — можно сейчас)."""
+        if self._opened_at is None:
+            return 0.0
+        return max(0.0, self._reset_timeout - (time.monotonic() - self._opened_at))
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def release_probe(self):
+        """
+        Пробный запрос не дал ответа ни в ту, ни в другую сторону (отменён,
+        упал не на стороне Kufar) — следующий allow() снова пропустит пробу.
+        """
+        self._probing = False
+
+    def record_success(self):
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def record_failure(self) -> bool:
+        """Учитывает ошибку. True — предохранитель только что разомкнулся."""
+        self._failures += 1
+        if self._probing or (self._opened_at is None and self._failures >= self._threshold):
+            self._opened_at = time.monotonic()
+            self._probing = False
+            return True
+        return False
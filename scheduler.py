@@ -0,0 +1,627 @@
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import config
+import metrics
+from ratelimit import RateLimiter
+from state import BotState, SeenIds
+from notifier import NotifyQueue
+from catalog import get_catalog
+from coordination import Coordinator, CoordinationError
+from tracking import AdTracker
+import parser as kufar_parser
+
+logger = logging.getLogger(__name__)
+
+
+# ─── Одна категория ─────────────────────────────────────────────────────────
+
+class CategoryScanner:
+    """
+    Расписание одной категории: свой интервал, джиттер и backoff при ошибках Kufar.
+
+    В адаптивном режиме (SCAN_ADAPTIVE) интервал подстраивается под темп
+    публикаций: по каждому скану считается EWMA числа новых объявлений
+    в секунду, и интервал выбирается так, чтобы за скан в среднем приходило
+    SCAN_TARGET_NEW_PER_SCAN объявлений. Результат ограничен интервалом
+    категории и размыт джиттером ±SCAN_JITTER.
+    """
+
+    def __init__(self, category: config.CategoryConfig):
+        self.category = category
+        self.failures = 0          # ошибок подряд
+        self.scans = 0             # успешных сканов всего
+        self.unchanged_scans = 0   # из них — страница не изменилась (шорткат)
+        self.new_ads = 0           # новых объявлений всего
+        self.rate: Optional[float] = None       # EWMA новых объявлений в секунду
+        self.retry_after: Optional[float] = None  # Kufar / предохранитель просит подождать столько секунд
+        self._last_scan_at: Optional[float] = None
+
+    def observe(self, new_count: int, now: float = None):
+        """Учитывает результат успешного скана в оценке темпа публикаций."""
+        if now is None:
+            now = time.monotonic()
+        if self._last_scan_at is not None:
+            elapsed = now - self._last_scan_at
+            if elapsed > 0:
+                observed = new_count / elapsed
+                if self.rate is None:
+                    self.rate = observed
+                else:
+                    alpha = config.SCAN_EWMA_ALPHA
+                    self.rate = alpha * observed + (1 - alpha) * self.rate
+        self._last_scan_at = now
+
+    def mark_scanned(self, now: float = None):
+        """Скан был, но в оценку темпа не идёт (например, первый скан категории)."""
+        self._last_scan_at = time.monotonic() if now is None else now
+
+    def next_interval(self) -> float:
+        """Интервал до следующего скана; после ошибок — удваивается, но не раньше retry_after."""
+        lo, hi = self.category.interval_min, self.category.interval_max
+
+        if not config.SCAN_ADAPTIVE or self.rate is None:
+            interval = random.uniform(lo, hi)
+        else:
+            target = hi if self.rate <= 0 else config.SCAN_TARGET_NEW_PER_SCAN / self.rate
+            target = min(max(target, lo), hi)
+            # Джиттер — после ограничения и внутри [lo, hi]: иначе тихие и очень
+            # активные категории опрашивались бы синхронно, ровно на границах
+            interval = random.uniform(
+                max(lo, target * (1 - config.SCAN_JITTER)),
+                min(hi, target * (1 + config.SCAN_JITTER)),
+            )
+
+        if self.failures:
+            interval = min(interval * 2 ** self.failures, config.SCAN_BACKOFF_MAX)
+        if self.retry_after is not None:
+            interval = max(interval, self.retry_after)
+        return interval
+
+
+# ─── Планировщик ────────────────────────────────────────────────────────────
+
+class ScanScheduler:
+    """
+    Следит за несколькими категориями одновременно.
+    У каждой категории свой цикл, а запросы к Kufar идут через общий
+    семафор (SCAN_CONCURRENCY) и общий token bucket (SCAN_RPS).
+
+    Категория скачивается один раз за цикл, а новые объявления раздаются
+    всем активным подпискам, которые её смотрят (каждой — через её фильтр).
+    Категории, которые никто сейчас не смотрит, не опрашиваются.
+
+    Если включено TRACK_CHANGES, всё скачанное за скан сверяется со снимками
+    (tracking.AdTracker): снижение цены и перевыкладка уходят подписчикам
+    отдельными уведомлениями.
+
+    С координатором (coordination.py, этот процесс — лидер) планировщик
+    сканирует только свои категории по кольцу, публикует список нужных
+    категорий для ведомых и разбирает их сканы из входящих (ingest) тем же
+    дедупом и фильтрами.
+    """
+
+    def __init__(self, app, categories: List[config.CategoryConfig] = None, coordinator: Coordinator = None):
+        self._app = app
+        self._coordinator = coordinator
+        self._scanners = {
+            c.id: CategoryScanner(c) for c in (categories or config.KUFAR_CATEGORIES)
+        }
+        self._configured = set(self._scanners)  # категории из конфига сканируются всегда
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._running = False
+        self._semaphore = asyncio.Semaphore(config.SCAN_CONCURRENCY)
+        self._limiter = RateLimiter(config.SCAN_RPS)
+        self._tracker = AdTracker() if config.TRACK_CHANGES else None
+        # Серверные фильтры последнего удачного скана категории и когда он начался
+        self._scan_params: Dict[int, Tuple[Tuple, datetime]] = {}
+        # ID из сканов, оборвавшихся посреди пагинации (см. _unconfirm)
+        self._unconfirmed: Dict[int, Set[int]] = {}
+
+    @property
+    def throttle(self) -> Callable[[], Awaitable[Any]]:
+        """Общий лимит SCAN_RPS — для запросов к Kufar мимо сканов (догоняющий подсчёт)."""
+        return self._limiter.acquire
+
+    def add_category(self, category_id: int):
+        """Начинает следить за категорией (например, чат подписался на новую)."""
+        if category_id not in self._scanners:
+            self._scanners[category_id] = CategoryScanner(
+                config.CategoryConfig(category_id, config.SCAN_INTERVAL_MIN, config.SCAN_INTERVAL_MAX)
+            )
+        if self._running and category_id not in self._tasks:
+            self._tasks[category_id] = asyncio.create_task(
+                self._category_loop(self._scanners[category_id])
+            )
+
+    def remove_category(self, category_id: int):
+        """
+        Перестаёт следить за категорией, если она не из конфига и её нет ни
+        в одной подписке (например, последний чат сделал /unwatch).
+        """
+        if category_id in self._configured:
+            return
+        state: BotState = self._app.bot_data["state"]
+        if any(category_id in sub.categories for sub in state.subscriptions()):
+            return
+        task = self._tasks.pop(category_id, None)
+        if task is not None:
+            task.cancel()
+        self._scanners.pop(category_id, None)
+        self._scan_params.pop(category_id, None)
+        self._unconfirmed.pop(category_id, None)
+        logger.info(f"Категорию {category_id} больше никто не смотрит, цикл сканирования остановлен")
+
+    async def run(self):
+        """Запускает циклы всех категорий (из конфига и из подписок) и работает до отмены."""
+        state: BotState = self._app.bot_data["state"]
+        for sub in state.subscriptions():
+            for category_id in sub.categories:
+                self.add_category(category_id)
+
+        self._warn_overlaps()
+        self._running = True
+        for category_id in list(self._scanners):
+            self.add_category(category_id)
+        tasks = [asyncio.create_task(self._inbox_loop())] if self._coordinator is not None else []
+        try:
+            await asyncio.Future()
+        finally:
+            self._running = False
+            tasks.extend(self._tasks.values())
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._tasks.clear()
+
+    def _warn_overlaps(self):
+        """
+        Раздел и его подкатегория в одном расписании — подкатегория
+        скачивается дважды (её объявления есть и в выдаче раздела).
+        """
+        catalog = get_catalog()
+        for root, members in catalog.group_by_parent(self._scanners).items():
+            nested = [c for c in members if c != root]
+            if root in members and nested:
+                logger.warning(
+                    f"Раздел «{catalog.name(root)}» ({root}) сканируется вместе с подкатегориями "
+                    f"{', '.join(map(str, nested))} — их объявления скачиваются дважды"
+                )
+
+    async def _category_loop(self, scanner: CategoryScanner):
+        state: BotState = self._app.bot_data["state"]
+        category_id = scanner.category.id
+
+        # Первый скан — сразу, без случайной паузы: после рестарта известные ID
+        # уже загружены из хранилища, и скан сразу «тёплый». Чтобы категории не
+        # били в Kufar одновременно, хватает общих семафора и token bucket
+        while True:
+            if self._coordinator is not None and not self._coordinator.owns(category_id):
+                logger.debug(f"Категорию {category_id} сканирует другой процесс")
+            elif state.subscribers(category_id):
+                try:
+                    await self.scan_category(category_id)
+                except Exception as e:
+                    scanner.failures += 1
+                    metrics.SCANS.inc(category=category_id, result="error")
+                    logger.error(f"Ошибка сканирования категории {category_id}: {e}")
+            else:
+                logger.debug(f"Категорию {category_id} сейчас никто не смотрит, пропускаем.")
+
+            interval = scanner.next_interval()
+            logger.debug(f"Категория {category_id}: следующий скан через {interval:.0f}с")
+            await asyncio.sleep(interval)
+
+    async def scan_category(self, category_id: int) -> Optional[kufar_parser.FetchResult]:
+        """
+        Один скан категории: fetch до известных ID → дедуп → очередь уведомлений.
+        Возвращает итог выборки (ads — новые объявления) или None, если
+        категорию сейчас никто не смотрит. Ошибки Kufar не бросает: то, что
+        успели скачать до ошибки, всё равно доставляется.
+        """
+        state: BotState = self._app.bot_data["state"]
+        kufar: kufar_parser.KufarClient = self._app.bot_data["kufar"]
+        queue: NotifyQueue = self._app.bot_data["notify_queue"]
+
+        scanner = self._scanners[category_id]
+
+        # Первый скан категории — только первая страница, без догоняния в глубину
+        first_scan = not state.has_seen(category_id)
+        max_pages = 1 if first_scan else config.KUFAR_MAX_PAGES
+
+        subscribers = state.subscribers(category_id)
+        if not subscribers:
+            return None
+        # Серверные фильтры можно отправить в Kufar, только если они у всех подписчиков одинаковые;
+        # иначе запрос идёт без них, и текст поиска каждого чата проверяется по заголовку
+        server_params = [sub.get_filter(category_id).server_params() for sub in subscribers]
+        extra_params = server_params[0] if all(p == server_params[0] for p in server_params) else {}
+        matchers = [
+            (sub.chat_id, sub.get_filter(category_id).compile(check_query=not extra_params))
+            for sub in subscribers
+        ]
+
+        # Фильтры в запросе сменились — в выдаче всплывут объявления, которые
+        # раньше прятал Kufar. Опубликованные до прошлого скана — не новые:
+        # запоминаем их без рассылки
+        params_key = tuple(sorted(extra_params.items()))
+        started_at = datetime.now(timezone.utc)
+        previous = self._scan_params.get(category_id)
+        old_before = previous[1] if previous is not None and previous[0] != params_key else None
+        unconfirmed = self._unconfirmed.get(category_id, ())
+
+        fresh = []
+        scanned = []
+        deliveries = []
+        checked = duplicates = filtered = 0
+        stats = kufar_parser.FetchStats()
+        failed: Optional[kufar_parser.FetchResult] = None
+        async with self._semaphore:
+            try:
+                async for ad in kufar.iter_ads(
+                    category_id,
+                    is_known=lambda ad_id: ad_id not in unconfirmed and state.is_seen(category_id, ad_id),
+                    max_pages=max_pages,
+                    throttle=self._limiter.acquire,
+                    conditional=True,
+                    stats=stats,
+                    extra_params=extra_params,
+                    on_page=lambda ads: state.recall_seen(category_id, [ad.id for ad in ads]),
+                ):
+                    checked += 1
+                    scanned.append(ad)
+                    outcome = self._route(category_id, ad, matchers, deliveries, old_before)
+                    if outcome in ("duplicate", "hidden"):
+                        duplicates += 1
+                        continue
+                    fresh.append(ad)
+                    if outcome == "filtered":
+                        filtered += 1
+            except kufar_parser.KufarError as e:
+                failed = kufar_parser.FetchResult.from_error(e)
+            except asyncio.CancelledError:
+                # Остановка посреди скана: скачанное успеваем поставить в очередь
+                queue.put_many(deliveries)
+                state.flush_seen()
+                raise
+
+        if self._tracker is not None:
+            deliveries = self._track_changes(scanned, deliveries, matchers)
+
+        # Сначала очередь, потом журнал: при падении между ними объявление
+        # придёт повторно, но не потеряется
+        queue.put_many(deliveries)
+        state.flush_seen()
+        new_ads = len(fresh)
+
+        if failed is not None:
+            scanner.failures += 1
+            scanner.retry_after = failed.retry_after
+            metrics.SCANS.inc(category=category_id, result=failed.status)
+            logger.error(
+                f"Скан категории {category_id}: {failed.status} — {failed.error}"
+                + (f" (ждём {failed.retry_after:.0f}с)" if failed.retry_after else "")
+            )
+            _unconfirm(self._unconfirmed, category_id, scanned, stats)
+            failed.ads = fresh
+            return failed
+
+        self._unconfirmed.pop(category_id, None)
+        self._scan_params[category_id] = (params_key, started_at)
+
+        if stats.unchanged:
+            result = kufar_parser.FetchResult("ok")
+        else:
+            result = kufar_parser.FetchResult("empty" if checked == 0 else "ok", fresh)
+
+        scanner.failures = 0
+        scanner.retry_after = None
+        scanner.scans += 1
+        scanner.new_ads += new_ads
+        if stats.unchanged:
+            scanner.unchanged_scans += 1
+
+        metrics.SCANS.inc(category=category_id, result="unchanged" if stats.unchanged else result.status)
+        metrics.SCAN_NEW_ADS.observe(new_ads, category=category_id)
+        metrics.SCAN_ADS_CHECKED.inc(checked, category=category_id)
+        metrics.SCAN_ADS_DUPLICATE.inc(duplicates, category=category_id)
+        metrics.SCAN_ADS_FILTERED.inc(filtered, category=category_id)
+        metrics.mark_scan_success()
+
+        if first_scan:
+            # На первом скане «новые» — вся страница, темп по ним не оценить
+            scanner.mark_scanned()
+        else:
+            scanner.observe(new_ads)
+        logger.debug(
+            f"Категория {category_id}: страниц {stats.pages}, новых {new_ads}, "
+            f"без изменений {scanner.unchanged_scans}/{scanner.scans} сканов, "
+            f"темп {_fmt_rate(scanner.rate)}"
+        )
+        return result
+
+    def ingest(self, category_id: int, ads: List[kufar_parser.Ad]) -> int:
+        """
+        Скан категории, сделанный ведомым процессом: тот же дедуп, фильтры
+        и отслеживание изменений, что и у своего скана. Возвращает, сколько
+        объявлений оказались новыми.
+        """
+        state: BotState = self._app.bot_data["state"]
+        queue: NotifyQueue = self._app.bot_data["notify_queue"]
+
+        metrics.mark_scan_success()
+        subscribers = state.subscribers(category_id)
+        if not subscribers:
+            return 0
+        matchers = [(sub.chat_id, sub.get_filter(category_id).compile()) for sub in subscribers]
+
+        deliveries = []
+        new_ads = duplicates = filtered = 0
+        for ad in ads:
+            outcome = self._route(category_id, ad, matchers, deliveries)
+            if outcome == "duplicate":
+                duplicates += 1
+                continue
+            new_ads += 1
+            if outcome == "filtered":
+                filtered += 1
+        if self._tracker is not None:
+            deliveries = self._track_changes(ads, deliveries, matchers)
+
+        queue.put_many(deliveries)
+        state.flush_seen()
+        metrics.SCAN_ADS_CHECKED.inc(len(ads), category=category_id)
+        metrics.SCAN_ADS_DUPLICATE.inc(duplicates, category=category_id)
+        metrics.SCAN_ADS_FILTERED.inc(filtered, category=category_id)
+        return new_ads
+
+    async def _inbox_loop(self):
+        """
+        Лидер: раз в COORDINATION_POLL_SECONDS публикует категории, на которые
+        есть подписчики, и разбирает сканы ведомых. Входящие подтверждаются
+        после постановки в очередь — при падении между ними скан разберётся
+        повторно, а дедуп отсеет уже разосланное.
+        """
+        state: BotState = self._app.bot_data["state"]
+        while True:
+            try:
+                wanted = [c for c in self._scanners if state.subscribers(c)]
+                await self._coordinator.publish_categories(wanted)
+                metrics.COORD_OWNED_CATEGORIES.set(sum(1 for c in wanted if self._coordinator.owns(c)))
+
+                upto, scans = await self._coordinator.pull_ads()
+                for category_id, ads in scans:
+                    try:
+                        self.ingest(category_id, ads)
+                    except Exception:
+                        # Одна битая запись не должна навсегда застопорить входящие
+                        logger.error(f"Не удалось разобрать скан категории {category_id} из входящих",
+                                     exc_info=True)
+                await self._coordinator.ack(upto)
+            except CoordinationError as e:
+                logger.warning(f"Хранилище координации недоступно: {e}")
+            except Exception:
+                # Цикл никто не перезапустит — без него сканы ведомых копились бы во входящих
+                logger.error("Ошибка в цикле входящих, продолжаем", exc_info=True)
+            await asyncio.sleep(config.COORDINATION_POLL_SECONDS)
+
+    def _route(self, category_id: int, ad: kufar_parser.Ad, matchers: List, deliveries: List,
+               old_before: datetime = None) -> str:
+        """
+        Дедуп и фильтры одного объявления: новое и подошедшее кому-то
+        добавляется в deliveries. Возвращает duplicate / hidden / filtered / new.
+        hidden — невиденное, но опубликованное до old_before (или без времени
+        публикации): оно только запоминается.
+        """
+        state: BotState = self._app.bot_data["state"]
+        if state.is_seen(category_id, ad.id):
+            return "duplicate"
+        # Отфильтрованные тоже запоминаем — чтобы не проверять их снова
+        state.add_seen(category_id, ad)
+        if old_before is not None:
+            listed = ad.listed_at
+            if listed is None or listed < old_before:
+                return "hidden"
+        targets = [chat_id for chat_id, matcher in matchers if matcher.matches(ad)]
+        if not targets:
+            return "filtered"
+        logger.info(f"Новое объявление [{category_id}]: {ad.id} — {ad.title} → {len(targets)} чат(ов)")
+        deliveries.extend((chat_id, ad) for chat_id in targets)
+        return "new"
+
+    def _track_changes(self, scanned: List, deliveries: List, matchers: List) -> List:
+        """
+        Сверяет скачанное со снимками и дополняет доставки событиями:
+        перевыкладка заменяет обычное «новое объявление» тем же адресатам,
+        снижение цены уходит всем, чей фильтр пропускает объявление.
+        """
+        events = self._tracker.diff(scanned)
+        if not events:
+            return deliveries
+
+        relists = {e.ad.id: e for e in events if e.kind == "relist"}
+        result = [(chat_id, ad, relists.get(ad.id)) for chat_id, ad in deliveries]
+        for event in events:
+            if event.kind != "price_drop":
+                continue
+            logger.info(f"Снижение цены: {event.ad.id} — {event.old_price} → {event.ad.price}")
+            result.extend(
+                (chat_id, event.ad, event) for chat_id, matcher in matchers if matcher.matches(event.ad)
+            )
+        return result
+
+
+# ─── Ведомый процесс ────────────────────────────────────────────────────────
+
+class ShardScanner:
+    """
+    Сканер ведомого процесса (coordination.py): берёт у лидера список
+    категорий, сканирует те, что по кольцу достались этому процессу,
+    и отдаёт всё скачанное лидеру через входящие.
+
+    Подписок и state.db у ведомого нет: виденные ID он держит в памяти
+    только для того, чтобы вовремя остановить пагинацию, а дедуп, фильтры
+    и рассылку делает лидер.
+    """
+
+    def __init__(self, kufar: kufar_parser.KufarClient, coordinator: Coordinator):
+        self._kufar = kufar
+        self._coordinator = coordinator
+        self._configured = {c.id: c for c in config.KUFAR_CATEGORIES}
+        self._scanners: Dict[int, CategoryScanner] = {}
+        self._seen: Dict[int, SeenIds] = {}
+        # Категории, где скачанное не дошло до лидера: следующий скан идёт вглубь
+        self._undelivered: Set[int] = set()
+        # ID из сканов, оборвавшихся посреди пагинации (см. _unconfirm)
+        self._unconfirmed: Dict[int, Set[int]] = {}
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._semaphore = asyncio.Semaphore(config.SCAN_CONCURRENCY)
+        self._limiter = RateLimiter(config.SCAN_RPS)
+
+    async def run(self):
+        """Раз в COORDINATION_POLL_SECONDS сверяет свои категории с кольцом; работает до отмены."""
+        try:
+            while True:
+                try:
+                    categories = await self._coordinator.categories()
+                except CoordinationError as e:
+                    logger.warning(f"Хранилище координации недоступно: {e}")
+                else:
+                    self._rebalance({c for c in categories if self._coordinator.owns(c)})
+                await asyncio.sleep(config.COORDINATION_POLL_SECONDS)
+        finally:
+            for task in self._tasks.values():
+                task.cancel()
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+            self._tasks.clear()
+
+    def _rebalance(self, owned: Set[int]):
+        for category_id in owned - set(self._tasks):
+            if category_id not in self._scanners:
+                category = self._configured.get(category_id) or config.CategoryConfig(
+                    category_id, config.SCAN_INTERVAL_MIN, config.SCAN_INTERVAL_MAX
+                )
+                self._scanners[category_id] = CategoryScanner(category)
+            logger.info(f"Категория {category_id} теперь сканируется здесь")
+            self._tasks[category_id] = asyncio.create_task(self._category_loop(self._scanners[category_id]))
+        for category_id in set(self._tasks) - owned:
+            logger.info(f"Категория {category_id} ушла другому процессу")
+            self._tasks.pop(category_id).cancel()
+            # Вернётся — начнём с первой страницы, как в первый раз
+            self._forget(category_id)
+        metrics.COORD_OWNED_CATEGORIES.set(len(owned))
+
+    def _forget(self, category_id: int, undelivered: bool = False):
+        """
+        Виденные ID и отпечаток выдачи — заново: следующий скан начнётся как
+        первый. undelivered — скачанное не дошло до лидера, и этот скан пройдёт
+        до KUFAR_MAX_PAGES страниц, чтобы передать его снова (дубли отсеет
+        дедуп лидера).
+        """
+        self._seen.pop(category_id, None)
+        self._unconfirmed.pop(category_id, None)
+        self._kufar.reset_validators(category_id)
+        if undelivered:
+            self._undelivered.add(category_id)
+
+    async def _category_loop(self, scanner: CategoryScanner):
+        category_id = scanner.category.id
+        while True:
+            try:
+                await self.scan_category(category_id)
+            except CoordinationError as e:
+                logger.warning(f"Скан категории {category_id} не передан лидеру: {e}")
+            except Exception as e:
+                scanner.failures += 1
+                metrics.SCANS.inc(category=category_id, result="error")
+                logger.error(f"Ошибка сканирования категории {category_id}: {e}")
+            await asyncio.sleep(scanner.next_interval())
+
+    async def scan_category(self, category_id: int):
+        """Один скан: fetch до известных ID → всё скачанное во входящие лидера."""
+        scanner = self._scanners[category_id]
+        seen = self._seen.get(category_id)
+        first_scan = seen is None
+        if first_scan:
+            seen = self._seen[category_id] = SeenIds(config.SEEN_IDS_LIMIT)
+        # Первый скан — только первая страница, если не надо передать потерянное
+        deep = not first_scan or category_id in self._undelivered
+        unconfirmed = self._unconfirmed.get(category_id, ())
+
+        scanned = []
+        new_ads = 0
+        stats = kufar_parser.FetchStats()
+        failed: Optional[kufar_parser.FetchResult] = None
+        async with self._semaphore:
+            try:
+                async for ad in self._kufar.iter_ads(
+                    category_id,
+                    is_known=lambda ad_id: ad_id not in unconfirmed and ad_id in seen,
+                    max_pages=config.KUFAR_MAX_PAGES if deep else 1,
+                    throttle=self._limiter.acquire,
+                    conditional=True,
+                    stats=stats,
+                ):
+                    scanned.append(ad)
+                    new_ads += seen.add(ad.id)
+            except kufar_parser.KufarError as e:
+                failed = kufar_parser.FetchResult.from_error(e)
+            except asyncio.CancelledError:
+                # Скачанное, но не переданное лидеру, не должно считаться виденным
+                self._forget(category_id, undelivered=True)
+                raise
+
+        if scanned or failed is None:
+            try:
+                await self._coordinator.push_ads(category_id, scanned)
+            except (CoordinationError, asyncio.CancelledError):
+                self._forget(category_id, undelivered=True)
+                raise
+            if failed is None:
+                self._undelivered.discard(category_id)
+
+        if failed is not None:
+            scanner.failures += 1
+            scanner.retry_after = failed.retry_after
+            metrics.SCANS.inc(category=category_id, result=failed.status)
+            logger.error(f"Скан категории {category_id}: {failed.status} — {failed.error}")
+            _unconfirm(self._unconfirmed, category_id, scanned, stats)
+            return
+
+        self._unconfirmed.pop(category_id, None)
+        scanner.failures = 0
+        scanner.retry_after = None
+        scanner.scans += 1
+        if stats.unchanged:
+            scanner.unchanged_scans += 1
+        if first_scan:
+            scanner.mark_scanned()
+        else:
+            scanner.observe(new_ads)
+        metrics.SCANS.inc(category=category_id, result="unchanged" if stats.unchanged else "ok")
+        metrics.mark_scan_success()
+
+
+def _unconfirm(unconfirmed: Dict[int, Set[int]], category_id: int, scanned: List, stats):
+    """
+    Скан оборвался на странице 2+: объявления первых страниц уже запомнены
+    (и доставлены), а более старые до известных ID так и не скачаны. Чтобы
+    следующий скан не остановился на первой же странице и не оставил дыру,
+    эти ID не считаются «известными» для остановки пагинации (дедуп по ним
+    работает как обычно), пока скан категории не пройдёт без ошибки.
+    """
+    if not scanned:
+        return
+    unconfirmed.setdefault(category_id, set()).update(ad.id for ad in scanned)
+    logger.warning(
+        f"Категория {category_id}: выборка оборвалась после {stats.pages} стр., "
+        f"следующий скан дочитает пропущенное до известных объявлений"
+    )
+
+
+def _fmt_rate(rate: Optional[float]) -> str:
+    return "—" if rate is None else f"{rate * 3600:.1f}/ч"
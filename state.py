@@ -1,82 +1,453 @@
-import json
-import os
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
-from typing import Optional
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Set
 
 import config
+import metrics
+from ad_filters import AdFilter
+from parser import Ad
+from storage import SeenRecord, Snapshot, Storage, open_storage
+
+logger = logging.getLogger(__name__)
+
+
+class SeenIds:
+    """
+    Множество виденных ID с ограниченным размером.
+
+    Хэш-множество даёт проверку за O(1), кольцевой буфер хранит порядок
+    добавления: при переполнении вытесняется самый старый ID, тоже за O(1).
+    """
+
+    def __init__(self, limit: int, ids: Iterable[int] = ()):
+        self._limit = limit
+        self._ring: List[Optional[int]] = [None] * limit
+        self._head = 0          # куда пишем следующий ID (он же самый старый при заполнении)
+        self._size = 0
+        self._index = set()
+        for ad_id in ids:
+            self.add(ad_id)
+
+    def __contains__(self, ad_id: int) -> bool:
+        return ad_id in self._index
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self) -> Iterator[int]:
+        """От самого старого к самому новому."""
+        start = (self._head - self._size) % self._limit
+        for i in range(self._size):
+            yield self._ring[(start + i) % self._limit]
+
+    def add(self, ad_id: int) -> bool:
+        """Добавляет ID. Возвращает False, если он уже был."""
+        if ad_id in self._index:
+            return False
+        if self._size == self._limit:
+            self._index.discard(self._ring[self._head])
+        else:
+            self._size += 1
+        self._ring[self._head] = ad_id
+        self._head = (self._head + 1) % self._limit
+        self._index.add(ad_id)
+        return True
+
+    def clear(self):
+        self._ring = [None] * self._limit
+        self._head = 0
+        self._size = 0
+        self._index.clear()
+
+
+@dataclass
+class Subscription:
+    """
+    Подписка одного чата.
+        status        — active | stopped | reset
+        stopped_at    — ISO timestamp момента Стопа
+        categories    — какие категории смотрит чат
+        filters       — категория → AdFilter
+        stop_cursors  — категория → номер последнего найденного объявления
+                        (BotState.seq) на момент Стопа; по нему при Старте
+                        видно, сколько нашлось, пока чат стоял
+    """
+    chat_id: int
+    categories: List[int] = field(default_factory=list)
+    status: str = "reset"
+    stopped_at: Optional[str] = None
+    filters: Dict[int, AdFilter] = field(default_factory=dict)
+    stop_cursors: Dict[int, int] = field(default_factory=dict)
+
+    @property
+    def stopped_at_dt(self) -> Optional[datetime]:
+        if self.stopped_at:
+            return datetime.fromisoformat(self.stopped_at)
+        return None
+
+    def get_filter(self, category_id: int) -> AdFilter:
+        return self.filters.get(category_id) or AdFilter()
+
+    def to_dict(self) -> Dict:
+        return {
+            "chat_id": self.chat_id,
+            "categories": self.categories,
+            "status": self.status,
+            "stopped_at": self.stopped_at,
+            "filters": {str(cat): f.to_dict() for cat, f in self.filters.items()},
+            "stop_cursors": {str(cat): n for cat, n in self.stop_cursors.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Subscription":
+        return cls(
+            chat_id=int(data["chat_id"]),
+            categories=[int(c) for c in data.get("categories", [])],
+            status=data.get("status", "reset"),
+            stopped_at=data.get("stopped_at"),
+            filters={int(cat): AdFilter.from_dict(f) for cat, f in data.get("filters", {}).items()},
+            stop_cursors={int(cat): int(n) for cat, n in data.get("stop_cursors", {}).items()},
+        )
+
+
+class StateWriteError(Exception):
+    """Изменения не легли на диск за отведённое время (причина — последняя ошибка записи)."""
+
+
+class _Batch(NamedTuple):
+    """Всё, что накопилось к записи; собирается в цикле событий, пишется в потоке."""
+    subs: List[Dict]
+    records: List[SeenRecord]
+    subscriptions: Optional[Dict[int, Dict]]  # все подписки — для снимка, если он нужен бэкенду
+    gen: int                      # номер последнего изменения, вошедшего в запись
 
 
 class BotState:
     """
-    Состояния бота:
+    Общее состояние бота: подписки чатов и виденные объявления.
+
+    У каждого чата своя подписка (Subscription) со своими категориями,
+    фильтрами и статусом:
         active   — слежка идёт
         stopped  — слежка приостановлена (есть дата остановки)
         reset    — сброшен (как свежий старт, без истории)
+
+    Виденные ID общие для всех чатов и ведутся по категориям: категория
+    скачивается один раз за цикл, сколько бы чатов её ни смотрело.
+
+    Всё рабочее — в памяти, запись — в хранилище (storage.Storage, бэкенд
+    по STATE_BACKEND) и идёт в фоне, в отдельном потоке; чтение истории
+    (recall_seen, ads_since) — в своём потоке: диск не держит цикл событий. Изменения помечаются грязными и копятся STATE_WRITE_DELAY
+    секунд, потом уходят одной записью. Смена статуса чата пишется сразу,
+    а flush() — точка надёжности: ждёт, пока всё изменённое до него
+    окажется на диске. Без запущенного цикла событий (скрипты) запись
+    синхронная.
+
+    add_seen ничего не пишет; flush_seen отдаёт накопленные за скан
+    объявления на запись. is_seen отвечает только по памяти — ID, вытесненные
+    из неё, recall_seen заранее (постранично) поднимает из хранилища.
     """
 
-    def __init__(self):
-        self._state = {
-            "status": "reset",           # active | stopped | reset
-            "stopped_at": None,          # ISO timestamp момента Стопа
-            "seen_ids": [],              # список виденных ID объявлений
-        }
+    def __init__(self, storage: Storage = None):
+        self._store = storage or open_storage()
+        self._subscriptions: Dict[int, Subscription] = {}
+        self._seen: Dict[int, SeenIds] = {}
+        self._seq: Dict[int, int] = {}              # категория → сколько новых объявлений найдено всего
+        self._pending: List[SeenRecord] = []       # в памяти, ещё не в хранилище
+        self._dirty_subs: Set[int] = set()         # чаты, чья подписка ещё не в хранилище
+        self._dirty_gen = 0                        # номер последнего изменения
+        self._written_gen = 0                      # до какого изменения всё записано
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state-writer")
+        self._reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state-reader")
+        # Снимок виденных ID собирается в потоке записи, пока цикл событий их дополняет
+        self._seen_lock = threading.Lock()
+        self._writer: Optional[asyncio.Task] = None
+        self._wake = asyncio.Event()               # есть что писать
+        self._urgent = asyncio.Event()             # писать, не дожидаясь окна
+        self._written = asyncio.Condition()
+        self._last_error: Optional[Exception] = None  # последняя ошибка записи, пока не было удачной
         self._load()
 
+    @property
+    def writer(self) -> ThreadPoolExecutor:
+        """Поток записи: кто пишет через него же, пишет строго по очереди с состоянием."""
+        return self._executor
+
     # ─── Загрузка / сохранение ──────────────────────────────────────────
 
     def _load(self):
-        if os.path.exists(config.STATE_FILE):
+        snapshot = self._store.load()
+        for data in snapshot.subscriptions.values():
+            sub = Subscription.from_dict(data)
+            self._subscriptions[sub.chat_id] = sub
+        for category_id, ids in snapshot.seen.items():
+            seen = self._seen_for(category_id)
+            for ad_id in ids:
+                seen.add(ad_id)
+        self._seq = dict(snapshot.seq)
+
+    def _snapshot(self, subscriptions: Dict[int, Dict]) -> Snapshot:
+        """Выполняется в потоке записи: подписки сняты в цикле событий, виденные ID — здесь."""
+        with self._seen_lock:
+            return Snapshot(
+                subscriptions=subscriptions,
+                seen={cat: list(seen) for cat, seen in list(self._seen.items())},
+                seq=dict(self._seq),
+            )
+
+    def _save_subscription(self, sub: Subscription, urgent: bool = False):
+        self._dirty_subs.add(sub.chat_id)
+        self._mark_dirty(urgent)
+
+    def flush_seen(self):
+        """Отдаёт накопленные объявления на запись (одна транзакция / один fsync на окно)."""
+        if self._pending:
+            self._mark_dirty()
+
+    async def flush(self, timeout: float = None):
+        """
+        Ждёт, пока всё изменённое до вызова будет записано, но не дольше
+        timeout (по умолчанию STATE_FLUSH_TIMEOUT). Не успели — StateWriteError
+        с последней ошибкой записи; запись при этом продолжает повторяться в фоне.
+        """
+        target = self._dirty_gen
+        if self._written_gen >= target:
+            return
+        self._mark_dirty(urgent=True)
+        if timeout is None:
+            timeout = config.STATE_FLUSH_TIMEOUT
+        try:
+            await asyncio.wait_for(self._wait_written(target), timeout)
+        except asyncio.TimeoutError:
+            reason = f": {self._last_error}" if self._last_error is not None else ""
+            raise StateWriteError(f"состояние не записано за {timeout:g}с{reason}") from self._last_error
+
+    async def _wait_written(self, target: int):
+        async with self._written:
+            await self._written.wait_for(lambda: self._written_gen >= target)
+
+    async def close(self):
+        """
+        Дописывает всё накопленное и закрывает хранилище. Если диск не
+        отвечает дольше STATE_FLUSH_TIMEOUT, недописанное теряется, но
+        остановка не зависает.
+        """
+        self.flush_seen()
+        written = True
+        try:
+            await self.flush()
+        except StateWriteError as e:
+            written = False
+            logger.error(f"Остановка без полной записи: {e}")
+        if self._writer is not None:
+            self._writer.cancel()
+            await asyncio.gather(self._writer, return_exceptions=True)
+        # Зависшую запись в потоке не ждём — и хранилище под ней не закрываем
+        self._reader.shutdown(wait=written)
+        self._executor.shutdown(wait=written)
+        if written:
+            self._store.close()
+
+    def _mark_dirty(self, urgent: bool = False):
+        self._dirty_gen += 1
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self._write(self._take_batch())
+            self._written_gen = self._dirty_gen
+            return
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._write_loop(), name="state-writer")
+        if urgent:
+            self._urgent.set()
+        self._wake.set()
+
+    def _take_batch(self) -> _Batch:
+        subs = [self._subscriptions[chat].to_dict() for chat in self._dirty_subs if chat in self._subscriptions]
+        self._dirty_subs = set()
+        records, self._pending = self._pending, []
+        # Снимок нужен JSON лишь изредка (смена подписки, сворачивание журнала) — соберётся
+        # в потоке записи; здесь — только подписки, их мало
+        subscriptions = (
+            {chat: sub.to_dict() for chat, sub in self._subscriptions.items()}
+            if self._store.wants_snapshot else None
+        )
+        return _Batch(subs, records, subscriptions, self._dirty_gen)
+
+    def _write(self, batch: _Batch):
+        """Выполняется в потоке записи."""
+        started = time.monotonic()
+        self._store.write(batch.subs, batch.records, lambda: self._snapshot(batch.subscriptions))
+        metrics.STATE_WRITE_SECONDS.observe(time.monotonic() - started)
+
+    async def _write_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wake.wait()
+            if not self._urgent.is_set():
+                # Копим изменения; срочная запись прерывает ожидание
+                try:
+                    await asyncio.wait_for(self._urgent.wait(), config.STATE_WRITE_DELAY)
+                except asyncio.TimeoutError:
+                    pass
+            self._wake.clear()
+            self._urgent.clear()
+
+            batch = self._take_batch()
             try:
-                with open(config.STATE_FILE, "r") as f:
-                    self._state = json.load(f)
-            except (json.JSONDecodeError, KeyError):
-                # Если файл повреждён — стартуем заново
-                self._state = {"status": "reset", "stopped_at": None, "seen_ids": []}
-                self.save()
+                await loop.run_in_executor(self._executor, self._write, batch)
+            except Exception as e:
+                # Не записалось — возвращаем в грязные и пробуем снова чуть позже
+                metrics.STATE_WRITE_ERRORS.inc()
+                logger.error(f"Не удалось записать состояние, повтор: {e}")
+                self._last_error = e
+                self._pending[:0] = batch.records
+                self._dirty_subs.update(sub["chat_id"] for sub in batch.subs)
+                self._wake.set()
+                await asyncio.sleep(max(config.STATE_WRITE_DELAY, 1.0))
+                continue
 
-    def save(self):
-        with open(config.STATE_FILE, "w") as f:
-            json.dump(self._state, f, ensure_ascii=False, indent=2)
+            self._written_gen = batch.gen
+            self._last_error = None
+            async with self._written:
+                self._written.notify_all()
 
-    # ─── Статус ─────────────────────────────────────────────────────────
+    # ─── Подписки ───────────────────────────────────────────────────────
+
+    def subscription(self, chat_id: int) -> Subscription:
+        """Подписка чата; новому чату достаются категории из KUFAR_CATEGORIES."""
+        sub = self._subscriptions.get(chat_id)
+        if sub is None:
+            sub = Subscription(chat_id, categories=[c.id for c in config.KUFAR_CATEGORIES])
+            self._subscriptions[chat_id] = sub
+        return sub
+
+    def subscriptions(self) -> List[Subscription]:
+        return list(self._subscriptions.values())
+
+    def subscribers(self, category_id: int) -> List[Subscription]:
+        """Активные подписки, которые смотрят категорию."""
+        return [
+            sub for sub in self._subscriptions.values()
+            if sub.status == "active" and category_id in sub.categories
+        ]
+
+    def active_categories(self) -> Set[int]:
+        return {
+            cat for sub in self._subscriptions.values() if sub.status == "active"
+            for cat in sub.categories
+        }
 
     @property
-    def status(self) -> str:
-        return self._state["status"]
+    def any_active(self) -> bool:
+        return any(sub.status == "active" for sub in self._subscriptions.values())
+
+    # ─── Статус чата ────────────────────────────────────────────────────
+
+    def set_active(self, chat_id: int):
+        sub = self.subscription(chat_id)
+        sub.status = "active"
+        sub.stopped_at = None
+        sub.stop_cursors = {}
+        self._save_subscription(sub, urgent=True)
+
+    def set_stopped(self, chat_id: int):
+        sub = self.subscription(chat_id)
+        sub.status = "stopped"
+        sub.stopped_at = datetime.now(timezone.utc).isoformat()
+        sub.stop_cursors = {cat: self.seq(cat) for cat in sub.categories}
+        self._save_subscription(sub, urgent=True)
 
-    def set_active(self):
-        self._state["status"] = "active"
-        self._state["stopped_at"] = None
-        self.save()
+    def set_reset(self, chat_id: int):
+        sub = self.subscription(chat_id)
+        sub.status = "reset"
+        sub.stopped_at = None
+        sub.stop_cursors = {}
+        self._save_subscription(sub, urgent=True)
 
-    def set_stopped(self):
-        self._state["status"] = "stopped"
-        self._state["stopped_at"] = datetime.now(timezone.utc).isoformat()
-        self.save()
+    def watch(self, chat_id: int, category_id: int):
+        sub = self.subscription(chat_id)
+        if category_id not in sub.categories:
+            sub.categories.append(category_id)
+            if sub.status == "stopped":
+                sub.stop_cursors[category_id] = self.seq(category_id)
+            self._save_subscription(sub)
 
-    def set_reset(self):
-        self._state["status"] = "reset"
-        self._state["stopped_at"] = None
-        self._state["seen_ids"] = []
-        self.save()
+    def unwatch(self, chat_id: int, category_id: int):
+        sub = self.subscription(chat_id)
+        if category_id in sub.categories:
+            sub.categories.remove(category_id)
+            sub.filters.pop(category_id, None)
+            sub.stop_cursors.pop(category_id, None)
+            self._save_subscription(sub)
 
     # ─── Seen IDs ───────────────────────────────────────────────────────
 
-    def is_seen(self, ad_id: int) -> bool:
-        return ad_id in self._state["seen_ids"]
+    def _seen_for(self, category_id: int) -> SeenIds:
+        seen = self._seen.get(category_id)
+        if seen is None:
+            seen = self._seen[category_id] = SeenIds(config.SEEN_IDS_LIMIT)
+        return seen
 
-    def add_seen(self, ad_id: int):
-        if ad_id not in self._state["seen_ids"]:
-            self._state["seen_ids"].append(ad_id)
-            # Режим скольжащего окна — убираем старые ID
-            if len(self._state["seen_ids"]) > config.SEEN_IDS_LIMIT:
-                self._state["seen_ids"] = self._state["seen_ids"][-config.SEEN_IDS_LIMIT:]
-            self.save()
+    def has_seen(self, category_id: int) -> bool:
+        """Есть ли у категории хоть один виденный ID (т.е. была ли она уже просканирована)."""
+        return bool(self._seen.get(category_id))
 
-    # ─── Дата остановки ─────────────────────────────────────────────────
+    def is_seen(self, category_id: int, ad_id: int) -> bool:
+        """Только по памяти: последние SEEN_IDS_LIMIT ID плюс поднятые recall_seen."""
+        seen = self._seen.get(category_id)
+        return seen is not None and ad_id in seen
 
-    @property
-    def stopped_at(self) -> Optional[datetime]:
-        if self._state["stopped_at"]:
-            return datetime.fromisoformat(self._state["stopped_at"])
-        return None
+    async def recall_seen(self, category_id: int, ad_ids: List[int]):
+        """
+        Поднимает в память ID страницы, которые уже вытеснены из неё, но есть
+        в истории хранилища (объявление подняли в выдаче): один запрос на
+        страницу, в потоке чтения. После этого is_seen отвечает и за них.
+        """
+        seen = self._seen.get(category_id)
+        missing = [ad_id for ad_id in ad_ids if seen is None or ad_id not in seen]
+        if not missing:
+            return
+        loop = asyncio.get_running_loop()
+        found = await loop.run_in_executor(self._reader, self._store.seen_among, category_id, missing)
+        if found:
+            seen = self._seen_for(category_id)
+            with self._seen_lock:
+                for ad_id in found:
+                    seen.add(ad_id)
+
+    def add_seen(self, category_id: int, ad: Ad):
+        """Запоминает объявление в памяти. На запись уходит при flush_seen()."""
+        seen = self._seen_for(category_id)
+        with self._seen_lock:
+            added = seen.add(ad.id)
+            if added:
+                self._seq[category_id] = self._seq.get(category_id, 0) + 1
+        if added:
+            self._pending.append((category_id, ad, time.time()))
+
+    def seq(self, category_id: int) -> int:
+        """Сколько новых объявлений в категории найдено за всё время (монотонно растёт)."""
+        return self._seq.get(category_id, 0)
+
+    async def ads_since(self, category_id: int, since: datetime) -> Optional[List[Ad]]:
+        """Объявления категории, найденные после since; None — бэкенд не хранит историю."""
+        self.flush_seen()
+        await self.flush()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._reader, self._store.ads_since, category_id, since.timestamp())
+
+    # ─── Фильтры ────────────────────────────────────────────────────────
+
+    def set_filter(self, chat_id: int, category_id: int, ad_filter: AdFilter):
+        sub = self.subscription(chat_id)
+        if ad_filter.is_empty:
+            sub.filters.pop(category_id, None)
+        else:
+            sub.filters[category_id] = ad_filter
+        self._save_subscription(sub)
@@ -0,0 +1,394 @@
+"""
+Хранилище состояния бота.
+
+BotState держит всё рабочее в памяти и отдаёт запись сюда. Бэкенды:
+    JsonStorage    — снимок STATE_FILE + журнал SEEN_JOURNAL_FILE (как раньше)
+    SqliteStorage  — одна база STATE_DB_FILE в режиме WAL, плюс история
+                     объявлений (ID, заголовок, цена, когда впервые увиден)
+
+Бэкенд выбирается переменной STATE_BACKEND, см. open_storage().
+"""
+import json
+import logging
+import os
+import sqlite3
+from typing import Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+import config
+from parser import Ad
+
+logger = logging.getLogger(__name__)
+
+
+class Snapshot(NamedTuple):
+    """Полное состояние в сериализуемом виде."""
+    subscriptions: Dict[int, Dict]    # чат → Subscription.to_dict()
+    seen: Dict[int, List[int]]        # категория → виденные ID, от старых к новым
+    seq: Dict[int, int]               # категория → сколько новых объявлений найдено всего
+
+
+# (категория, объявление, unix-время, когда его впервые увидели)
+SeenRecord = Tuple[int, Ad, float]
+
+
+def empty_snapshot() -> Snapshot:
+    return Snapshot({}, {}, {})
+
+
+class Storage:
+    """
+    Интерфейс хранилища. Методы, которым может понадобиться полный снимок
+    (JSON пишет файл целиком), получают его лениво — функцией snapshot.
+
+    Пишущие методы (save, save_subscription, append_seen, write) BotState
+    вызывает из отдельного потока записи — по одному за раз; читающие
+    (seen_among, ads_since) — из отдельного потока чтения.
+    """
+
+    # Нужен ли write() полный снимок (снимок собирается в потоке записи, лениво)
+    wants_snapshot = False
+
+    def load(self) -> Snapshot:
+        raise NotImplementedError
+
+    def save(self, snapshot: Snapshot):
+        """Записывает полный снимок."""
+        raise NotImplementedError
+
+    def save_subscription(self, sub: Dict, snapshot: Callable[[], Snapshot]):
+        """Сохраняет изменённую подписку одного чата."""
+        raise NotImplementedError
+
+    def append_seen(self, records: List[SeenRecord], snapshot: Callable[[], Snapshot]):
+        """Дописывает новые объявления одного скана — одной записью на диск."""
+        raise NotImplementedError
+
+    def write(self, subs: List[Dict], records: List[SeenRecord], snapshot: Callable[[], Snapshot]):
+        """Всё, что накопилось с прошлой записи: изменённые подписки и новые объявления."""
+        for sub in subs:
+            self.save_subscription(sub, snapshot)
+        self.append_seen(records, snapshot)
+
+    def seen_among(self, category_id: int, ad_ids: List[int]) -> Set[int]:
+        """Какие из ID видели когда-либо (даже если они уже вытеснены из памяти)."""
+        return set()
+
+    def ads_since(self, category_id: int, since: float) -> Optional[List[Ad]]:
+        """Объявления категории, впервые увиденные после since; None — истории нет."""
+        return None
+
+    def close(self):
+        pass
+
+
+def open_storage() -> Storage:
+    if config.STATE_BACKEND == "json":
+        return JsonStorage()
+    return SqliteStorage()
+
+
+# ─── JSON ───────────────────────────────────────────────────────────────────
+
+class JsonStorage(Storage):
+    """
+    Снимок STATE_FILE (пишется атомарно через rename) и журнал новых ID
+    SEEN_JOURNAL_FILE (только дозапись, "<категория> <ID>"). Журнал
+    дописывается одним fsync на скан и сворачивается в новый снимок, когда
+    вырастает до SEEN_JOURNAL_COMPACT_EVERY строк.
+    """
+
+    wants_snapshot = True
+
+    def __init__(self, path: str = None, journal_path: str = None):
+        self._path = path or config.STATE_FILE
+        self._journal_path = journal_path or config.SEEN_JOURNAL_FILE
+        self._journal_lines = 0
+
+    def load(self) -> Snapshot:
+        snapshot = empty_snapshot()
+        if os.path.exists(self._path):
+            try:
+                with open(self._path, "r") as f:
+                    snapshot = _snapshot_from_json(json.load(f))
+            except (json.JSONDecodeError, KeyError, ValueError, TypeError, AttributeError) as e:
+                # Повреждённый файл не затираем молча — откладываем в сторону
+                broken = self._path + ".corrupt"
+                os.replace(self._path, broken)
+                logger.error(f"{self._path} повреждён ({e}), сохранён как {broken}; стартуем заново")
+                self.save(snapshot)
+                return snapshot
+
+        self._replay_journal(snapshot)
+        return snapshot
+
+    def _replay_journal(self, snapshot: Snapshot):
+        if not os.path.exists(self._journal_path):
+            return
+        known = {cat: set(ids) for cat, ids in snapshot.seen.items()}
+        with open(self._journal_path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                parts = line.split()
+                if len(parts) == 1:
+                    # Старый формат журнала — без категории
+                    parts.insert(0, config.KUFAR_CATEGORY_ID)
+                try:
+                    category_id, ad_id = int(parts[0]), int(parts[1])
+                except (ValueError, IndexError):
+                    # Недописанная строка после падения — пропускаем
+                    continue
+                ids = known.setdefault(category_id, set())
+                if ad_id not in ids:
+                    ids.add(ad_id)
+                    snapshot.seen.setdefault(category_id, []).append(ad_id)
+                    snapshot.seq[category_id] = snapshot.seq.get(category_id, 0) + 1
+                self._journal_lines += 1
+
+    def save(self, snapshot: Snapshot):
+        """Пишет полный снимок атомарно и обнуляет журнал."""
+        data = {
+            "subscriptions": {str(chat): sub for chat, sub in snapshot.subscriptions.items()},
+            "seen_ids": {str(cat): ids for cat, ids in snapshot.seen.items()},
+            "seq": {str(cat): n for cat, n in snapshot.seq.items()},
+        }
+
+        tmp_path = self._path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._path)
+
+        # Всё из журнала теперь в снимке
+        open(self._journal_path, "w").close()
+        self._journal_lines = 0
+
+    def save_subscription(self, sub: Dict, snapshot: Callable[[], Snapshot]):
+        self.save(snapshot())
+
+    def write(self, subs: List[Dict], records: List[SeenRecord], snapshot: Callable[[], Snapshot]):
+        # Подписки пишутся только полным снимком, а он покрывает и новые ID
+        if subs:
+            self.save(snapshot())
+        else:
+            self.append_seen(records, snapshot)
+
+    def append_seen(self, records: List[SeenRecord], snapshot: Callable[[], Snapshot]):
+        if not records:
+            return
+        with open(self._journal_path, "a") as f:
+            f.write("".join(f"{cat} {ad.id}\n" for cat, ad, _ in records))
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal_lines += len(records)
+
+        if self._journal_lines >= config.SEEN_JOURNAL_COMPACT_EVERY:
+            self.save(snapshot())
+
+
+def _snapshot_from_json(data: Dict) -> Snapshot:
+    seen_ids = data.get("seen_ids", {})
+    if isinstance(seen_ids, list):
+        # Старый формат — один общий список для KUFAR_CATEGORY_ID
+        seen_ids = {str(config.KUFAR_CATEGORY_ID): seen_ids}
+
+    if "subscriptions" in data:
+        subscriptions = {int(chat): sub for chat, sub in data["subscriptions"].items()}
+    elif config.TELEGRAM_CHAT_ID:
+        # Старый формат — одно состояние на весь бот, переносим в чат TELEGRAM_CHAT_ID
+        subscriptions = {config.TELEGRAM_CHAT_ID: {
+            "chat_id": config.TELEGRAM_CHAT_ID,
+            "categories": [c.id for c in config.KUFAR_CATEGORIES],
+            "status": data["status"],
+            "stopped_at": data["stopped_at"],
+            "filters": data.get("filters", {}),
+        }}
+    else:
+        subscriptions = {}
+
+    return Snapshot(
+        subscriptions=subscriptions,
+        seen={int(cat): [int(i) for i in ids] for cat, ids in seen_ids.items()},
+        seq={int(cat): int(n) for cat, n in data.get("seq", {}).items()},
+    )
+
+
+# ─── SQLite ─────────────────────────────────────────────────────────────────
+
+SCHEMA_VERSION = 2
+
+# Как довести базу прошлой версии до следующей
+UPGRADES = {
+    2: "ALTER TABLE ads ADD COLUMN list_time TEXT",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS subscriptions (
+    chat_id     INTEGER PRIMARY KEY,
+    data        TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ads (
+    category_id INTEGER NOT NULL,
+    ad_id       INTEGER NOT NULL,
+    title       TEXT,
+    price_byn   TEXT,
+    price_usd   TEXT,
+    region      INTEGER,
+    first_seen  REAL NOT NULL,
+    list_time   TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS ads_seen ON ads (category_id, ad_id);
+CREATE INDEX IF NOT EXISTS ads_first_seen ON ads (category_id, first_seen);
+CREATE TABLE IF NOT EXISTS seq (
+    category_id INTEGER PRIMARY KEY,
+    n           INTEGER NOT NULL
+);
+"""
+
+
+class SqliteStorage(Storage):
+    """
+    Состояние в SQLite (STATE_DB_FILE).
+
+    Режим WAL: запись скана — одна короткая транзакция, которая не
+    блокирует чтение и не может оставить базу полузаписанной. Таблица ads —
+    одновременно индекс виденных ID и полная история объявлений: в памяти
+    BotState держит только последние SEEN_IDS_LIMIT ID, остальное
+    проверяется запросом по индексу.
+
+    При первом открытии пустой базы в неё один раз переносится старый
+    STATE_FILE с журналом; файлы после этого переименовываются в *.migrated.
+
+    Соединений два: _conn читает из потока чтения, _wconn пишет из потока
+    записи. WAL позволяет им не ждать друг друга.
+    """
+
+    def __init__(self, path: str = None):
+        self._path = path or config.STATE_DB_FILE
+        # load() идёт из цикла событий при старте, дальше _conn — только поток чтения
+        self._conn = sqlite3.connect(self._path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._wconn = sqlite3.connect(self._path, check_same_thread=False)
+        # В WAL этого достаточно: падение процесса не теряет закоммиченное
+        self._wconn.execute("PRAGMA synchronous=NORMAL")
+
+    def load(self) -> Snapshot:
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        if version == 0:
+            self._migrate_from_json()
+        else:
+            self._upgrade(version)
+
+        snapshot = empty_snapshot()
+        for chat_id, data in self._conn.execute("SELECT chat_id, data FROM subscriptions"):
+            snapshot.subscriptions[chat_id] = json.loads(data)
+        for category_id, n in self._conn.execute("SELECT category_id, n FROM seq"):
+            snapshot.seq[category_id] = n
+        categories = [row[0] for row in self._conn.execute("SELECT DISTINCT category_id FROM ads")]
+        for category_id in categories:
+            rows = self._conn.execute(
+                "SELECT ad_id FROM ads WHERE category_id = ? ORDER BY rowid DESC LIMIT ?",
+                (category_id, config.SEEN_IDS_LIMIT),
+            ).fetchall()
+            snapshot.seen[category_id] = [row[0] for row in reversed(rows)]
+        return snapshot
+
+    def _migrate_from_json(self):
+        legacy = [p for p in (config.STATE_FILE, config.SEEN_JOURNAL_FILE) if os.path.exists(p)]
+        if legacy:
+            snapshot = JsonStorage().load()
+            self.save(snapshot, version=SCHEMA_VERSION)
+            for path in legacy:
+                os.replace(path, path + ".migrated")
+            seen = sum(len(ids) for ids in snapshot.seen.values())
+            logger.info(
+                f"Состояние перенесено в {self._path}: "
+                f"{len(snapshot.subscriptions)} подписок, {seen} виденных ID"
+            )
+        else:
+            with self._conn:
+                self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _upgrade(self, version: int):
+        for target in range(version + 1, SCHEMA_VERSION + 1):
+            with self._conn:
+                self._conn.execute(UPGRADES[target])
+                self._conn.execute(f"PRAGMA user_version = {target}")
+            logger.info(f"База {self._path} обновлена до версии {target}")
+
+    def save(self, snapshot: Snapshot, version: int = None):
+        """Заменяет всё содержимое снимком (одной транзакцией). История без данных объявлений."""
+        with self._wconn:
+            self._wconn.execute("DELETE FROM subscriptions")
+            self._wconn.execute("DELETE FROM seq")
+            self._wconn.execute("DELETE FROM ads")
+            self._wconn.executemany(
+                "INSERT INTO subscriptions (chat_id, data) VALUES (?, ?)",
+                [(chat, json.dumps(sub, ensure_ascii=False)) for chat, sub in snapshot.subscriptions.items()],
+            )
+            self._wconn.executemany(
+                "INSERT INTO seq (category_id, n) VALUES (?, ?)", list(snapshot.seq.items()),
+            )
+            # Время первого показа старых ID неизвестно — 0, в «новые с момента Стопа» не попадут
+            self._wconn.executemany(
+                "INSERT OR IGNORE INTO ads (category_id, ad_id, first_seen) VALUES (?, ?, 0)",
+                [(cat, ad_id) for cat, ids in snapshot.seen.items() for ad_id in ids],
+            )
+            if version is not None:
+                self._wconn.execute(f"PRAGMA user_version = {int(version)}")
+
+    def save_subscription(self, sub: Dict, snapshot: Callable[[], Snapshot]):
+        with self._wconn:
+            self._wconn.execute(
+                "INSERT OR REPLACE INTO subscriptions (chat_id, data) VALUES (?, ?)",
+                (sub["chat_id"], json.dumps(sub, ensure_ascii=False)),
+            )
+
+    def append_seen(self, records: List[SeenRecord], snapshot: Callable[[], Snapshot]):
+        if not records:
+            return
+        counts: Dict[int, int] = {}
+        for category_id, _, _ in records:
+            counts[category_id] = counts.get(category_id, 0) + 1
+        with self._wconn:
+            self._wconn.executemany(
+                "INSERT OR IGNORE INTO ads "
+                "(category_id, ad_id, title, price_byn, price_usd, region, list_time, first_seen) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (cat, ad.id, ad.title, ad.price_byn, ad.price_usd, ad.region, ad.list_time, seen_at)
+                    for cat, ad, seen_at in records
+                ],
+            )
+            self._wconn.executemany(
+                "INSERT INTO seq (category_id, n) VALUES (?, ?) "
+                "ON CONFLICT (category_id) DO UPDATE SET n = n + excluded.n",
+                list(counts.items()),
+            )
+
+    def seen_among(self, category_id: int, ad_ids: List[int]) -> Set[int]:
+        found: Set[int] = set()
+        # Не упираемся в лимит параметров SQLite (999 в старых сборках)
+        for start in range(0, len(ad_ids), 500):
+            chunk = ad_ids[start:start + 500]
+            rows = self._conn.execute(
+                f"SELECT ad_id FROM ads WHERE category_id = ? AND ad_id IN ({','.join('?' * len(chunk))})",
+                (category_id, *chunk),
+            )
+            found.update(row[0] for row in rows)
+        return found
+
+    def ads_since(self, category_id: int, since: float) -> Optional[List[Ad]]:
+        rows = self._conn.execute(
+            "SELECT ad_id, title, price_byn, price_usd, region, list_time FROM ads "
+            "WHERE category_id = ? AND first_seen > ? ORDER BY rowid",
+            (category_id, since),
+        )
+        return [Ad(*row) for row in rows]
+
+    def close(self):
+        self._conn.close()
+        self._wconn.close()
@@ -0,0 +1,29 @@
+from html.parser import HTMLParser
+
+from notifier import _format_ad
+from parser import Ad
+
+
+class _Tags(HTMLParser):
+    """Собирает теги и текст — так, как их увидит разбор parse_mode=HTML."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.tags = []
+        self.text = ""
+
+    def handle_starttag(self, tag, attrs):
+        self.tags.append(tag)
+
+    def handle_data(self, data):
+        self.text += data
+
+
+def test_format_ad_escapes_title():
+    ad = Ad(1, "Canon 5D <mark II> & объектив", price_byn="150000")
+    text = _format_ad(ad)
+
+    tags = _Tags()
+    tags.feed(text)
+    assert tags.tags == ["b", "a"]
+    assert "Canon 5D <mark II> & объектив" in tags.text
@@ -0,0 +1,111 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+import config
+import parser as kufar_parser
+from resilience import CircuitBreaker
+
+
+def _open_breaker(client: kufar_parser.KufarClient) -> CircuitBreaker:
+    """Предохранитель эндпоинта, уже дождавшийся пробного запроса (half-open)."""
+    breaker = CircuitBreaker(threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    client._breakers[kufar_parser.KUFAR_API_URL] = breaker
+    return breaker
+
+
+def test_cancelled_probe_does_not_keep_breaker_open():
+    async def run():
+        client = kufar_parser.KufarClient()
+        breaker = _open_breaker(client)
+
+        async def hang(params, validator=None):
+            await asyncio.sleep(3600)
+
+        client._request_once = hang
+        probe = asyncio.create_task(client._request({"cat": 5070}))
+        await asyncio.sleep(0)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+        page = kufar_parser._Page({"ads": []}, kufar_parser.PageValidator(), None)
+
+        async def healthy(params, validator=None):
+            return page
+
+        client._request_once = healthy
+        assert await client._request({"cat": 5070}) is page
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    asyncio.run(run())
+
+
+def test_probe_failing_outside_kufar_releases_probe():
+    async def run():
+        client = kufar_parser.KufarClient()
+        _open_breaker(client)
+
+        async def broken(params, validator=None):
+            raise RuntimeError("сломалось у нас")
+
+        client._request_once = broken
+        with pytest.raises(RuntimeError):
+            await client._request({"cat": 5070})
+        assert client._breakers[kufar_parser.KUFAR_API_URL].allow()
+
+    asyncio.run(run())
+
+
+class _Response:
+    """Ответ aiohttp ровно настолько, насколько его читает _request_once."""
+
+    def __init__(self, status: int, body: bytes):
+        self.status = status
+        self.headers = {}
+        self._body = body
+
+    async def read(self) -> bytes:
+        return self._body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class _Session:
+    def __init__(self, response: _Response):
+        self._response = response
+
+    def get(self, *args, **kwargs):
+        return self._response
+
+
+@pytest.mark.parametrize("body", [b"<html><body>captcha</body></html>", b"[1, 2, 3]"])
+def test_non_json_200_is_kufar_error(body):
+    async def run():
+        client = kufar_parser.KufarClient()
+        client._session = _Session(_Response(200, body))
+        with pytest.raises(kufar_parser.KufarBadPayload):
+            await client._request_once({"cat": 5070})
+
+    asyncio.run(run())
+
+
+def test_fingerprint_sees_price_change_below_first_ten_ads():
+    path = os.path.join(os.path.dirname(__file__), "..", "bench", "fixtures", "search_5070_page1.json")
+    with open(path, "rb") as f:
+        raw = f.read()
+    data = json.loads(raw)
+    assert len(data["ads"]) > 15
+    ad = data["ads"][14]
+    ad["price_byn"] = str(int(ad["price_byn"]) + 10000)
+
+    original = kufar_parser._fingerprint(json.dumps(json.loads(raw)).encode())
+    assert kufar_parser._fingerprint(json.dumps(data).encode()) != original
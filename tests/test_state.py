@@ -0,0 +1,45 @@
+import asyncio
+
+import config
+from parser import Ad
+from state import BotState
+from storage import JsonStorage, SqliteStorage
+
+
+def test_recall_seen_reads_evicted_ids_from_history(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "SEEN_IDS_LIMIT", 2)
+    path = str(tmp_path / "state.db")
+
+    async def run():
+        state = BotState(SqliteStorage(path))
+        for ad_id in (1, 2, 3):
+            state.add_seen(5070, Ad(ad_id, f"t{ad_id}"))
+        state.flush_seen()
+        await state.close()
+
+        state = BotState(SqliteStorage(path))
+        assert not state.is_seen(5070, 1)
+        await state.recall_seen(5070, [1, 3, 4])
+        assert state.is_seen(5070, 1)
+        assert state.is_seen(5070, 3)
+        assert not state.is_seen(5070, 4)
+        await state.close()
+
+    asyncio.run(run())
+
+
+def test_json_snapshot_is_built_in_writer_thread(tmp_path):
+    storage = JsonStorage(str(tmp_path / "state.json"), str(tmp_path / "seen.log"))
+
+    async def run():
+        state = BotState(storage)
+        state.watch(1, 5010)
+        state.add_seen(5070, Ad(7, "t"))
+        state.flush_seen()
+        await state.flush()
+        await state.close()
+
+    asyncio.run(run())
+    snapshot = JsonStorage(str(tmp_path / "state.json"), str(tmp_path / "seen.log")).load()
+    assert 1 in snapshot.subscriptions
+    assert snapshot.seen[5070] == [7]
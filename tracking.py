@@ -0,0 +1,137 @@
+"""
+Отслеживание изменений объявлений между сканами: снижение цены и
+перевыкладка (то же объявление тем же продавцом под новым ID).
+
+Про каждое встреченное объявление хранится компактный снимок — 16 байт
+(цена, хэш заголовка, продавец, когда видели последний раз). Хранилище
+ограничено по размеру (LRU, TRACK_MAX_ADS) и по времени (TTL,
+TRACK_TTL_DAYS) и живёт только в памяти: после рестарта снимки
+набираются заново.
+"""
+import re
+import struct
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+import config
+import metrics
+from parser import Ad
+
+# цена, хэш заголовка, продавец, unix-время последней встречи — всё uint32
+_SNAPSHOT = struct.Struct("<IIII")
+_UINT32_MAX = 0xFFFFFFFF
+
+_SPACES_RE = re.compile(r"\s+")
+
+
+@dataclass
+class AdEvent:
+    """
+    Событие по объявлению:
+        price_drop — цена снизилась (old_price — прежняя)
+        relist     — похоже на перевыкладку previous_id (old_price — его цена)
+    """
+    kind: str
+    ad: Ad
+    old_price: int
+    previous_id: Optional[int] = None
+
+    def to_dict(self) -> Dict:
+        return {"kind": self.kind, "old_price": self.old_price, "previous_id": self.previous_id}
+
+    @classmethod
+    def from_dict(cls, data: Dict, ad: Ad) -> "AdEvent":
+        return cls(data["kind"], ad, int(data["old_price"]), data.get("previous_id"))
+
+
+class AdTracker:
+    """
+    Снимки объявлений и их сравнение со свежим сканом.
+
+    Снимки — dict ID → упакованные 16 байт; порядок вставки в dict и есть
+    порядок LRU (встреченное объявление переставляется в конец), так что
+    вытеснение по размеру и по TTL — это снятие элементов с начала.
+    Второй индекс — (продавец, хэш заголовка) → ID — находит перевыкладки.
+    """
+
+    def __init__(self, capacity: int = None, ttl: float = None):
+        self._capacity = capacity or config.TRACK_MAX_ADS
+        self._ttl = ttl if ttl is not None else config.TRACK_TTL_DAYS * 86400
+        self._drop_ratio = 1 - config.TRACK_PRICE_DROP_PCT / 100
+        self._snapshots: Dict[int, bytes] = {}
+        self._by_item: Dict[int, int] = {}     # (продавец << 32 | хэш заголовка) → ID
+        metrics.TRACKED_ADS.set_function(lambda: len(self._snapshots))
+
+    def __len__(self) -> int:
+        return len(self._snapshots)
+
+    def __contains__(self, ad_id: int) -> bool:
+        return ad_id in self._snapshots
+
+    def diff(self, ads: Iterable[Ad], now: float = None) -> List[AdEvent]:
+        """
+        Сравнивает объявления скана со снимками за один проход, обновляет
+        снимки и возвращает события. Первая встреча объявления событий не даёт,
+        кроме случая, когда это перевыкладка уже известного.
+        """
+        now = time.time() if now is None else now
+        stamp = min(int(now), _UINT32_MAX)
+        snapshots, by_item = self._snapshots, self._by_item
+        unpack, pack = _SNAPSHOT.unpack, _SNAPSHOT.pack
+        events = []
+
+        for ad in ads:
+            price = _price(ad)
+            title_hash = _title_hash(ad.title)
+            seller = ad.seller_id if ad.seller_id and ad.seller_id <= _UINT32_MAX else 0
+            item_key = (seller << 32 | title_hash) if seller else None
+
+            old = snapshots.pop(ad.id, None)
+            if old is not None:
+                old_price = unpack(old)[0]
+                if price and old_price and price <= old_price * self._drop_ratio:
+                    events.append(AdEvent("price_drop", ad, old_price))
+            elif item_key is not None:
+                previous_id = by_item.get(item_key)
+                previous = snapshots.get(previous_id) if previous_id is not None else None
+                if previous is not None:
+                    events.append(AdEvent("relist", ad, unpack(previous)[0], previous_id))
+
+            snapshots[ad.id] = pack(price, title_hash, seller, stamp)
+            if item_key is not None:
+                by_item[item_key] = ad.id
+
+        self._evict(stamp)
+        for event in events:
+            metrics.TRACK_EVENTS.inc(kind=event.kind)
+        return events
+
+    def _evict(self, now: int):
+        """Снимает с начала (давно не встречавшиеся) — сверх лимита и старше TTL."""
+        snapshots, by_item = self._snapshots, self._by_item
+        deadline = now - self._ttl
+        while snapshots:
+            ad_id = next(iter(snapshots))
+            _, title_hash, seller, seen_at = _SNAPSHOT.unpack(snapshots[ad_id])
+            if len(snapshots) <= self._capacity and seen_at >= deadline:
+                break
+            del snapshots[ad_id]
+            if seller:
+                item_key = seller << 32 | title_hash
+                if by_item.get(item_key) == ad_id:
+                    del by_item[item_key]
+
+
+def _price(ad: Ad) -> int:
+    """Цена в BYN как число (0 — не указана / договорная)."""
+    try:
+        return min(int(float(ad.price_byn or 0)), _UINT32_MAX)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _title_hash(title: Optional[str]) -> int:
+    normalized = _SPACES_RE.sub(" ", (title or "").strip().lower())
+    return zlib.crc32(normalized.encode("utf-8"))